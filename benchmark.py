@@ -0,0 +1,336 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import rasterio
+import sklearn
+from affine import Affine
+from rasterio.windows import Window
+
+import muestras
+import muestreo
+import regresion
+from calibracion import MODELOS, aplicar_calibracion_lineal, aplicar_modelo, crear_modelo
+from indices import ARCHIVOS_SALIDA, calcular_indices
+from nucleos import FACTOR_REFLECTANCIA, PRECISIONES
+
+# --- 1. CONFIGURACIÓN ---
+# Carpeta donde se guardan los resultados (un JSON por ejecución)
+ruta_resultados = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resultados_benchmark')
+
+# Lados de las escenas sintéticas, en píxeles: de 1k² hasta el tile completo de Sentinel-2 a 10 m
+tamanos = [1024, 2048, 4096, 10980]
+
+# Malla de las escenas: UTM 17S con el origen del tile 17LQL
+CRS_SINTETICO = 'EPSG:32717'
+ORIGEN_SINTETICO = (699960.0, 9100000.0)
+RESOLUCION = 10.0
+
+# Bandas que se generan y nombre de archivo como en la carpeta R10m
+BANDAS = ('B04', 'B08', 'B11')
+
+# Etapas medidas, en el orden en que se ejecutan (cada una usa los productos de las anteriores)
+ETAPAS = ('indices', 'ingreso_muestras', 'muestreo', 'ajuste_lineal', 'ajuste_modelo', 'ajuste_zonas',
+          'calibracion_lineal', 'aplicar_modelo', 'mapa')
+
+# Diferencia relativa de tiempo a partir de la cual --comparar marca una etapa
+TOLERANCIA_COMPARACION = 0.10
+
+# Línea con la que el proceso de mapa.py devuelve su pico de memoria
+MARCA_MEMORIA = 'BENCHMARK_MEMORIA_PICO='
+
+
+def generar_bandas(directorio, lado, semilla=0):
+    """
+    Escribe bandas uint16 con el aspecto de Sentinel-2 L2A (B04, B08, B11) de `lado` × `lado` píxeles.
+
+    La reflectancia combina un gradiente suave (campos, costa) con ruido, y la
+    esquina inferior derecha queda a 0 como el borde sin dato de un tile. Se
+    escribe por franjas, así que la memoria no depende del tamaño.
+    """
+    generador = np.random.default_rng(semilla)
+    perfil = {'driver': 'GTiff', 'dtype': 'uint16', 'count': 1, 'width': lado, 'height': lado,
+              'crs': CRS_SINTETICO, 'nodata': 0,
+              'transform': Affine(RESOLUCION, 0, ORIGEN_SINTETICO[0], 0, -RESOLUCION, ORIGEN_SINTETICO[1])}
+    # Reflectancia media y amplitud de cada banda (suelo desnudo con algo de vegetación)
+    parametros = {'B04': (0.12, 0.06), 'B08': (0.25, 0.12), 'B11': (0.28, 0.08)}
+    rutas = {banda: os.path.join(directorio, f'T17LQL_SINTETICO_{banda}_10m.tif') for banda in BANDAS}
+
+    destinos = {banda: rasterio.open(ruta, 'w', **perfil) for banda, ruta in rutas.items()}
+    try:
+        cols = np.arange(lado) / lado
+        for fila in range(0, lado, 512):
+            alto = min(512, lado - fila)
+            filas = (np.arange(fila, fila + alto) / lado)[:, np.newaxis]
+            patron = np.sin(6 * np.pi * cols)[np.newaxis, :] * np.cos(4 * np.pi * filas)
+            sin_dato = (filas + cols[np.newaxis, :]) > 1.8
+            for banda, (media, amplitud) in parametros.items():
+                reflectancia = media + amplitud * patron + generador.normal(0, 0.01, (alto, lado))
+                valores = np.clip(reflectancia * FACTOR_REFLECTANCIA, 1, 10000).astype(np.uint16)
+                valores[sin_dato] = 0
+                destinos[banda].write(valores, 1, window=Window(0, fila, lado, alto))
+    finally:
+        for dst in destinos.values():
+            dst.close()
+    return rutas
+
+
+def generar_muestras(ruta_excel, lado, n_muestras, semilla=0):
+    """Excel de campo sintético (CoorEste, CoorNorte, CE, Ubicacion) con puntos dentro de la escena."""
+    generador = np.random.default_rng(semilla)
+    x0, y0 = ORIGEN_SINTETICO
+    extension = lado * RESOLUCION
+    xs = x0 + generador.uniform(0, extension, n_muestras)
+    ys = y0 - generador.uniform(0, extension, n_muestras)
+    tabla = pd.DataFrame({
+        'CoorEste': xs.round(2),
+        'CoorNorte': ys.round(2),
+        'CE': generador.lognormal(7, 0.6, n_muestras).round(1),
+        'Ubicacion': np.where(ys < y0 - extension / 2, 'costa', 'tierra_adentro'),
+    })
+    tabla.to_excel(ruta_excel, index=False)
+
+
+def medir(funcion):
+    """Ejecuta `funcion` y devuelve (resultado, segundos, pico de memoria en MB según tracemalloc)."""
+    tracemalloc.start()
+    try:
+        inicio = time.perf_counter()
+        resultado = funcion()
+        segundos = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return resultado, segundos, pico / 1024 ** 2
+
+
+def ejecutar_mapa(ruta_raster, ruta_html):
+    """
+    Ejecuta mapa.py en un proceso aparte sobre `ruta_raster`.
+
+    mapa.py es un script (configura el entorno y lee argumentos al importarlo),
+    así que se lanza con un intérprete nuevo que mide su propio pico de memoria.
+    """
+    ruta_mapa = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mapa.py')
+    codigo = (
+        "import runpy, sys, tracemalloc\n"
+        "tracemalloc.start()\n"
+        f"sys.argv = [{ruta_mapa!r}, '--raster', {ruta_raster!r}, '--salida', {ruta_html!r}]\n"
+        f"runpy.run_path({ruta_mapa!r}, run_name='__main__')\n"
+        f"print({MARCA_MEMORIA!r} + str(tracemalloc.get_traced_memory()[1]))\n"
+    )
+    inicio = time.perf_counter()
+    proceso = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True,
+                             cwd=os.path.dirname(ruta_mapa))
+    segundos = time.perf_counter() - inicio
+    lineas = proceso.stdout.splitlines()
+    pico = next((int(linea[len(MARCA_MEMORIA):]) for linea in lineas if linea.startswith(MARCA_MEMORIA)), None)
+    if proceso.returncode != 0 or pico is None or not os.path.exists(ruta_html):
+        raise RuntimeError(f"mapa.py no generó el mapa: {(proceso.stderr or proceso.stdout).strip()[-500:]}")
+    return segundos, pico / 1024 ** 2
+
+
+def medir_escena(directorio, lado, args, resultados):
+    """Genera una escena sintética y mide cada etapa, añadiendo cada medida a `resultados`."""
+    print(f"Escena sintética de {lado} × {lado} píxeles...")
+    rutas_bandas = generar_bandas(directorio, lado, args.semilla)
+    ruta_excel = os.path.join(directorio, 'Datos_CE_sintetico.xlsx')
+    generar_muestras(ruta_excel, lado, args.muestras, args.semilla)
+
+    rutas_indices = {indice: os.path.join(directorio, archivo) for indice, archivo in ARCHIVOS_SALIDA.items()}
+    caracteristicas = list(rutas_indices)
+    estado = {}
+
+    def indices():
+        calcular_indices(rutas_bandas, rutas_indices, workers=args.workers, precision=args.precision,
+                         usar_cache=False)
+
+    def ingreso_muestras():
+        # Cada repetición ingresa el Excel desde cero en un almacén nuevo
+        almacen = os.path.join(directorio, 'muestras_campo')
+        shutil.rmtree(almacen, ignore_errors=True)
+        estado['muestras'] = muestras.cargar_excel(ruta_excel, directorio=almacen)
+
+    def muestreo_puntos():
+        tabla = estado['muestras']
+        valores = muestreo.muestrear_varios([rutas_indices[nombre] for nombre in caracteristicas],
+                                            tabla['x'].to_numpy(), tabla['y'].to_numpy(),
+                                            metodo=args.muestreo, vecindad=args.vecindad)
+        validos = np.isfinite(valores).all(axis=1)
+        estado['X'], estado['y'] = valores[validos], tabla['ce'].to_numpy()[validos]
+        estado['ubicacion'] = tabla['ubicacion'].to_numpy()[validos]
+
+    def ajuste_lineal():
+        estado['lineal'] = crear_modelo('lineal').fit(estado['X'][:, :1], estado['y'])
+
+    def ajuste_modelo():
+        estado['modelo'] = crear_modelo(args.modelo).fit(estado['X'], estado['y'])
+
+    def ajuste_zonas():
+        # Una recta por zona e índice, con intervalos bootstrap, en una sola pasada agrupada
+        tabla = pd.DataFrame(estado['X'], columns=caracteristicas)
+        tabla['ce'], tabla['ubicacion'] = estado['y'], estado['ubicacion']
+        regresion.ajustar_tabla(tabla, caracteristicas, 'ce', 'ubicacion', intervalos='bootstrap')
+
+    def calibracion_lineal():
+        lineal = estado['lineal']
+        aplicar_calibracion_lineal(rutas_indices['SSI'], os.path.join(directorio, 'SSI_calibrado.tiff'),
+                                   lineal.coef_[0], lineal.intercept_, workers=args.workers,
+                                   precision=args.precision, usar_cache=False)
+
+    def aplicar():
+        aplicar_modelo(rutas_indices, os.path.join(directorio, 'CE_modelo.tiff'), estado['modelo'],
+                       workers=args.workers, usar_cache=False)
+
+    funciones = {
+        'indices': indices,
+        'ingreso_muestras': ingreso_muestras,
+        'muestreo': muestreo_puntos,
+        'ajuste_lineal': ajuste_lineal,
+        'ajuste_modelo': ajuste_modelo,
+        'ajuste_zonas': ajuste_zonas,
+        'calibracion_lineal': calibracion_lineal,
+        'aplicar_modelo': aplicar,
+    }
+
+    for etapa in ETAPAS:
+        if etapa not in args.etapas:
+            # Las etapas no pedidas se ejecutan una vez sin medir si otras dependen de ellas
+            if etapa in funciones and any(ETAPAS.index(e) > ETAPAS.index(etapa) for e in args.etapas):
+                funciones[etapa]()
+            continue
+        tiempos, memorias = [], []
+        for _ in range(args.repeticiones):
+            if etapa == 'mapa':
+                ruta_html = os.path.join(directorio, 'mapa.html')
+                if os.path.exists(ruta_html):
+                    os.remove(ruta_html)
+                segundos, memoria = ejecutar_mapa(os.path.join(directorio, 'SSI_calibrado.tiff'), ruta_html)
+            else:
+                _, segundos, memoria = medir(funciones[etapa])
+            tiempos.append(segundos)
+            memorias.append(memoria)
+        resultados.append({
+            'tamano': lado,
+            'etapa': etapa,
+            'segundos': round(min(tiempos), 4),
+            'tiempos': [round(t, 4) for t in tiempos],
+            'memoria_pico_mb': round(max(memorias), 1),
+            'megapixeles_por_segundo': round(lado * lado / 1e6 / min(tiempos), 2),
+        })
+        print(f"  {etapa:<20} {min(tiempos):9.3f} s  {max(memorias):9.1f} MB")
+
+
+def entorno():
+    """Versiones y máquina, para saber qué se está comparando."""
+    try:
+        version = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        version = None
+    return {
+        'commit': version,
+        'python': platform.python_version(),
+        'sistema': platform.platform(),
+        'procesador': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'rasterio': rasterio.__version__,
+        'gdal': rasterio.__gdal_version__,
+        'scikit-learn': sklearn.__version__,
+    }
+
+
+def comparar(resultados, ruta_anterior):
+    """Imprime, etapa por etapa, cuánto cambian tiempo y memoria respecto a un JSON anterior."""
+    with open(ruta_anterior, encoding='utf-8') as f:
+        anterior = json.load(f)
+    previos = {(r['tamano'], r['etapa']): r for r in anterior['resultados']}
+    print(f"--- Comparación con {ruta_anterior} (commit {anterior['entorno'].get('commit')}) ---")
+    for resultado in resultados:
+        previo = previos.get((resultado['tamano'], resultado['etapa']))
+        if previo is None:
+            continue
+        cambio = resultado['segundos'] / previo['segundos'] - 1 if previo['segundos'] else 0.0
+        marca = ''
+        if cambio > TOLERANCIA_COMPARACION:
+            marca = '  <-- más lento'
+        elif cambio < -TOLERANCIA_COMPARACION:
+            marca = '  <-- más rápido'
+        print(f"  {resultado['tamano']:>6} {resultado['etapa']:<20} {previo['segundos']:9.3f} s -> "
+              f"{resultado['segundos']:9.3f} s ({cambio:+.0%}), memoria {previo['memoria_pico_mb']:.1f} -> "
+              f"{resultado['memoria_pico_mb']:.1f} MB{marca}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mide tiempo y memoria de la cadena completa con datos sintéticos.')
+    parser.add_argument('--tamanos', nargs='+', type=int, default=tamanos,
+                        help='Lados de las escenas sintéticas en píxeles (por defecto 1024 2048 4096 10980).')
+    parser.add_argument('--etapas', nargs='+', choices=ETAPAS, default=list(ETAPAS), help='Etapas a medir.')
+    parser.add_argument('--repeticiones', type=int, default=1,
+                        help='Veces que se mide cada etapa; se guarda el menor tiempo (por defecto 1).')
+    parser.add_argument('--workers', type=int, default=1, help='Hilos de cálculo (por defecto 1).')
+    parser.add_argument('--precision', choices=PRECISIONES, default='exacta')
+    parser.add_argument('--modelo', choices=MODELOS, default='gradiente',
+                        help="Regresor de las etapas 'ajuste_modelo' y 'aplicar_modelo' (por defecto gradiente).")
+    parser.add_argument('--muestras', type=int, default=500, help='Puntos de campo sintéticos (por defecto 500).')
+    muestreo.agregar_argumentos(parser)
+    parser.add_argument('--semilla', type=int, default=0, help='Semilla de los datos sintéticos.')
+    parser.add_argument('--directorio', default=None,
+                        help='Carpeta de trabajo para los datos sintéticos (por defecto una temporal que se borra).')
+    parser.add_argument('--salida', default=None,
+                        help='Ruta del JSON de resultados (por defecto resultados_benchmark/benchmark_<fecha>.json).')
+    parser.add_argument('--comparar', default=None, help='JSON de una ejecución anterior con el que comparar.')
+    args = parser.parse_args()
+
+    if args.repeticiones < 1:
+        parser.error('--repeticiones debe ser al menos 1.')
+
+    fecha = datetime.now()
+    ruta_salida = args.salida or os.path.join(ruta_resultados, f"benchmark_{fecha:%Y%m%d_%H%M%S}.json")
+    informe = {
+        'fecha': fecha.isoformat(timespec='seconds'),
+        'entorno': entorno(),
+        'parametros': {'tamanos': args.tamanos, 'etapas': args.etapas, 'repeticiones': args.repeticiones,
+                       'workers': args.workers, 'precision': args.precision, 'modelo': args.modelo,
+                       'muestras': args.muestras, 'muestreo': args.muestreo, 'semilla': args.semilla},
+        # tracemalloc cuenta la memoria de Python y NumPy, no la caché interna de GDAL
+        'medicion_memoria': 'tracemalloc',
+        'resultados': [],
+    }
+
+    # --- 2. MEDICIÓN POR TAMAÑO DE ESCENA ---
+    for lado in args.tamanos:
+        directorio = os.path.join(args.directorio, f'escena_{lado}') if args.directorio else tempfile.mkdtemp(
+            prefix=f'benchmark_{lado}_')
+        os.makedirs(directorio, exist_ok=True)
+        try:
+            medir_escena(directorio, lado, args, informe['resultados'])
+        except Exception as e:
+            print(f"Ocurrió un error con la escena de {lado} píxeles: {e}")
+        finally:
+            if not args.directorio:
+                shutil.rmtree(directorio, ignore_errors=True)
+
+    # --- 3. RESULTADOS ---
+    os.makedirs(os.path.dirname(os.path.abspath(ruta_salida)), exist_ok=True)
+    with open(ruta_salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en: {ruta_salida}")
+
+    if args.comparar:
+        comparar(informe['resultados'], args.comparar)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+import math
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+
+import escritura
+import estadisticas
+import validez
+from instrumentacion import parcial
+
+# Filas aproximadas por ventana cuando el GeoTIFF está organizado en tiras (strips)
+FILAS_POR_VENTANA = 512
+
+# Métodos para llevar las bandas de menor resolución (p. ej. B11 a 20 m) a la rejilla de 10 m
+REMUESTREOS = {
+    'cercano': Resampling.nearest,
+    'bilineal': Resampling.bilinear,
+    'cubico': Resampling.cubic,
+    'cubico_spline': Resampling.cubic_spline,
+    'lanczos': Resampling.lanczos,
+}
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos de la lectura de las bandas."""
+    parser.add_argument('--remuestreo', choices=list(REMUESTREOS), default='cercano',
+                        help='Cómo se llevan a la rejilla de 10 m las bandas de menor resolución '
+                             "(p. ej. B11 a 20 m); por defecto 'cercano'.")
+
+
+def ventanas(src, tamano_ventana=None):
+    """
+    Genera las ventanas de lectura/escritura de un raster.
+
+    Si el archivo está teselado se recorren sus bloques internos; si está en tiras
+    se agrupan tiras completas hasta unas FILAS_POR_VENTANA filas. Con
+    `tamano_ventana` se usan ventanas cuadradas de ese lado.
+    """
+    if tamano_ventana is None:
+        alto_bloque, ancho_bloque = src.block_shapes[0]
+        if ancho_bloque < src.width:
+            for _, ventana in src.block_windows(1):
+                yield ventana
+            return
+        paso_filas = alto_bloque * max(1, FILAS_POR_VENTANA // alto_bloque)
+        for fila in range(0, src.height, paso_filas):
+            yield Window(0, fila, src.width, min(paso_filas, src.height - fila))
+        return
+
+    for fila in range(0, src.height, tamano_ventana):
+        for col in range(0, src.width, tamano_ventana):
+            yield Window(col, fila,
+                         min(tamano_ventana, src.width - col),
+                         min(tamano_ventana, src.height - fila))
+
+
+def rejilla(src):
+    """Rejilla de un raster: (crs, transformación, ancho, alto)."""
+    return src.crs, src.transform, src.width, src.height
+
+
+def misma_rejilla(a, b):
+    """True si dos rejillas coinciden (la transformación, salvo redondeo)."""
+    return a[0] == b[0] and a[2:] == b[2:] and a[1].almost_equals(b[1])
+
+
+def entrada_referencia(fuentes):
+    """
+    Entrada cuya rejilla se usa para el cálculo: la de mayor resolución.
+
+    Todas deben cubrir la misma zona en el mismo CRS (con tolerancia de medio
+    píxel de la referencia); si no, lanza ValueError.
+    """
+    referencia = min(fuentes.values(), key=lambda src: abs(src.transform.a * src.transform.e))
+    tolerancia = abs(referencia.transform.a) / 2
+    for nombre, src in fuentes.items():
+        if src.crs != referencia.crs:
+            raise ValueError(f"La banda '{nombre}' no está en el mismo CRS que la referencia "
+                             f"({src.crs} frente a {referencia.crs}).")
+        if any(abs(a - b) > tolerancia for a, b in zip(src.bounds, referencia.bounds)):
+            raise ValueError(
+                f"La banda '{nombre}' no tiene las mismas dimensiones que la referencia "
+                f"({src.width}x{src.height} frente a {referencia.width}x{referencia.height}) "
+                f"ni cubre la misma zona."
+            )
+    return referencia
+
+
+def abrir_en_rejilla(ruta, pila, rejilla_destino=None, remuestreo='cercano'):
+    """
+    Abre `ruta` para leerla en `rejilla_destino`; se cierra al cerrar `pila` (ExitStack).
+
+    Si el raster ya está en esa rejilla se devuelve tal cual; si no (p. ej. una
+    banda de 20 m, GeoTIFF o JP2 de un SAFE), se devuelve un WarpedVRT que la
+    remuestrea al vuelo: cada lectura de ventana remuestrea solo esa ventana y
+    no se crea ningún archivo intermedio.
+    """
+    if remuestreo not in REMUESTREOS:
+        raise ValueError(f"Remuestreo no válido: '{remuestreo}' (opciones: {', '.join(REMUESTREOS)})")
+    # Se registra `close` y no el context manager: al entrar, el dataset activa un entorno de GDAL
+    # del hilo que lo abre, y los lectores se cierran desde el hilo principal
+    src = rasterio.open(ruta)
+    pila.callback(src.close)
+    if rejilla_destino is None or misma_rejilla(rejilla(src), rejilla_destino):
+        return src
+    crs, transformacion, ancho, alto = rejilla_destino
+    # WarpedVRT necesita un entorno de GDAL activo al crearse, y en los hilos de cálculo no lo hay
+    with rasterio.Env():
+        vrt = WarpedVRT(src, crs=crs, transform=transformacion, width=ancho, height=alto,
+                        resampling=REMUESTREOS[remuestreo])
+    pila.callback(vrt.close)
+    return vrt
+
+
+def perfil_indice(perfil_base):
+    """
+    Perfil de salida de los índices: una banda float32 en GTiff con nodata NaN.
+
+    Los núcleos ya escriben NaN en los píxeles sin dato; el nodata de las bandas
+    (0 en L2A) no se hereda, porque en un índice 0 es un valor como otro cualquiera.
+    """
+    perfil_salida = perfil_base.copy()
+    if perfil_salida.get('driver') != 'GTiff':
+        # Las opciones de bloques de otros formatos (p. ej. JP2 de un SAFE) no sirven para el GeoTIFF de salida
+        for clave in ('blockxsize', 'blockysize', 'tiled', 'compress', 'interleave'):
+            perfil_salida.pop(clave, None)
+    perfil_salida.update(
+        dtype=rasterio.float32,
+        count=1,
+        driver='GTiff',
+        nodata=np.nan
+    )
+    return perfil_salida
+
+
+class _LectorVentanas:
+    """
+    Lee una ventana de todas las entradas y le aplica `funcion`.
+
+    Con `con_ventana`, `funcion` recibe también la ventana como segundo argumento
+    (p. ej. para calcular coordenadas). Cada hilo abre sus propios datasets (los objetos de rasterio no se deben
+    compartir entre hilos); en un proceso hijo hay un único lector por proceso.
+    Con `rejilla_destino`, las entradas en otra rejilla se leen remuestreadas (ver `abrir_en_rejilla`).
+    """
+
+    def __init__(self, rutas_entrada, funcion, con_ventana=False, rejilla_destino=None, remuestreo='cercano'):
+        self.rutas_entrada = rutas_entrada
+        self.funcion = funcion
+        self.con_ventana = con_ventana
+        self.rejilla_destino = rejilla_destino
+        self.remuestreo = remuestreo
+        self._local = threading.local()
+        self._abiertos = []
+        self._cerrojo = threading.Lock()
+
+    def _fuentes(self):
+        fuentes = getattr(self._local, 'fuentes', None)
+        if fuentes is None:
+            pila = ExitStack()
+            fuentes = {nombre: abrir_en_rejilla(ruta, pila, self.rejilla_destino, self.remuestreo)
+                       for nombre, ruta in self.rutas_entrada.items()}
+            self._local.fuentes = fuentes
+            with self._cerrojo:
+                self._abiertos.append(pila)
+        return fuentes
+
+    def __call__(self, ventana):
+        with parcial('lectura') as tramo:
+            datos = {nombre: src.read(1, window=ventana) for nombre, src in self._fuentes().items()}
+            tramo.bytes = sum(valores.nbytes for valores in datos.values())
+        with parcial('calculo'):
+            if self.con_ventana:
+                return self.funcion(datos, ventana)
+            return self.funcion(datos)
+
+    def cerrar(self):
+        with self._cerrojo:
+            for pila in self._abiertos:
+                pila.close()
+            self._abiertos.clear()
+
+    def __getstate__(self):
+        return {'rutas_entrada': self.rutas_entrada, 'funcion': self.funcion, 'con_ventana': self.con_ventana,
+                'rejilla_destino': self.rejilla_destino, 'remuestreo': self.remuestreo}
+
+    def __setstate__(self, estado):
+        self.__init__(**estado)
+
+
+_lector_proceso = None
+
+
+def _iniciar_proceso(lector):
+    global _lector_proceso
+    _lector_proceso = lector
+
+
+def _procesar_en_proceso(ventana):
+    return _lector_proceso(ventana)
+
+
+def resultados_por_ventana(rutas_entrada, funcion, lista_ventanas, workers=1, usar_procesos=False,
+                           con_ventana=False, rejilla_destino=None, remuestreo='cercano'):
+    """
+    Devuelve (ventana, resultados) para cada ventana, en el mismo orden de `lista_ventanas`.
+
+    Con workers > 1 las ventanas se calculan en un grupo de hilos (GDAL libera el
+    GIL durante la lectura y NumPy durante el cálculo) o, con `usar_procesos`, en
+    un grupo de procesos; en ese caso `funcion` debe poder serializarse con pickle.
+    Como máximo hay 2 * workers ventanas en vuelo, así que la memoria sigue acotada.
+    Con `con_ventana`, `funcion` se llama como funcion(datos, ventana).
+    rejilla_destino, remuestreo: ver `abrir_en_rejilla`.
+    """
+    lector = _LectorVentanas(rutas_entrada, funcion, con_ventana, rejilla_destino, remuestreo)
+    try:
+        if workers <= 1:
+            for ventana in lista_ventanas:
+                yield ventana, lector(ventana)
+            return
+
+        if usar_procesos:
+            ejecutor = ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_proceso, initargs=(lector,))
+            tarea = _procesar_en_proceso
+        else:
+            ejecutor = ThreadPoolExecutor(max_workers=workers)
+            tarea = lector
+
+        with ejecutor:
+            pendientes = deque()
+            for ventana in lista_ventanas:
+                pendientes.append((ventana, ejecutor.submit(tarea, ventana)))
+                if len(pendientes) >= 2 * workers:
+                    ventana_lista, futuro = pendientes.popleft()
+                    yield ventana_lista, futuro.result()
+            while pendientes:
+                ventana_lista, futuro = pendientes.popleft()
+                yield ventana_lista, futuro.result()
+    finally:
+        lector.cerrar()
+
+
+def calcular_por_ventanas(rutas_entrada, funcion, rutas_salida, perfil_salida=None, tamano_ventana=None,
+                          workers=1, usar_procesos=False, formato='GTiff', compresion='DEFLATE',
+                          con_ventana=False, remuestreo='cercano', omitir_vacios=False, ruta_scl=None,
+                          clases_scl=None):
+    """
+    Calcula productos ráster ventana a ventana sin cargar la escena completa.
+
+    rutas_entrada: dict nombre -> ruta del raster de entrada (se lee la banda 1).
+    funcion: recibe un dict nombre -> array de la ventana y devuelve un dict
+             nombre_salida -> array con el resultado de esa ventana.
+    rutas_salida: dict nombre_salida -> ruta del GeoTIFF de salida.
+    perfil_salida: perfil de los archivos de salida; por defecto el de la primera
+                   entrada convertido con `perfil_indice`.
+    workers, usar_procesos: ver `resultados_por_ventana`. La escritura se hace
+                   siempre desde el hilo principal y en orden.
+    formato, compresion: formato de los archivos de salida (ver escritura.py).
+    con_ventana: si es True, `funcion` recibe también la ventana (funcion(datos, ventana)).
+    remuestreo: método de REMUESTREOS con que las entradas de menor resolución se
+                leen en la rejilla de la de mayor resolución, ventana a ventana.
+    omitir_vacios: las ventanas sin ningún píxel válido según el índice de
+                validez (ver validez.py, con la banda SCL `ruta_scl` y sus clases
+                `clases_scl` si se dan) no se
+                leen, no se calculan y no se escriben: el GeoTIFF se crea disperso
+                (SPARSE_OK) con nodata NaN, así que esos bloques no ocupan espacio y
+                se leen como NaN. Solo para salidas de coma flotante.
+
+    Junto a cada salida se guardan sus estadísticas (mínimo, máximo, media,
+    histograma...; ver estadisticas.py), acumuladas mientras se escribe.
+
+    La memoria máxima depende del tamaño de ventana, no del tamaño de la escena.
+    """
+    with ExitStack() as pila:
+        fuentes = {nombre: pila.enter_context(rasterio.open(ruta))
+                   for nombre, ruta in rutas_entrada.items()}
+        referencia = entrada_referencia(fuentes)
+        rejilla_destino = rejilla(referencia)
+        # Si todas las entradas comparten rejilla se leen directamente, sin WarpedVRT
+        if all(misma_rejilla(rejilla(src), rejilla_destino) for src in fuentes.values()):
+            rejilla_destino = None
+
+        if perfil_salida is None:
+            perfil_salida = perfil_indice(referencia.profile)
+        lista_ventanas = list(ventanas(referencia, tamano_ventana))
+
+        perfil_destino = escritura.perfil_escritura(perfil_salida, formato, compresion)
+        if omitir_vacios:
+            if not np.issubdtype(np.dtype(perfil_salida['dtype']), np.floating):
+                raise ValueError('Solo se pueden omitir los bloques vacíos en salidas de coma flotante (quedan como NaN).')
+            resumenes = validez.indice_validez(rutas_entrada, lista_ventanas, rejilla(referencia), ruta_scl,
+                                               clases_scl, workers)
+            lista_ventanas = [ventana for ventana, resumen in zip(lista_ventanas, resumenes)
+                              if resumen['estado'] == validez.VALIDO]
+            perfil_destino = dict(perfil_destino, nodata=np.nan, SPARSE_OK=True)
+        rutas_escritura = {nombre: escritura.ruta_temporal(ruta, formato) for nombre, ruta in rutas_salida.items()}
+        destinos = {nombre: pila.enter_context(rasterio.open(ruta, 'w', **perfil_destino))
+                    for nombre, ruta in rutas_escritura.items()}
+        # Las estadísticas de cada salida se acumulan al escribir, para no tener que releerla después
+        acumuladores = {nombre: estadisticas.Acumulador(perfil_destino.get('nodata')) for nombre in rutas_salida}
+
+        for ventana, resultados in resultados_por_ventana(rutas_entrada, funcion, lista_ventanas,
+                                                          workers, usar_procesos, con_ventana,
+                                                          rejilla_destino, remuestreo):
+            escritos = {}
+            with parcial('escritura') as tramo:
+                for nombre, dst in destinos.items():
+                    valores = resultados[nombre].astype(perfil_salida['dtype'], copy=False)
+                    dst.write(valores, 1, window=ventana)
+                    tramo.bytes += valores.nbytes
+                    escritos[nombre] = valores
+            with parcial('estadisticas'):
+                for nombre, valores in escritos.items():
+                    acumuladores[nombre].agregar(valores)
+
+    for nombre, ruta in rutas_salida.items():
+        with parcial('escritura'):
+            escritura.finalizar(rutas_escritura[nombre], ruta, formato, compresion)
+        estadisticas.guardar(ruta, acumuladores[nombre].resumen())
+
+
+def leer_reducido(ruta, lado_maximo=2000):
+    """Lee la banda 1 diezmada para que su lado mayor no supere `lado_maximo` píxeles."""
+    with rasterio.open(ruta) as src:
+        factor = max(1, math.ceil(max(src.width, src.height) / lado_maximo))
+        return src.read(1, out_shape=(math.ceil(src.height / factor), math.ceil(src.width / factor)))
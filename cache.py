@@ -0,0 +1,172 @@
+import glob
+import hashlib
+import json
+import os
+import time
+
+# Sufijo del archivo que acompaña a cada producto con la clave con la que se generó
+SUFIJO_CACHE = '.cache.json'
+
+# Sufijo de las estadísticas que se guardan junto a cada raster (ver estadisticas.py)
+SUFIJO_ESTADISTICAS = '.estadisticas.json'
+
+# Rásteres en memoria de GDAL (ver flujo.py): solo viven durante el proceso y nunca se dan por vigentes
+PREFIJO_MEMORIA = '/vsimem/'
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos comunes para controlar la caché."""
+    parser.add_argument('--forzar', action='store_true',
+                        help='Recalcula los productos aunque la caché indique que siguen vigentes.')
+    parser.add_argument('--hash-entradas', action='store_true',
+                        help='Identifica las entradas por su SHA-256 en lugar de tamaño y fecha de modificación.')
+
+
+def en_memoria(ruta):
+    return str(ruta).startswith(PREFIJO_MEMORIA)
+
+
+def huella_archivo(ruta, hash_contenido=False):
+    """
+    Identifica el contenido de un archivo por tamaño y fecha de modificación, o por su SHA-256.
+
+    Un raster en memoria solo se identifica por su ruta: quien lo crea (flujo.py)
+    es quien sabe de qué entradas sale y lleva su propia clave.
+    """
+    if en_memoria(ruta):
+        return {'ruta': ruta, 'memoria': True}
+    estado = os.stat(ruta)
+    huella = {'ruta': os.path.abspath(ruta), 'tamano': estado.st_size}
+    if hash_contenido:
+        sha = hashlib.sha256()
+        with open(ruta, 'rb') as f:
+            for bloque in iter(lambda: f.read(1 << 20), b''):
+                sha.update(bloque)
+        huella['sha256'] = sha.hexdigest()
+    else:
+        huella['mtime_ns'] = estado.st_mtime_ns
+    return huella
+
+
+def clave_cache(rutas_entrada, definicion, parametros=None, hash_contenido=False):
+    """
+    Clave de un producto: huellas de sus entradas, definición (fórmula o modelo) y parámetros.
+
+    Si cambia cualquiera de los tres, cambia la clave y el producto deja de ser válido.
+    """
+    contenido = {
+        'entradas': [huella_archivo(ruta, hash_contenido) for ruta in rutas_entrada],
+        'definicion': definicion,
+        'parametros': parametros or {},
+    }
+    texto = json.dumps(contenido, sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def ruta_registro(ruta_producto):
+    return ruta_producto + SUFIJO_CACHE
+
+
+def _leer_registro(ruta_producto):
+    try:
+        with open(ruta_registro(ruta_producto), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _escribir_registro(ruta_producto, registro):
+    with open(ruta_registro(ruta_producto), 'w', encoding='utf-8') as f:
+        json.dump(registro, f, indent=2)
+
+
+def producto_vigente(ruta_producto, clave):
+    """
+    True si el producto existe, se generó con `clave` y no se ha modificado desde entonces.
+
+    Cada acierto actualiza la fecha de último uso que usa `limpiar_cache`.
+    """
+    if en_memoria(ruta_producto):
+        return False
+    registro = _leer_registro(ruta_producto)
+    if registro is None or registro.get('clave') != clave or not os.path.exists(ruta_producto):
+        return False
+    estado = os.stat(ruta_producto)
+    if (estado.st_size, estado.st_mtime_ns) != (registro.get('tamano'), registro.get('mtime_ns')):
+        return False
+    registro['ultimo_uso'] = time.time()
+    _escribir_registro(ruta_producto, registro)
+    return True
+
+
+def registrar_producto(ruta_producto, clave, intermedio=False, **datos):
+    """
+    Anota que `ruta_producto` se acaba de generar con `clave` (y datos extra opcionales).
+
+    Con `intermedio` el producto se marca como intermedio (no pedido por el
+    usuario), el único tipo que `limpiar_cache` puede borrar.
+    """
+    if en_memoria(ruta_producto):
+        return
+    estado = os.stat(ruta_producto)
+    registro = {
+        'clave': clave,
+        'tamano': estado.st_size,
+        'mtime_ns': estado.st_mtime_ns,
+        'ultimo_uso': time.time(),
+    }
+    if intermedio:
+        registro['intermedio'] = True
+    registro.update(datos)
+    _escribir_registro(ruta_producto, registro)
+
+
+def cargar_resultado(ruta_json, clave):
+    """Devuelve los datos guardados con `guardar_resultado` si la clave coincide; si no, None."""
+    try:
+        with open(ruta_json, encoding='utf-8') as f:
+            registro = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if registro.get('clave') != clave:
+        return None
+    return registro.get('datos')
+
+
+def guardar_resultado(ruta_json, clave, datos):
+    """Guarda un resultado pequeño (p. ej. los coeficientes de un modelo) junto con su clave."""
+    with open(ruta_json, 'w', encoding='utf-8') as f:
+        json.dump({'clave': clave, 'datos': datos}, f, indent=2)
+
+
+def limpiar_cache(directorio, tamano_maximo):
+    """
+    Borra los productos intermedios registrados bajo `directorio` menos usados
+    recientemente hasta que su tamaño total no supere `tamano_maximo` bytes.
+
+    Solo se tocan archivos registrados con `intermedio=True`: los productos
+    finales (índices, mapas calibrados, tablas...) nunca se borran ni cuentan
+    para el límite. Devuelve las rutas borradas.
+    """
+    productos = []
+    patron = os.path.join(directorio, '**', '*' + SUFIJO_CACHE)
+    for ruta_json in glob.glob(patron, recursive=True):
+        ruta_producto = ruta_json[:-len(SUFIJO_CACHE)]
+        registro = _leer_registro(ruta_producto)
+        if registro is None or not registro.get('intermedio') or not os.path.exists(ruta_producto):
+            continue
+        productos.append((registro.get('ultimo_uso', 0), ruta_producto, os.path.getsize(ruta_producto)))
+
+    total = sum(tamano for _, _, tamano in productos)
+    borrados = []
+    for _, ruta_producto, tamano in sorted(productos):
+        if total <= tamano_maximo:
+            break
+        os.remove(ruta_producto)
+        os.remove(ruta_registro(ruta_producto))
+        # Las estadísticas del producto (ver estadisticas.py) se van con él
+        if os.path.exists(ruta_producto + SUFIJO_ESTADISTICAS):
+            os.remove(ruta_producto + SUFIJO_ESTADISTICAS)
+        total -= tamano
+        borrados.append(ruta_producto)
+    return borrados
@@ -0,0 +1,193 @@
+import numpy as np
+import os
+import argparse
+
+import rasterio
+
+import bloques
+import cache
+import escritura
+import instrumentacion
+import muestras
+import muestreo
+import validez
+from calibracion import MODELOS, aplicar_calibracion_lineal, aplicar_modelo, crear_modelo
+from flujo import Flujo, Nodo
+from indices import ARCHIVOS_SALIDA, bandas_necesarias, calcular_indices
+from mapa_web import guardar_mapa
+from nucleos import PRECISIONES
+
+# --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
+# Carpeta de la escena y bandas de entrada
+ruta_carpeta = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m'
+rutas_bandas = {
+    'B04': os.path.join(ruta_carpeta, 'T17LQL_20250721T152721_B04_10m.tif'),
+    'B08': os.path.join(ruta_carpeta, 'T17LQL_20250721T152721_B08_10m.tif'),
+    'B11': os.path.join(ruta_carpeta, 'T17LQL_20250721T152721_B11_10m.tif'),
+}
+
+# Datos de campo
+ruta_excel = r'D:\INFORMES-PECH\2025\AGOSTO\EXCEL\Datos_CE.xlsx'
+columna_x = 'cooreste'
+columna_y = 'coornorte'
+columna_conductividad = 'ce'
+
+# Productos que se pueden guardar; los que no se piden se quedan en memoria y se descartan
+rutas_guardado = {indice: os.path.join(ruta_carpeta, archivo) for indice, archivo in ARCHIVOS_SALIDA.items()}
+rutas_guardado['CALIBRADO'] = os.path.join(ruta_carpeta, 'SSI_calibrado_uScm.tiff')
+rutas_guardado['MAPA'] = os.path.join(ruta_carpeta, 'mapa_interactivo_SSI_calibrado.html')
+
+# Clasificación de escena (SCL) de L2A, opcional: con --omitir-vacios descarta también los bloques de las
+# clases de --clases-scl, p. ej. os.path.join(ruta_carpeta, '..', 'R20m', 'T17LQL_20250721T152721_SCL_20m.jp2')
+ruta_scl = None
+
+# Memoria que pueden ocupar los rásteres intermedios antes de pasar a archivos temporales
+limite_memoria_gb = 4
+
+# Carpeta donde guardar los rásteres intermedios para reutilizarlos en la siguiente ejecución
+# (None = en memoria y se descartan), p. ej. os.path.join(ruta_carpeta, 'intermedios')
+ruta_intermedios = None
+
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(
+    description='Cadena SSI -> calibración -> mapa web en un solo proceso, pasando los rásteres intermedios en memoria.')
+parser.add_argument('--guardar', nargs='+', choices=sorted(rutas_guardado), default=['CALIBRADO', 'MAPA'],
+                    help='Productos que se escriben en disco (por defecto el mapa calibrado y el HTML).')
+parser.add_argument('--memoria-gb', type=float, default=limite_memoria_gb,
+                    help='Memoria máxima para los rásteres intermedios, en GB (por defecto 4).')
+parser.add_argument('--intermedios', default=ruta_intermedios,
+                    help='Carpeta donde se guardan los rásteres intermedios (índices no pedidos) para '
+                         'reutilizarlos en la siguiente ejecución.')
+parser.add_argument('--limite-intermedios-gb', type=float, default=None,
+                    help='Tras la cadena, borra los intermedios menos usados de --intermedios hasta no superar '
+                         'este tamaño; los productos de --guardar nunca se borran.')
+parser.add_argument('--workers', type=int, default=1, help='Número de hilos de cálculo (por defecto 1).')
+parser.add_argument('--precision', choices=PRECISIONES, default='exacta',
+                    help="'exacta' reproduce el cálculo original en float64; 'float32'/'float64' usan los núcleos fusionados.")
+parser.add_argument('--modelo', choices=MODELOS, default='lineal',
+                    help="Regresor a ajustar: 'lineal' (como hasta ahora), 'polinomico', 'bosque' o 'gradiente'.")
+parser.add_argument('--grado', type=int, default=2, help="Grado del modelo 'polinomico' (por defecto 2).")
+parser.add_argument('--caracteristicas', nargs='+', choices=sorted(ARCHIVOS_SALIDA), default=['SSI'],
+                    help='Índices usados como variables del modelo (por defecto solo SSI).')
+parser.add_argument('--sin-recorte', action='store_true',
+                    help='No lleva a 0 los valores calibrados negativos.')
+bloques.agregar_argumentos(parser)
+cache.agregar_argumentos(parser)
+escritura.agregar_argumentos(parser)
+muestreo.agregar_argumentos(parser)
+validez.agregar_argumentos(parser)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'cadena')
+
+modelo_lineal_ssi = args.modelo == 'lineal' and args.caracteristicas == ['SSI'] and not args.sin_recorte
+
+# Índices que hay que calcular: los del modelo y los que se piden guardar, en una sola pasada
+indices = sorted(set(args.caracteristicas) | {'SSI'} | (set(args.guardar) & set(ARCHIVOS_SALIDA)))
+bandas = {banda: rutas_bandas[banda] for banda in sorted(bandas_necesarias(indices))}
+
+
+# --- 2. PASOS DE LA CADENA ---
+def paso_indices(entradas, salidas, formato, compresion):
+    calcular_indices(bandas, salidas, workers=args.workers, precision=args.precision, usar_cache=False,
+                     formato=formato, compresion=compresion, remuestreo=args.remuestreo,
+                     omitir_vacios=args.omitir_vacios, ruta_scl=ruta_scl, clases_scl=args.clases_scl)
+
+
+def paso_muestras(entradas, salidas, formato, compresion):
+    # Las filas sin coordenadas o sin conductividad ya vienen descartadas
+    df_calibracion = muestras.cargar_excel(
+        ruta_excel, columnas={'x': columna_x, 'y': columna_y, 'ce': columna_conductividad}
+    )
+    print(f"Datos de Excel leídos y limpiados. {len(df_calibracion)} puntos de muestra válidos.")
+    return {'MUESTRAS': df_calibracion}
+
+
+def paso_modelo(entradas, salidas, formato, compresion):
+    df_calibracion = entradas['MUESTRAS']
+    # Se muestrean los índices recién calculados, sin que hayan pasado por disco
+    X = muestreo.muestrear_varios(
+        [entradas[nombre] for nombre in args.caracteristicas], df_calibracion['x'].tolist(),
+        df_calibracion['y'].tolist(), metodo=args.muestreo, vecindad=args.vecindad
+    )
+    y = df_calibracion['ce'].to_numpy(dtype=float)
+
+    # Filtramos los valores que no sean válidos para el modelo (como NaN)
+    mascara_valida = ~np.isnan(X).any(axis=1)
+    modelo = crear_modelo(args.modelo, args.grado)
+    modelo.fit(X[mascara_valida], y[mascara_valida])
+
+    print("\n--- Modelo de Calibración ---")
+    if modelo_lineal_ssi:
+        print(f"Ecuación del modelo: Conductividad = {modelo.coef_[0]:.2f} * SSI + {modelo.intercept_:.2f}")
+    else:
+        print(f"Modelo '{args.modelo}' con las variables: {', '.join(args.caracteristicas)}")
+    print(f"Coeficiente de determinación (R²): {modelo.score(X[mascara_valida], y[mascara_valida]):.2f}")
+    return {'MODELO': modelo}
+
+
+def paso_calibracion(entradas, salidas, formato, compresion):
+    modelo = entradas['MODELO']
+    if modelo_lineal_ssi:
+        aplicar_calibracion_lineal(entradas['SSI'], salidas['CALIBRADO'], modelo.coef_[0], modelo.intercept_,
+                                   workers=args.workers, precision=args.precision, usar_cache=False,
+                                   formato=formato, compresion=compresion, omitir_vacios=args.omitir_vacios)
+    else:
+        aplicar_modelo({nombre: entradas[nombre] for nombre in args.caracteristicas}, salidas['CALIBRADO'],
+                       modelo, limites=(None, None) if args.sin_recorte else (0, None), workers=args.workers,
+                       usar_cache=False, formato=formato, compresion=compresion,
+                       omitir_vacios=args.omitir_vacios)
+
+
+def paso_mapa(entradas, salidas, formato, compresion):
+    guardar_mapa(entradas['CALIBRADO'], salidas['MAPA'], nombre='SSI calibrado (µS/cm)')
+
+
+try:
+    # Cada raster intermedio ocupa un float32 del tamaño de la escena (en la rejilla de la banda más fina)
+    pixeles = 0
+    for ruta in bandas.values():
+        with rasterio.open(ruta) as src:
+            pixeles = max(pixeles, src.width * src.height)
+    bytes_raster = pixeles * np.dtype('float32').itemsize
+
+    flujo = Flujo(bytes_raster, limite_memoria=int(args.memoria_gb * 1024 ** 3),
+                  directorio_intermedios=args.intermedios)
+    flujo.agregar(Nodo('indices', paso_indices, {indice: 'raster' for indice in indices},
+                       fuentes=list(bandas.values()) + ([ruta_scl] if ruta_scl and args.omitir_vacios else []),
+                       parametros={'precision': args.precision, 'remuestreo': args.remuestreo,
+                                   'omitir_vacios': args.omitir_vacios, 'clases_scl': args.clases_scl}))
+    flujo.agregar(Nodo('muestras', paso_muestras, {'MUESTRAS': 'objeto'}, fuentes=[ruta_excel],
+                       parametros={'columnas': [columna_x, columna_y, columna_conductividad]}))
+    flujo.agregar(Nodo('modelo', paso_modelo, {'MODELO': 'objeto'},
+                       entradas=['MUESTRAS'] + args.caracteristicas,
+                       parametros={'modelo': args.modelo, 'grado': args.grado, 'caracteristicas': args.caracteristicas,
+                                   'muestreo': args.muestreo, 'vecindad': args.vecindad}))
+    flujo.agregar(Nodo('calibracion', paso_calibracion, {'CALIBRADO': 'raster'},
+                       entradas=['MODELO'] + args.caracteristicas,
+                       parametros={'precision': args.precision, 'sin_recorte': args.sin_recorte,
+                                   'omitir_vacios': args.omitir_vacios}))
+    flujo.agregar(Nodo('mapa', paso_mapa, {'MAPA': 'archivo'}, entradas=['CALIBRADO']))
+
+    # --- 3. EJECUCIÓN ---
+    # Solo se ejecutan los pasos de lo pedido que no esté ya guardado y vigente
+    guardados, ejecutados = flujo.ejecutar(args.guardar, rutas_guardado, usar_cache=not args.forzar,
+                                           hash_contenido=args.hash_entradas, formato=args.formato,
+                                           compresion=args.compresion)
+    if ejecutados:
+        print(f"\nPasos ejecutados: {', '.join(ejecutados)}.")
+    else:
+        print("\nTodos los productos pedidos ya estaban actualizados.")
+    for producto, ruta in guardados.items():
+        print(f"{producto} guardado en: {ruta}")
+
+    if args.intermedios and args.limite_intermedios_gb is not None:
+        borrados = cache.limpiar_cache(args.intermedios, args.limite_intermedios_gb * 1024 ** 3)
+        print(f"Intermedios: se borraron {len(borrados)} para no superar {args.limite_intermedios_gb} GB.")
+
+except FileNotFoundError as e:
+    print(f"Error: No se encontró un archivo de entrada: {e}")
+except KeyError as e:
+    print(f"Error: No se encontró la columna {e} en el archivo de Excel.")
+except Exception as e:
+    print(f"Ocurrió un error inesperado: {e}")
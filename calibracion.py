@@ -0,0 +1,229 @@
+import hashlib
+import pickle
+from functools import partial
+
+import numpy as np
+import rasterio
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import PolynomialFeatures
+
+import nucleos
+from bloques import calcular_por_ventanas
+from cache import clave_cache, producto_vigente, registrar_producto
+
+
+# Modelos que se pueden ajustar desde los scripts de calibración (ver `crear_modelo`)
+MODELOS = ('lineal', 'polinomico', 'bosque', 'gradiente')
+
+# Píxeles por llamada a `predict`: lotes grandes para aprovechar la vectorización sin disparar la memoria
+PIXELES_POR_LOTE = 1 << 20
+
+
+def crear_modelo(nombre, grado=2):
+    """Regresor de scikit-learn sin ajustar para el nombre dado."""
+    if nombre == 'lineal':
+        return LinearRegression()
+    if nombre == 'polinomico':
+        return make_pipeline(PolynomialFeatures(grado), LinearRegression())
+    if nombre == 'bosque':
+        return RandomForestRegressor(n_estimators=200, min_samples_leaf=2, random_state=0)
+    if nombre == 'gradiente':
+        return HistGradientBoostingRegressor(random_state=0)
+    raise ValueError(f"Modelo no válido: '{nombre}' (opciones: {', '.join(MODELOS)})")
+
+
+def _calibrar_ventana_lineal(pendiente, intercepto, datos):
+    mapa_ssi = datos['SSI'].astype(float)
+    mapa_calibrado = np.where(np.isnan(mapa_ssi), np.nan, pendiente * mapa_ssi + intercepto)
+    mapa_calibrado[mapa_calibrado < 0] = 0
+    return {'CALIBRADO': mapa_calibrado}
+
+
+def _calibrar_ventana_nucleo(pendiente, intercepto, dtype, datos):
+    mapa_ssi = datos['SSI']
+    # La ventana recién leída no se usa para nada más: se calibra en el sitio si el tipo coincide
+    out = mapa_ssi if mapa_ssi.dtype == dtype else None
+    return {'CALIBRADO': nucleos.calibracion_lineal(mapa_ssi, pendiente, intercepto, out=out, dtype=dtype)}
+
+
+def _calibrar_ventana_zonas(zonas, pendientes, interceptos, transformacion, datos, ventana):
+    mapa_ssi = datos['SSI'].astype(float)
+    # Tablas indexadas por código de zona; el código 0 (sin zona) y las zonas sin modelo dan NaN.
+    # Con zonas por umbral los códigos son una fila o columna y se extienden por broadcasting
+    codigos = zonas.codigos(datos, ventana, transformacion)
+    mapa_calibrado = pendientes[codigos] * mapa_ssi + interceptos[codigos]
+    mapa_calibrado[np.isnan(mapa_ssi)] = np.nan
+    mapa_calibrado[mapa_calibrado < 0] = 0
+    return {'CALIBRADO': mapa_calibrado}
+
+
+def _predecir_ventana(modelo, nombres, limites, propagar_nan, datos):
+    forma = datos[nombres[0]].shape
+    columnas = [datos[nombre].astype(float, copy=False).ravel() for nombre in nombres]
+    if propagar_nan:
+        # Solo se predicen los píxeles con todas las variables válidas; el resto queda NaN
+        validos = np.logical_and.reduce([np.isfinite(columna) for columna in columnas])
+    else:
+        # El modelo recibe también los NaN (p. ej. HistGradientBoostingRegressor los admite)
+        validos = np.ones(columnas[0].shape, dtype=bool)
+
+    resultado = np.full(columnas[0].shape, np.nan)
+    indices = np.flatnonzero(validos)
+    for inicio in range(0, len(indices), PIXELES_POR_LOTE):
+        lote = indices[inicio:inicio + PIXELES_POR_LOTE]
+        X = np.column_stack([columna[lote] for columna in columnas])
+        resultado[lote] = modelo.predict(X)
+
+    minimo, maximo = limites
+    if minimo is not None or maximo is not None:
+        np.clip(resultado, minimo, maximo, out=resultado)
+    return {'CALIBRADO': resultado.reshape(forma)}
+
+
+def huella_modelo(modelo):
+    """Resumen del modelo ajustado para la clave de caché: cambia si cambian sus parámetros."""
+    return hashlib.sha256(pickle.dumps(modelo)).hexdigest()
+
+
+def aplicar_modelo(rutas_caracteristicas, ruta_salida, modelo, limites=(0, None), propagar_nan=True,
+                   tamano_ventana=None, workers=1, usar_procesos=False, usar_cache=True,
+                   hash_contenido=False, formato='GTiff', compresion='DEFLATE', omitir_vacios=False):
+    """
+    Aplica un regresor ya ajustado a uno o varios rásteres y escribe el resultado ventana a ventana.
+
+    rutas_caracteristicas: dict nombre -> ruta; el orden del dict es el de las
+                           columnas con las que se ajustó el modelo (p. ej. SSI, NDVI, NDSI).
+    modelo: cualquier objeto con `predict` (p. ej. un regresor o pipeline de scikit-learn).
+    limites: (mínimo, máximo) al que se recorta la predicción; None en un extremo
+             lo deja abierto. Por defecto los negativos se llevan a 0, como en la
+             calibración lineal; (None, None) no recorta.
+    propagar_nan: si es True, los píxeles con alguna variable NaN quedan NaN sin
+                  pasar por el modelo; si es False se le pasan tal cual.
+    omitir_vacios: no predice ni escribe los bloques en que todas las variables
+                  son NaN (quedan como NaN, ver bloques.calcular_por_ventanas);
+                  requiere `propagar_nan`.
+
+    En cada ventana `predict` se llama con lotes de hasta PIXELES_POR_LOTE píxeles.
+    Con `workers` > 1 las ventanas se predicen en paralelo. Devuelve True si el
+    mapa se ha (re)calculado.
+    """
+    if omitir_vacios and not propagar_nan:
+        raise ValueError('Para omitir los bloques vacíos los NaN deben propagarse (propagar_nan=True).')
+    nombres = list(rutas_caracteristicas)
+    parametros = {'caracteristicas': nombres, 'modelo': type(modelo).__name__,
+                  'huella_modelo': huella_modelo(modelo), 'limites': list(limites),
+                  'propagar_nan': propagar_nan, 'formato': formato, 'compresion': compresion}
+    # Solo entra en la clave si se usa, para no invalidar los mapas ya calculados
+    if omitir_vacios:
+        parametros['omitir_vacios'] = True
+    clave = clave_cache(list(rutas_caracteristicas.values()), 'aplicar_modelo', parametros, hash_contenido)
+    if usar_cache and producto_vigente(ruta_salida, clave):
+        return False
+
+    calcular_por_ventanas(
+        rutas_caracteristicas,
+        partial(_predecir_ventana, modelo, nombres, tuple(limites), propagar_nan),
+        {'CALIBRADO': ruta_salida},
+        tamano_ventana=tamano_ventana,
+        workers=workers,
+        usar_procesos=usar_procesos,
+        formato=formato,
+        compresion=compresion,
+        omitir_vacios=omitir_vacios
+    )
+    registrar_producto(ruta_salida, clave)
+    return True
+
+
+def aplicar_calibracion_lineal(ruta_ssi, ruta_salida, pendiente, intercepto, tamano_ventana=None,
+                               workers=1, usar_procesos=False, precision='exacta', usar_cache=True,
+                               hash_contenido=False, formato='GTiff', compresion='DEFLATE', omitir_vacios=False):
+    """
+    Escribe el mapa calibrado `pendiente * SSI + intercepto` ventana a ventana.
+
+    Los píxeles sin dato (NaN) se mantienen como NaN y los valores negativos se
+    llevan a 0. Con precision 'float32' o 'float64' se usa el núcleo
+    nucleos.calibracion_lineal en lugar del cálculo original en float64.
+
+    Con `usar_cache` el mapa no se reescribe si el SSI y el modelo no han
+    cambiado. Con `omitir_vacios` no se calculan los bloques del SSI que son
+    todo NaN. Devuelve True si el mapa se ha (re)calculado.
+    """
+    parametros = {'pendiente': float(pendiente), 'intercepto': float(intercepto), 'precision': precision,
+                  'formato': formato, 'compresion': compresion}
+    if omitir_vacios:
+        parametros['omitir_vacios'] = True
+    clave = clave_cache([ruta_ssi], 'calibracion_lineal', parametros, hash_contenido)
+    if usar_cache and producto_vigente(ruta_salida, clave):
+        return False
+
+    if precision == 'exacta':
+        funcion = partial(_calibrar_ventana_lineal, pendiente, intercepto)
+    else:
+        funcion = partial(_calibrar_ventana_nucleo, pendiente, intercepto, np.dtype(precision))
+
+    calcular_por_ventanas(
+        {'SSI': ruta_ssi},
+        funcion,
+        {'CALIBRADO': ruta_salida},
+        tamano_ventana=tamano_ventana,
+        workers=workers,
+        usar_procesos=usar_procesos,
+        formato=formato,
+        compresion=compresion,
+        omitir_vacios=omitir_vacios
+    )
+    registrar_producto(ruta_salida, clave)
+    return True
+
+
+def aplicar_calibracion_por_zonas(ruta_ssi, ruta_salida, zonas, modelos, tamano_ventana=None, workers=1,
+                                  usar_procesos=False, usar_cache=True, hash_contenido=False,
+                                  formato='GTiff', compresion='DEFLATE', omitir_vacios=False):
+    """
+    Escribe el mapa calibrado con un modelo lineal distinto en cada zona, ventana a ventana.
+
+    zonas: definición de zonas de zonas.py (umbral, polígonos o raster de etiquetas).
+    modelos: dict nombre de zona -> (pendiente, intercepto).
+
+    Los píxeles sin zona, o de una zona sin modelo, quedan como NaN; igual que en
+    la calibración lineal, los NaN del SSI se mantienen y los negativos se llevan a 0.
+    Con `omitir_vacios` no se calculan los bloques del SSI que son todo NaN.
+    Devuelve True si el mapa se ha (re)calculado.
+    """
+    rutas_entrada = {'SSI': ruta_ssi}
+    rutas_entrada.update(zonas.entradas())
+    parametros = {'zonas': zonas.descripcion(),
+                  'modelos': {nombre: [float(p), float(i)] for nombre, (p, i) in modelos.items()},
+                  'formato': formato, 'compresion': compresion}
+    if omitir_vacios:
+        parametros['omitir_vacios'] = True
+    clave = clave_cache(list(rutas_entrada.values()), 'calibracion_zonas', parametros, hash_contenido)
+    if usar_cache and producto_vigente(ruta_salida, clave):
+        return False
+
+    pendientes = np.full(len(zonas.nombres) + 1, np.nan)
+    interceptos = np.full(len(zonas.nombres) + 1, np.nan)
+    for codigo, nombre in enumerate(zonas.nombres, start=1):
+        if nombre in modelos:
+            pendientes[codigo], interceptos[codigo] = modelos[nombre]
+
+    with rasterio.open(ruta_ssi) as src:
+        transformacion = src.transform
+
+    calcular_por_ventanas(
+        rutas_entrada,
+        partial(_calibrar_ventana_zonas, zonas, pendientes, interceptos, transformacion),
+        {'CALIBRADO': ruta_salida},
+        tamano_ventana=tamano_ventana,
+        workers=workers,
+        usar_procesos=usar_procesos,
+        formato=formato,
+        compresion=compresion,
+        con_ventana=True,
+        omitir_vacios=omitir_vacios
+    )
+    registrar_producto(ruta_salida, clave)
+    return True
@@ -1,8 +1,16 @@
-import pandas as pd
-from sklearn.linear_model import LinearRegression
 import numpy as np
-import rasterio
 import os
+import argparse
+
+import cache
+import escritura
+import instrumentacion
+import muestras
+import muestreo
+import validez
+from calibracion import MODELOS, aplicar_calibracion_lineal, aplicar_modelo, crear_modelo
+from indices import ARCHIVOS_SALIDA
+from nucleos import PRECISIONES
 
 # --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
 ruta_excel = r'D:\INFORMES-PECH\2025\AGOSTO\EXCEL\Datos_CE.xlsx'
@@ -12,84 +20,167 @@ columna_conductividad = 'ce'
 ruta_ssi_mapa = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m\SSI_final.tiff'
 ruta_calibrado_salida = os.path.join(os.path.dirname(ruta_ssi_mapa), 'SSI_calibrado_uScm.tiff')
 
-# --- 2. LEER Y PREPARAR DATOS DE CAMPO ---
-print("Leyendo datos de campo desde el archivo de Excel...")
-try:
-    df_calibracion = pd.read_excel(ruta_excel)
-    
-    # 2.1. Limpiamos cualquier fila con valores faltantes
-    df_calibracion.dropna(subset=[columna_x, columna_y, columna_conductividad], inplace=True)
-    
-    x_coords = df_calibracion[columna_x].tolist()
-    y_coords = df_calibracion[columna_y].tolist()
-    conductividad_medida = df_calibracion[columna_conductividad].tolist()
-    
-    print(f"Datos de Excel leídos y limpiados. {len(x_coords)} puntos de muestra válidos.")
+# Rásteres que pueden usarse como variables del modelo (los índices de la misma carpeta que el SSI)
+rutas_caracteristicas = {indice: os.path.join(os.path.dirname(ruta_ssi_mapa), archivo)
+                         for indice, archivo in ARCHIVOS_SALIDA.items()}
+rutas_caracteristicas['SSI'] = ruta_ssi_mapa
 
-except FileNotFoundError:
-    print(f"Error: No se encontró el archivo de Excel en la ruta '{ruta_excel}'.")
-    exit()
-except KeyError as e:
-    print(f"Error: No se encontró la columna {e} en el archivo de Excel.")
-    exit()
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Calibra el mapa SSI con las mediciones de conductividad de campo.')
+parser.add_argument('--workers', type=int, default=1, help='Número de hilos para aplicar el modelo (por defecto 1).')
+parser.add_argument('--precision', choices=PRECISIONES, default='exacta',
+                    help="'exacta' reproduce el cálculo original en float64; 'float32'/'float64' usan los núcleos fusionados.")
+parser.add_argument('--modelo', choices=MODELOS, default='lineal',
+                    help="Regresor a ajustar: 'lineal' (como hasta ahora), 'polinomico', 'bosque' o 'gradiente'.")
+parser.add_argument('--grado', type=int, default=2, help="Grado del modelo 'polinomico' (por defecto 2).")
+parser.add_argument('--caracteristicas', nargs='+', choices=sorted(rutas_caracteristicas), default=['SSI'],
+                    help='Índices usados como variables del modelo (por defecto solo SSI).')
+parser.add_argument('--sin-recorte', action='store_true',
+                    help='No lleva a 0 los valores calibrados negativos.')
+cache.agregar_argumentos(parser)
+escritura.agregar_argumentos(parser)
+muestreo.agregar_argumentos(parser)
+validez.agregar_argumentos(parser, con_scl=False)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'calibracion_datos')
 
-# --- 3. EXTRAER VALORES DEL MAPA SSI EN CADA PUNTO ---
-try:
-    with rasterio.open(ruta_ssi_mapa) as src:
-        # Creamos una lista de tuplas con las coordenadas (x, y)
-        coordenadas_muestreo = list(zip(x_coords, y_coords))
-        
-        # Extraemos los valores de píxeles
-        valores_ssi_muestra = [value[0] for value in src.sample(coordenadas_muestreo)]
-        
-    # Aseguramos que los valores sean un array de numpy
-    valores_ssi_muestra = np.array(valores_ssi_muestra)
-    print(f"Se extrajeron {len(valores_ssi_muestra)} valores del mapa SSI.")
+# La recta sobre el SSI se guarda como pendiente/intercepto y se aplica con los núcleos de calibracion.py;
+# cualquier otro modelo se ajusta con scikit-learn y se aplica con `aplicar_modelo`
+modelo_lineal_ssi = args.modelo == 'lineal' and args.caracteristicas == ['SSI'] and not args.sin_recorte
 
-except FileNotFoundError:
-    print(f"Error: No se encontró el mapa SSI en la ruta '{ruta_ssi_mapa}'.")
-    exit()
-except Exception as e:
-    print(f"Ocurrió un error al extraer los valores del mapa SSI: {e}")
-    exit()
+# --- 2. COMPROBAR SI EL MODELO YA ESTÁ AJUSTADO ---
+# El modelo solo depende del Excel, del mapa SSI y de las columnas usadas
+ruta_modelo = os.path.splitext(ruta_calibrado_salida)[0] + '_modelo.json'
+# Los demás modelos se vuelven a ajustar (son pocos puntos); el mapa solo se reescribe si cambian
+clave_modelo, modelo_guardado = None, None
+if modelo_lineal_ssi:
+    try:
+        clave_modelo = cache.clave_cache(
+            [ruta_excel, ruta_ssi_mapa],
+            'LinearRegression',
+            {'columnas': [columna_x, columna_y, columna_conductividad],
+             'muestreo': args.muestreo, 'vecindad': args.vecindad},
+            hash_contenido=args.hash_entradas
+        )
+        modelo_guardado = None if args.forzar else cache.cargar_resultado(ruta_modelo, clave_modelo)
+    except FileNotFoundError:
+        # Si falta alguna entrada, los pasos siguientes indican cuál
+        clave_modelo, modelo_guardado = None, None
+
+if modelo_guardado is not None:
+    pendiente = modelo_guardado['pendiente']
+    intercepto = modelo_guardado['intercepto']
+    r2 = modelo_guardado['r2']
+    print("El Excel y el mapa SSI no han cambiado: se reutiliza el modelo ajustado anteriormente.")
+else:
+    # --- 3. LEER Y PREPARAR DATOS DE CAMPO ---
+    print("Leyendo datos de campo desde el archivo de Excel...")
+    try:
+        # El Excel solo se lee la primera vez (o si cambia); después se cargan sus muestras desde Parquet.
+        # Las filas sin coordenadas o sin conductividad ya vienen descartadas
+        with instrumentacion.etapa('muestras'):
+            df_calibracion = muestras.cargar_excel(
+                ruta_excel, columnas={'x': columna_x, 'y': columna_y, 'ce': columna_conductividad}
+            )
+
+        x_coords = df_calibracion['x'].tolist()
+        y_coords = df_calibracion['y'].tolist()
+        conductividad_medida = df_calibracion['ce'].tolist()
+
+        print(f"Datos de Excel leídos y limpiados. {len(x_coords)} puntos de muestra válidos.")
+
+    except FileNotFoundError:
+        print(f"Error: No se encontró el archivo de Excel en la ruta '{ruta_excel}'.")
+        exit()
+    except KeyError as e:
+        print(f"Error: No se encontró la columna {e} en el archivo de Excel.")
+        exit()
+
+    # --- 4. EXTRAER VALORES DEL MAPA SSI EN CADA PUNTO ---
+    try:
+        # Todos los puntos se pasan a fila/columna de una vez y cada bloque del mapa se lee una sola vez
+        with instrumentacion.etapa('muestreo', puntos=len(x_coords)):
+            valores_ssi_muestra = muestreo.muestrear_varios(
+                [rutas_caracteristicas[nombre] for nombre in args.caracteristicas], x_coords, y_coords,
+                metodo=args.muestreo, vecindad=args.vecindad
+            )
+        print(f"Se extrajeron {len(valores_ssi_muestra)} valores de: {', '.join(args.caracteristicas)}.")
+
+    except FileNotFoundError:
+        print(f"Error: No se encontró alguno de los mapas ({', '.join(args.caracteristicas)}) junto a '{ruta_ssi_mapa}'.")
+        exit()
+    except Exception as e:
+        print(f"Ocurrió un error al extraer los valores del mapa SSI: {e}")
+        exit()
+
+    # --- 5. CONSTRUIR Y ENTRENAR EL MODELO ---
+    X = valores_ssi_muestra.reshape(len(valores_ssi_muestra), -1)
+    y = np.array(conductividad_medida)
 
-# --- 4. CONSTRUIR Y ENTRENAR EL MODELO ---
-X = valores_ssi_muestra.reshape(-1, 1)
-y = np.array(conductividad_medida)
+    # Filtramos los valores que no sean válidos para el modelo (como NaN)
+    mascara_valida = ~np.isnan(X).any(axis=1)
+    X_limpio = X[mascara_valida]
+    y_limpio = y[mascara_valida]
 
-# Filtramos los valores que no sean válidos para el modelo (como NaN)
-mascara_valida = ~np.isnan(X).flatten()
-X_limpio = X[mascara_valida]
-y_limpio = y[mascara_valida]
+    modelo = crear_modelo(args.modelo, args.grado)
+    with instrumentacion.etapa('ajuste', modelo=args.modelo, puntos=len(y_limpio)):
+        modelo.fit(X_limpio, y_limpio)
 
-modelo = LinearRegression()
-modelo.fit(X_limpio, y_limpio)
+    if modelo_lineal_ssi:
+        pendiente = modelo.coef_[0]
+        intercepto = modelo.intercept_
+    r2 = modelo.score(X_limpio, y_limpio)
 
-pendiente = modelo.coef_[0]
-intercepto = modelo.intercept_
+    # Guardamos el modelo para no volver a ajustarlo mientras no cambien el Excel ni el mapa SSI
+    if modelo_lineal_ssi and clave_modelo is not None:
+        cache.guardar_resultado(ruta_modelo, clave_modelo,
+                                {'pendiente': float(pendiente), 'intercepto': float(intercepto), 'r2': float(r2)})
 
 print("\n--- Modelo de Calibración ---")
-print(f"Ecuación del modelo: Conductividad = {pendiente:.2f} * SSI + {intercepto:.2f}")
-print(f"Coeficiente de determinación (R²): {modelo.score(X_limpio, y_limpio):.2f}")
+if modelo_lineal_ssi:
+    print(f"Ecuación del modelo: Conductividad = {pendiente:.2f} * SSI + {intercepto:.2f}")
+else:
+    print(f"Modelo '{args.modelo}' con las variables: {', '.join(args.caracteristicas)}")
+print(f"Coeficiente de determinación (R²): {r2:.2f}")
 
-# --- 5. ABRIR EL MAPA SSI Y APLICAR EL MODELO ---
+# --- 6. APLICAR EL MODELO AL MAPA SSI Y GUARDAR EL MAPA CALIBRADO ---
 try:
-    with rasterio.open(ruta_ssi_mapa) as src:
-        mapa_ssi = src.read(1).astype(float)
-        perfil_salida = src.profile.copy()
-        
-    mapa_calibrado = np.where(np.isnan(mapa_ssi), np.nan, pendiente * mapa_ssi + intercepto)
-    
-    mapa_calibrado[mapa_calibrado < 0] = 0
-    print("Mapa de SSI calibrado a µS/cm.")
-
-    # --- 6. GUARDAR EL NUEVO MAPA CALIBRADO ---
-    perfil_salida.update(dtype=rasterio.float32, count=1)
-
-    with rasterio.open(ruta_calibrado_salida, 'w', **perfil_salida) as dst:
-        dst.write(mapa_calibrado.astype(rasterio.float32), 1)
-
-    print(f"\nMapa calibrado guardado en: {ruta_calibrado_salida}")
+    # El mapa se calibra por ventanas, repartidas entre --workers hilos
+    with instrumentacion.etapa('aplicacion', modelo=args.modelo):
+        if modelo_lineal_ssi:
+            recalculado = aplicar_calibracion_lineal(
+                ruta_ssi_mapa,
+                ruta_calibrado_salida,
+                pendiente,
+                intercepto,
+                workers=args.workers,
+                precision=args.precision,
+                usar_cache=not args.forzar,
+                hash_contenido=args.hash_entradas,
+                formato=args.formato,
+                compresion=args.compresion,
+                omitir_vacios=args.omitir_vacios
+            )
+        else:
+            # `predict` se llama por lotes grandes de píxeles válidos en cada ventana
+            recalculado = aplicar_modelo(
+                {nombre: rutas_caracteristicas[nombre] for nombre in args.caracteristicas},
+                ruta_calibrado_salida,
+                modelo,
+                limites=(None, None) if args.sin_recorte else (0, None),
+                workers=args.workers,
+                usar_cache=not args.forzar,
+                hash_contenido=args.hash_entradas,
+                formato=args.formato,
+                compresion=args.compresion,
+                omitir_vacios=args.omitir_vacios
+            )
+    if recalculado:
+        print("Mapa de SSI calibrado a µS/cm.")
+        print(f"\nMapa calibrado guardado en: {ruta_calibrado_salida}")
+    else:
+        print(f"\nEl mapa calibrado ya estaba actualizado, se reutiliza: {ruta_calibrado_salida}")
 
 except FileNotFoundError:
     print(f"Error: No se encontró el mapa SSI en la ruta '{ruta_ssi_mapa}'.")
@@ -1,8 +1,15 @@
-import pandas as pd
-from sklearn.linear_model import LinearRegression
-import numpy as np
-import rasterio
 import os
+import argparse
+
+import cache
+import escritura
+import instrumentacion
+import muestras
+import muestreo
+import regresion
+import validez
+import zonas
+from calibracion import aplicar_calibracion_por_zonas
 
 # --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
 ruta_excel = r'D:\INFORMES-PECH\2025\AGOSTO\EXCEL\Datos_CE.xlsx'
@@ -13,84 +20,111 @@ columna_ubicacion = 'ubicacion'
 
 ruta_ssi_mapa = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m\SSI_final.tiff'
 ruta_calibrado_salida = os.path.join(os.path.dirname(ruta_ssi_mapa), 'SSI_calibrado_uScm_final.tiff')
+# Tabla con la recta, el R² y los errores de cada zona
+ruta_modelos = os.path.splitext(ruta_calibrado_salida)[0] + '_modelos.csv'
+
+# Zonas por defecto: umbral en la coordenada Y (coornorte) entre costa y tierra adentro
+# Nota: Ajusta este umbral para que corresponda a la división entre tus zonas de costa y tierra adentro
+umbral_costa = 9050000  # Se asume que la costa está en coordenadas Y más bajas
+nombres_zonas = ['costa', 'tierra_adentro']
+
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Calibra el mapa SSI con un modelo separado para cada zona.')
+parser.add_argument('--workers', type=int, default=1, help='Número de hilos para aplicar los modelos (por defecto 1).')
+parser.add_argument('--ubicacion-desde-zonas', action='store_true',
+                    help='Asigna la zona de cada punto de campo según la definición de zonas y no la columna del Excel.')
+zonas.agregar_argumentos(parser)
+muestreo.agregar_argumentos(parser)
+regresion.agregar_argumentos(parser)
+cache.agregar_argumentos(parser)
+escritura.agregar_argumentos(parser)
+validez.agregar_argumentos(parser, con_scl=False)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'calibracion_datos_final')
 
 # --- 2. LEER DATOS DE CAMPO Y EXTRAER VALORES SSI ---
 print("Leyendo datos de campo y extrayendo valores SSI...")
 try:
-    df_calibracion = pd.read_excel(ruta_excel)
-    df_calibracion.columns = df_calibracion.columns.str.strip().str.lower()
-    df_calibracion.dropna(subset=[columna_x, columna_y, columna_conductividad, columna_ubicacion], inplace=True)
+    definicion_zonas = zonas.zonas_desde_argumentos(args, ruta_ssi_mapa, nombres_zonas, [umbral_costa])
+
+    # Muestras con el esquema normalizado (x, y, ce, ubicacion), leídas del almacén Parquet
+    with instrumentacion.etapa('muestras'):
+        df_calibracion = muestras.cargar_excel(ruta_excel, columnas={'x': columna_x, 'y': columna_y,
+                                                                     'ce': columna_conductividad,
+                                                                     'ubicacion': columna_ubicacion})
+    if not args.ubicacion_desde_zonas:
+        df_calibracion = df_calibracion.dropna(subset=['ubicacion']).reset_index(drop=True)
     
-    x_coords = df_calibracion[columna_x].tolist()
-    y_coords = df_calibracion[columna_y].tolist()
+    x_coords = df_calibracion['x'].tolist()
+    y_coords = df_calibracion['y'].tolist()
+    if args.ubicacion_desde_zonas:
+        df_calibracion['ubicacion'] = definicion_zonas.zonas_de_puntos(x_coords, y_coords)
     
-    with rasterio.open(ruta_ssi_mapa) as src:
-        coordenadas_muestreo = list(zip(x_coords, y_coords))
-        valores_ssi_muestra = [value[0] for value in src.sample(coordenadas_muestreo)]
+    with instrumentacion.etapa('muestreo', puntos=len(x_coords)):
+        valores_ssi_muestra = muestreo.muestrear(ruta_ssi_mapa, x_coords, y_coords,
+                                                 metodo=args.muestreo, vecindad=args.vecindad)
     
     df_calibracion['SSI_Valor'] = valores_ssi_muestra
+    # Los puntos fuera del mapa o sobre píxeles sin dato no sirven para ajustar los modelos
+    df_calibracion.dropna(subset=['SSI_Valor'], inplace=True)
     
 except Exception as e:
     print(f"Error al preparar los datos de calibración: {e}")
     exit()
 
-# --- 3. CONSTRUIR LOS DOS MODELOS DE CALIBRACIÓN ---
-df_tierra_adentro = df_calibracion[df_calibracion[columna_ubicacion] == 'tierra_adentro']
-df_costa = df_calibracion[df_calibracion[columna_ubicacion] == 'costa']
+# --- 3. CONSTRUIR UN MODELO DE CALIBRACIÓN POR ZONA ---
+# Todas las zonas se ajustan a la vez, en forma cerrada (ver regresion.py)
+df_zonas = df_calibracion[df_calibracion['ubicacion'].isin(definicion_zonas.nombres)]
+with instrumentacion.etapa('ajuste', zonas=len(definicion_zonas.nombres), puntos=len(df_zonas)):
+    tabla_modelos = regresion.ajustar_tabla(df_zonas, 'SSI_Valor', 'ce', 'ubicacion', intervalos=args.intervalos,
+                                            repeticiones=args.repeticiones, confianza=args.confianza)
+modelos = regresion.modelos_de_tabla(tabla_modelos, 'ubicacion')
 
-# Modelo para "tierra_adentro"
-X_inland = df_tierra_adentro[['SSI_Valor']].values
-y_inland = df_tierra_adentro[columna_conductividad].values
-modelo_inland = LinearRegression().fit(X_inland, y_inland)
-pendiente_inland = modelo_inland.coef_[0]
-intercepto_inland = modelo_inland.intercept_
+print("\n--- Modelos de Calibración ---")
+filas_modelos = tabla_modelos.set_index('ubicacion')
+for nombre in definicion_zonas.nombres:
+    if nombre not in modelos:
+        puntos = filas_modelos['n'].get(nombre, 0)
+        print(f"Aviso: la zona '{nombre}' tiene {puntos} puntos; sus píxeles quedarán sin calibrar (NaN).")
+        continue
+    fila = filas_modelos.loc[nombre]
+    print(f"Zona {nombre}: µS/cm = {fila['pendiente']:.2f} * SSI + {fila['intercepto']:.2f} "
+          f"(R² = {fila['r2']:.2f}, R² dejando uno fuera = {fila['r2_loo']:.2f}, {int(fila['n'])} puntos)")
+    if args.intervalos:
+        print(f"  Intervalo {args.confianza:.0%} ({args.intervalos}): pendiente [{fila['pendiente_inf']:.2f}, "
+              f"{fila['pendiente_sup']:.2f}], intercepto [{fila['intercepto_inf']:.2f}, {fila['intercepto_sup']:.2f}]")
+tabla_modelos.to_csv(ruta_modelos, index=False)
+print(f"Tabla de modelos guardada en: {ruta_modelos}")
 
-# Modelo para "costa"
-X_coastal = df_costa[['SSI_Valor']].values
-y_coastal = df_costa[columna_conductividad].values
-modelo_coastal = LinearRegression().fit(X_coastal, y_coastal)
-pendiente_coastal = modelo_coastal.coef_[0]
-intercepto_coastal = modelo_coastal.intercept_
+ubicaciones_sin_zona = set(df_calibracion['ubicacion'].dropna()) - set(definicion_zonas.nombres)
+if ubicaciones_sin_zona:
+    print(f"Aviso: se ignoran los puntos de ubicaciones que no son zonas del mapa: {', '.join(map(str, sorted(ubicaciones_sin_zona)))}")
 
 print("Modelos de calibración construidos.")
 
-# --- 4. ABRIR MAPA SSI COMPLETO Y APLICAR MODELOS ---
+# --- 4. APLICAR LOS MODELOS POR ZONAS Y GUARDAR EL MAPA CALIBRADO ---
 try:
-    with rasterio.open(ruta_ssi_mapa) as src:
-        mapa_ssi = src.read(1).astype(float)
-        perfil_salida = src.profile.copy()
-        
-        # Obtenemos las coordenadas de cada píxel del mapa
-        cols, rows = np.meshgrid(np.arange(src.width), np.arange(src.height))
-        xs, ys = src.transform * (cols, rows)
-        
-        # Aplicamos el modelo de calibración basado en la ubicación
-        # Nota: Ajusta este umbral para que corresponda a la división entre tus zonas de costa y tierra adentro
-        umbral_costa = 9050000  # Valor de ejemplo para la coordenada Y (coornorte)
-
-        mapa_calibrado = np.zeros_like(mapa_ssi)
-        
-        # Aplicamos el modelo de la costa a los píxeles que cumplen la condición
-        mascara_costa = (ys < umbral_costa) # Se asume que la costa está en coordenadas Y más bajas
-        mapa_calibrado[mascara_costa] = pendiente_coastal * mapa_ssi[mascara_costa] + intercepto_coastal
-
-        # Aplicamos el modelo de tierra adentro a los píxeles restantes
-        mascara_tierra_adentro = (ys >= umbral_costa)
-        mapa_calibrado[mascara_tierra_adentro] = pendiente_inland * mapa_ssi[mascara_tierra_adentro] + intercepto_inland
-
-        # Mantenemos los valores de no-data como NaN
-        mapa_calibrado[np.isnan(mapa_ssi)] = np.nan
-        mapa_calibrado[mapa_calibrado < 0] = 0
-        
-    print("Mapa de SSI calibrado a µS/cm.")
-
-    # --- 5. GUARDAR EL NUEVO MAPA CALIBRADO ---
-    perfil_salida.update(dtype=rasterio.float32, count=1)
-
-    with rasterio.open(ruta_calibrado_salida, 'w', **perfil_salida) as dst:
-        dst.write(mapa_calibrado.astype(rasterio.float32), 1)
-
-    print(f"\nMapa calibrado guardado en: {ruta_calibrado_salida}")
+    # El mapa se recorre por ventanas: la zona de cada píxel se obtiene dentro de la ventana
+    # (con umbral, a partir de las coordenadas de sus filas), sin mallas de coordenadas de la escena
+    with instrumentacion.etapa('aplicacion'):
+        recalculado = aplicar_calibracion_por_zonas(
+            ruta_ssi_mapa,
+            ruta_calibrado_salida,
+            definicion_zonas,
+            modelos,
+            workers=args.workers,
+            usar_cache=not args.forzar,
+            hash_contenido=args.hash_entradas,
+            formato=args.formato,
+            compresion=args.compresion,
+            omitir_vacios=args.omitir_vacios
+        )
+    if recalculado:
+        print("Mapa de SSI calibrado a µS/cm.")
+        print(f"\nMapa calibrado guardado en: {ruta_calibrado_salida}")
+    else:
+        print(f"\nEl mapa calibrado ya estaba actualizado, se reutiliza: {ruta_calibrado_salida}")
 
 except Exception as e:
-    print(f"Ocurrió un error inesperado: {e}")
\ No newline at end of file
+    print(f"Ocurrió un error inesperado: {e}")
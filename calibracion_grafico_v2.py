@@ -1,10 +1,14 @@
-import pandas as pd
-from sklearn.linear_model import LinearRegression
 import numpy as np
-import rasterio
+import pandas as pd
 import os
+import argparse
 import matplotlib.pyplot as plt
 
+import instrumentacion
+import muestras
+import muestreo
+import regresion
+
 # --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
 ruta_excel = r'D:\INFORMES-PECH\2025\AGOSTO\EXCEL\Datos_CE.xlsx'
 # Columna por posición (índice 0-basado)
@@ -16,28 +20,37 @@ idx_ubicacion = 3
 ruta_ssi_mapa = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m\SSI_final.tiff'
 ruta_calibrado_salida = os.path.join(os.path.dirname(ruta_ssi_mapa), 'SSI_calibrado_uScm.tiff')
 
+# Valor del SSI en cada punto: 'cercano' (píxel del punto), 'bilineal', 'media' o 'mediana'
+# de una vecindad de lado_vecindad × lado_vecindad píxeles (suaviza el error del GPS)
+metodo_muestreo = 'cercano'
+lado_vecindad = 3
+
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Ajusta y grafica un modelo de calibración por zona.')
+regresion.agregar_argumentos(parser)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'calibracion_grafico_v2')
+
 # --- 2. LEER DATOS DE CAMPO Y EXTRAER VALORES SSI ---
 print("Leyendo datos de campo desde el archivo de Excel...")
 try:
-    df_calibracion = pd.read_excel(ruta_excel)
-    
-    # Extraemos los datos por su índice de columna
-    df_calibracion.dropna(subset=[df_calibracion.columns[idx_x], 
-                                  df_calibracion.columns[idx_y], 
-                                  df_calibracion.columns[idx_conductividad], 
-                                  df_calibracion.columns[idx_ubicacion]], inplace=True)
+    # Extraemos los datos por su índice de columna; el almacén los deja como x, y, ce, ubicacion
+    with instrumentacion.etapa('muestras'):
+        df_calibracion = muestras.cargar_excel(ruta_excel, columnas={'x': idx_x, 'y': idx_y,
+                                                                     'ce': idx_conductividad, 'ubicacion': idx_ubicacion})
+    df_calibracion = df_calibracion.dropna(subset=['ubicacion']).reset_index(drop=True)
     
-    x_coords = df_calibracion.iloc[:, idx_x].tolist()
-    y_coords = df_calibracion.iloc[:, idx_y].tolist()
-    conductividad_medida = df_calibracion.iloc[:, idx_conductividad].tolist()
-    ubicacion_data = df_calibracion.iloc[:, idx_ubicacion].tolist()
+    x_coords = df_calibracion['x'].tolist()
+    y_coords = df_calibracion['y'].tolist()
     
-    with rasterio.open(ruta_ssi_mapa) as src:
-        coordenadas_muestreo = list(zip(x_coords, y_coords))
-        valores_ssi_muestra = [value[0] for value in src.sample(coordenadas_muestreo)]
+    with instrumentacion.etapa('muestreo', puntos=len(x_coords)):
+        valores_ssi_muestra = muestreo.muestrear(ruta_ssi_mapa, x_coords, y_coords,
+                                                 metodo=metodo_muestreo, vecindad=lado_vecindad)
     
     df_calibracion['SSI_Valor'] = valores_ssi_muestra
-    df_calibracion['ubicacion'] = ubicacion_data
+    # Los puntos fuera del mapa o sobre píxeles sin dato no sirven para ajustar los modelos
+    df_calibracion.dropna(subset=['SSI_Valor'], inplace=True)
     
     print(f"Datos de Excel y valores de SSI extraídos correctamente. Se encontraron {len(df_calibracion)} puntos válidos.")
 
@@ -49,39 +62,48 @@ except Exception as e:
 df_tierra_adentro = df_calibracion[df_calibracion['ubicacion'] == 'tierra_adentro']
 df_costa = df_calibracion[df_calibracion['ubicacion'] == 'costa']
 
-# Modelo para "tierra_adentro"
 X_inland = df_tierra_adentro[['SSI_Valor']].values
-y_inland = df_tierra_adentro.iloc[:, idx_conductividad].values
-modelo_inland = LinearRegression().fit(X_inland, y_inland)
-pendiente_inland = modelo_inland.coef_[0]
-intercepto_inland = modelo_inland.intercept_
-
-# Modelo para "costa"
+y_inland = df_tierra_adentro['ce'].values
 X_coastal = df_costa[['SSI_Valor']].values
-y_coastal = df_costa.iloc[:, idx_conductividad].values
-modelo_coastal = LinearRegression().fit(X_coastal, y_coastal)
-pendiente_coastal = modelo_coastal.coef_[0]
-intercepto_coastal = modelo_coastal.intercept_
+y_coastal = df_costa['ce'].values
+
+# Las dos rectas se ajustan a la vez, en forma cerrada (ver regresion.py)
+df_zonas = pd.concat([df_tierra_adentro, df_costa])
+with instrumentacion.etapa('ajuste', zonas=2, puntos=len(df_zonas)):
+    tabla_modelos = regresion.ajustar_tabla(df_zonas, 'SSI_Valor', 'ce', 'ubicacion', intervalos=args.intervalos,
+                                            repeticiones=args.repeticiones,
+                                            confianza=args.confianza).set_index('ubicacion')
+modelo_inland = tabla_modelos.loc['tierra_adentro']
+modelo_coastal = tabla_modelos.loc['costa']
+pendiente_inland = modelo_inland['pendiente']
+intercepto_inland = modelo_inland['intercepto']
+pendiente_coastal = modelo_coastal['pendiente']
+intercepto_coastal = modelo_coastal['intercepto']
 
 print("\n--- Modelos de Calibración ---")
-print(f"Modelo TIERRA ADENTRO: µS/cm = {pendiente_inland:.2f} * SSI + {intercepto_inland:.2f}")
-print(f"Coeficiente R²: {modelo_inland.score(X_inland, y_inland):.2f}")
-print("\n")
-print(f"Modelo COSTA: µS/cm = {pendiente_coastal:.2f} * SSI + {intercepto_coastal:.2f}")
-print(f"Coeficiente R²: {modelo_coastal.score(X_coastal, y_coastal):.2f}")
+for titulo, modelo_zona in (('TIERRA ADENTRO', modelo_inland), ('COSTA', modelo_coastal)):
+    print(f"Modelo {titulo}: µS/cm = {modelo_zona['pendiente']:.2f} * SSI + {modelo_zona['intercepto']:.2f}")
+    print(f"Coeficiente R²: {modelo_zona['r2']:.2f} (dejando uno fuera: {modelo_zona['r2_loo']:.2f})")
+    if args.intervalos:
+        print(f"Intervalo {args.confianza:.0%} ({args.intervalos}) de la pendiente: "
+              f"[{modelo_zona['pendiente_inf']:.2f}, {modelo_zona['pendiente_sup']:.2f}]")
+    if titulo != 'COSTA':
+        print("\n")
 
-plt.figure(figsize=(10, 6))
-plt.scatter(X_inland, y_inland, color='blue', label='Puntos Tierra Adentro')
-plt.plot(X_inland, modelo_inland.predict(X_inland), color='blue', linewidth=2, linestyle='--', label='Línea de Regresión T.Adentro')
+# El tiempo de plt.show() depende de cuándo se cierre la ventana y no se mide
+with instrumentacion.etapa('grafico'):
+    plt.figure(figsize=(10, 6))
+    plt.scatter(X_inland, y_inland, color='blue', label='Puntos Tierra Adentro')
+    plt.plot(X_inland, pendiente_inland * X_inland + intercepto_inland, color='blue', linewidth=2, linestyle='--', label='Línea de Regresión T.Adentro')
 
-plt.scatter(X_coastal, y_coastal, color='red', label='Puntos Costa')
-plt.plot(X_coastal, modelo_coastal.predict(X_coastal), color='red', linewidth=2, linestyle='--', label='Línea de Regresión Costa')
+    plt.scatter(X_coastal, y_coastal, color='red', label='Puntos Costa')
+    plt.plot(X_coastal, pendiente_coastal * X_coastal + intercepto_coastal, color='red', linewidth=2, linestyle='--', label='Línea de Regresión Costa')
 
-plt.xlabel('Valor del Índice SSI')
-plt.ylabel('Conductividad del Suelo (µS/cm)')
-plt.title('Calibración de Salinidad por Segmentos')
-plt.legend()
-plt.grid(True)
+    plt.xlabel('Valor del Índice SSI')
+    plt.ylabel('Conductividad del Suelo (µS/cm)')
+    plt.title('Calibración de Salinidad por Segmentos')
+    plt.legend()
+    plt.grid(True)
 plt.show()
 
 print("La calibración se completó y se generó el gráfico.")
\ No newline at end of file
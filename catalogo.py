@@ -0,0 +1,230 @@
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import rasterio
+
+from escenas import agrupar_escenas, interpretar_nombre_banda
+
+# Extensiones de los rásteres que se catalogan (GeoTIFF y las bandas JP2 de los SAFE)
+EXTENSIONES = ('.tif', '.tiff', '.jp2')
+
+# Nombre del catalogo por defecto, en la carpeta raíz que se recorre
+NOMBRE_CATALOGO = 'catalogo_rasteres.sqlite'
+
+# Hilos que abren los rásteres nuevos o modificados (la mayor parte del tiempo es espera de disco)
+WORKERS = 8
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS rasteres (
+    ruta TEXT PRIMARY KEY,
+    carpeta TEXT NOT NULL,
+    nombre TEXT NOT NULL,
+    tamano INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    tile TEXT,
+    fecha TEXT,
+    banda TEXT,
+    resolucion_nombre TEXT,
+    crs TEXT,
+    transformacion TEXT,
+    izquierda REAL,
+    abajo REAL,
+    derecha REAL,
+    arriba REAL,
+    ancho INTEGER,
+    alto INTEGER,
+    n_bandas INTEGER,
+    dtype TEXT,
+    nodata REAL,
+    resolucion_x REAL,
+    resolucion_y REAL,
+    bloque_x INTEGER,
+    bloque_y INTEGER,
+    overviews TEXT,
+    compresion TEXT,
+    error TEXT,
+    catalogado TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rasteres_escena ON rasteres (tile, fecha, banda);
+CREATE INDEX IF NOT EXISTS rasteres_carpeta ON rasteres (carpeta);
+"""
+
+COLUMNAS = ('ruta', 'carpeta', 'nombre', 'tamano', 'mtime_ns', 'tile', 'fecha', 'banda', 'resolucion_nombre',
+            'crs', 'transformacion', 'izquierda', 'abajo', 'derecha', 'arriba', 'ancho', 'alto', 'n_bandas',
+            'dtype', 'nodata', 'resolucion_x', 'resolucion_y', 'bloque_x', 'bloque_y', 'overviews',
+            'compresion', 'error', 'catalogado')
+
+
+def recorrer(raiz, extensiones=EXTENSIONES):
+    """
+    Rásteres bajo `raiz` (recursivo) como (ruta, tamaño, mtime en ns).
+
+    Usa os.scandir: en Windows el tamaño y la fecha vienen con el listado del
+    directorio, sin abrir ni consultar cada archivo.
+    """
+    pendientes = [raiz]
+    while pendientes:
+        carpeta = pendientes.pop()
+        try:
+            entradas = list(os.scandir(carpeta))
+        except OSError:
+            continue
+        for entrada in entradas:
+            if entrada.is_dir(follow_symlinks=False):
+                pendientes.append(entrada.path)
+            elif entrada.name.lower().endswith(extensiones):
+                estado = entrada.stat()
+                yield os.path.abspath(entrada.path), estado.st_size, estado.st_mtime_ns
+
+
+def leer_metadatos(ruta, tamano, mtime_ns):
+    """Fila del catálogo para un raster; si no se puede abrir, la fila lleva el error."""
+    fila = dict.fromkeys(COLUMNAS)
+    fila.update(ruta=ruta, carpeta=os.path.dirname(ruta), nombre=os.path.basename(ruta), tamano=tamano,
+                mtime_ns=mtime_ns, catalogado=datetime.now().isoformat(timespec='seconds'))
+    datos = interpretar_nombre_banda(ruta)
+    if datos is not None:
+        tile, fecha, banda, resolucion = datos
+        fila.update(tile=tile, fecha=fecha.isoformat(), banda=banda, resolucion_nombre=resolucion)
+    try:
+        with rasterio.open(ruta) as src:
+            bloque_y, bloque_x = src.block_shapes[0]
+            fila.update(
+                crs=src.crs.to_string() if src.crs else None,
+                transformacion=json.dumps(list(src.transform)[:6]),
+                izquierda=src.bounds.left, abajo=src.bounds.bottom,
+                derecha=src.bounds.right, arriba=src.bounds.top,
+                ancho=src.width, alto=src.height, n_bandas=src.count,
+                dtype=src.dtypes[0], nodata=src.nodata,
+                resolucion_x=src.transform.a, resolucion_y=-src.transform.e,
+                bloque_x=bloque_x, bloque_y=bloque_y,
+                overviews=json.dumps(src.overviews(1)),
+                compresion=src.compression.name if src.compression else None,
+            )
+    except Exception as e:
+        # El error queda en el catálogo: el archivo no se vuelve a abrir hasta que cambie
+        fila['error'] = str(e)
+    return fila
+
+
+class Catalogo:
+    """
+    Índice persistente (SQLite) de los metadatos de los rásteres de un archivo de escenas.
+
+    `actualizar` recorre las carpetas y solo abre los archivos nuevos o cuyo
+    tamaño o fecha de modificación han cambiado; los que ya no existen se
+    borran del catálogo. Las consultas no tocan los rásteres.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.conexion = sqlite3.connect(ruta)
+        self.conexion.row_factory = sqlite3.Row
+        self.conexion.executescript(ESQUEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, error, traza):
+        self.cerrar()
+        return False
+
+    def cerrar(self):
+        self.conexion.close()
+
+    def actualizar(self, raices, workers=WORKERS, extensiones=EXTENSIONES):
+        """
+        Pone al día el catálogo con los rásteres bajo `raices` (una ruta o una lista).
+
+        Devuelve un dict con el número de archivos nuevos, modificados, sin
+        cambios, eliminados y con error de lectura.
+        """
+        if isinstance(raices, str):
+            raices = [raices]
+        resumen = {'nuevos': 0, 'modificados': 0, 'sin_cambios': 0, 'eliminados': 0, 'errores': 0}
+        for raiz in raices:
+            raiz = os.path.abspath(raiz)
+            # Las columnas de ruta se comparan como texto: el prefijo acota la raíz
+            prefijo = os.path.join(raiz, '')
+            conocidos = {fila['ruta']: (fila['tamano'], fila['mtime_ns']) for fila in self.conexion.execute(
+                'SELECT ruta, tamano, mtime_ns FROM rasteres WHERE substr(ruta, 1, ?) = ?',
+                (len(prefijo), prefijo))}
+
+            pendientes = []
+            for ruta, tamano, mtime_ns in recorrer(raiz, extensiones):
+                anterior = conocidos.pop(ruta, None)
+                if anterior == (tamano, mtime_ns):
+                    resumen['sin_cambios'] += 1
+                    continue
+                resumen['nuevos' if anterior is None else 'modificados'] += 1
+                pendientes.append((ruta, tamano, mtime_ns))
+
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as ejecutor:
+                filas = list(ejecutor.map(lambda archivo: leer_metadatos(*archivo), pendientes))
+            resumen['errores'] += sum(fila['error'] is not None for fila in filas)
+            resumen['eliminados'] += len(conocidos)
+
+            # Todo lo de la raíz en una sola transacción; SQLite solo se usa desde este hilo
+            with self.conexion:
+                self.conexion.executemany(
+                    f"INSERT OR REPLACE INTO rasteres ({', '.join(COLUMNAS)}) "
+                    f"VALUES ({', '.join('?' * len(COLUMNAS))})",
+                    [tuple(fila[columna] for columna in COLUMNAS) for fila in filas])
+                self.conexion.executemany('DELETE FROM rasteres WHERE ruta = ?', [(ruta,) for ruta in conocidos])
+        return resumen
+
+    def consultar(self, raiz=None, tile=None, fecha=None, banda=None, resolucion=None, con_error=False):
+        """
+        Filas del catálogo (sqlite3.Row) que cumplen los filtros, ordenadas por ruta.
+
+        fecha: datetime o texto ISO (p. ej. '2025-07-21T15:27:21'); resolucion:
+        la del nombre del archivo (p. ej. '10m'). Por defecto se omiten los
+        archivos que no se pudieron leer.
+        """
+        condiciones, valores = [], []
+        if raiz is not None:
+            prefijo = os.path.join(os.path.abspath(raiz), '')
+            condiciones.append('substr(ruta, 1, ?) = ?')
+            valores += [len(prefijo), prefijo]
+        for columna, valor in (('tile', tile), ('banda', banda), ('resolucion_nombre', resolucion)):
+            if valor is not None:
+                condiciones.append(f'{columna} = ?')
+                valores.append(valor)
+        if fecha is not None:
+            condiciones.append('fecha = ?')
+            valores.append(fecha.isoformat() if isinstance(fecha, datetime) else fecha)
+        if not con_error:
+            condiciones.append('error IS NULL')
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+        return self.conexion.execute(f'SELECT * FROM rasteres {donde} ORDER BY ruta', valores).fetchall()
+
+    def rutas_bandas(self, tile, fecha, bandas, resolucion='10m'):
+        """
+        Rutas de las bandas pedidas de una adquisición (las de menor resolución si
+        no las hay en `resolucion`, ver escenas.agrupar_escenas); lanza
+        FileNotFoundError si falta alguna.
+        """
+        escenas = agrupar_escenas([fila['ruta'] for fila in self.consultar(tile=tile, fecha=fecha)], resolucion)
+        if not escenas:
+            raise FileNotFoundError(f"El catálogo no tiene bandas del tile {tile} en {fecha}")
+        return escenas[0].rutas_bandas(bandas)
+
+    def escenas(self, raiz=None, resolucion='10m'):
+        """Escenas catalogadas (como escenas.descubrir_escenas), ordenadas por tile y fecha."""
+        return agrupar_escenas([fila['ruta'] for fila in self.consultar(raiz=raiz) if fila['tile'] is not None],
+                               resolucion)
+
+
+def ruta_por_defecto(raiz):
+    """Catálogo por defecto: NOMBRE_CATALOGO en la carpeta raíz."""
+    return os.path.join(os.path.abspath(raiz), NOMBRE_CATALOGO)
+
+
+def escenas_catalogadas(raiz, ruta_catalogo=None, resolucion='10m', workers=WORKERS):
+    """Actualiza el catálogo de `raiz` y devuelve sus escenas; sustituye a descubrir_escenas."""
+    with Catalogo(ruta_catalogo or ruta_por_defecto(raiz)) as catalogo:
+        catalogo.actualizar(raiz, workers=workers)
+        return catalogo.escenas(raiz=raiz, resolucion=resolucion)
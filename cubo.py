@@ -0,0 +1,236 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.windows import Window
+
+import escritura
+from cache import huella_archivo
+from instrumentacion import parcial
+
+# Lado de los bloques espaciales del cubo. Cada bloque es un archivo con todas sus
+# fechas seguidas (fecha, fila, columna), así que añadir una fecha solo escribe al
+# final de cada archivo y leer la serie de un bloque es una lectura contigua
+TAMANO_BLOQUE = 256
+
+NOMBRE_METADATOS = 'cubo.json'
+
+ESTADISTICAS = ('media', 'desviacion', 'minimo', 'maximo', 'pendiente', 'n')
+
+DIAS_POR_ANIO = 365.25
+
+
+class CuboTemporal:
+    """
+    Serie temporal de un índice sobre la malla de un tile, guardada por bloques en `directorio`.
+
+    Los bloques se leen como np.memmap de forma (fechas, alto, ancho) y float32.
+    cubo.json guarda la malla, el orden de las fechas y la huella del raster de
+    cada fecha.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        with open(os.path.join(directorio, NOMBRE_METADATOS), encoding='utf-8') as f:
+            self.metadatos = json.load(f)
+        self.alto = self.metadatos['alto']
+        self.ancho = self.metadatos['ancho']
+        self.tamano_bloque = self.metadatos['tamano_bloque']
+        self.transform = Affine(*self.metadatos['transform'])
+        self.crs = CRS.from_wkt(self.metadatos['crs']) if self.metadatos['crs'] else None
+
+    @classmethod
+    def abrir_o_crear(cls, directorio, ruta_referencia, tamano_bloque=TAMANO_BLOQUE):
+        """Abre el cubo de `directorio` o lo crea vacío con la malla de `ruta_referencia`."""
+        if not os.path.exists(os.path.join(directorio, NOMBRE_METADATOS)):
+            with rasterio.open(ruta_referencia) as src:
+                metadatos = {
+                    'alto': src.height,
+                    'ancho': src.width,
+                    'transform': list(src.transform)[:6],
+                    'crs': src.crs.to_wkt() if src.crs else None,
+                    'tamano_bloque': tamano_bloque,
+                    'fechas': [],
+                    'huellas': [],
+                }
+            os.makedirs(directorio, exist_ok=True)
+            with open(os.path.join(directorio, NOMBRE_METADATOS), 'w', encoding='utf-8') as f:
+                json.dump(metadatos, f, indent=2)
+        return cls(directorio)
+
+    @property
+    def fechas(self):
+        return [datetime.fromisoformat(fecha) for fecha in self.metadatos['fechas']]
+
+    def bloques(self):
+        """Ventanas (Window) de los bloques del cubo."""
+        for fila in range(0, self.alto, self.tamano_bloque):
+            for col in range(0, self.ancho, self.tamano_bloque):
+                yield Window(col, fila, min(self.tamano_bloque, self.ancho - col),
+                             min(self.tamano_bloque, self.alto - fila))
+
+    def _ruta_bloque(self, ventana):
+        return os.path.join(self.directorio,
+                            f'bloque_{ventana.row_off // self.tamano_bloque}_{ventana.col_off // self.tamano_bloque}.f32')
+
+    def leer_bloque(self, ventana):
+        """Serie del bloque como memmap de solo lectura (fechas, alto, ancho)."""
+        n_fechas = len(self.metadatos['fechas'])
+        if n_fechas == 0:
+            return np.empty((0, ventana.height, ventana.width), dtype=np.float32)
+        return np.memmap(self._ruta_bloque(ventana), dtype=np.float32, mode='r',
+                         shape=(n_fechas, ventana.height, ventana.width))
+
+    def _guardar_metadatos(self):
+        ruta = os.path.join(self.directorio, NOMBRE_METADATOS)
+        with open(ruta + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.metadatos, f, indent=2)
+        os.replace(ruta + '.tmp', ruta)
+
+    def agregar(self, ruta_raster, fecha):
+        """
+        Añade (o sustituye) la fecha `fecha` con la banda 1 de `ruta_raster`.
+
+        Solo se lee el raster nuevo y se escribe al final de cada bloque, así que el
+        coste no depende de cuántas fechas tenga ya el cubo. Si la fecha ya está con
+        el mismo raster sin cambios no se hace nada. Devuelve True si el cubo cambió.
+        """
+        clave_fecha = fecha.isoformat()
+        huella = huella_archivo(ruta_raster)
+        fechas = self.metadatos['fechas']
+        if clave_fecha in fechas:
+            posicion = fechas.index(clave_fecha)
+            if self.metadatos['huellas'][posicion] == huella:
+                return False
+        else:
+            posicion = None
+
+        with rasterio.open(ruta_raster) as src:
+            if (src.height, src.width) != (self.alto, self.ancho) or not src.transform.almost_equals(self.transform):
+                raise ValueError(f"'{ruta_raster}' no tiene la misma malla que el cubo de '{self.directorio}'.")
+
+            n_fechas = len(fechas)
+            # Se lee una franja de bloques cada vez: la memoria es de tamano_bloque filas de la escena
+            for fila in range(0, self.alto, self.tamano_bloque):
+                alto = min(self.tamano_bloque, self.alto - fila)
+                franja = src.read(1, window=Window(0, fila, self.ancho, alto), masked=True)
+                franja = franja.astype(np.float32).filled(np.nan)
+                for col in range(0, self.ancho, self.tamano_bloque):
+                    ventana = Window(col, fila, min(self.tamano_bloque, self.ancho - col), alto)
+                    datos = np.ascontiguousarray(franja[:, col:col + ventana.width])
+                    ruta_bloque = self._ruta_bloque(ventana)
+                    if posicion is None:
+                        # Si una escritura anterior se interrumpió, se descarta lo que sobra
+                        with open(ruta_bloque, 'ab') as f:
+                            f.truncate(n_fechas * datos.nbytes)
+                            f.write(datos.tobytes())
+                    else:
+                        bloque = np.memmap(ruta_bloque, dtype=np.float32, mode='r+',
+                                           shape=(n_fechas, ventana.height, ventana.width))
+                        bloque[posicion] = datos
+                        bloque.flush()
+                        del bloque
+
+        if posicion is None:
+            fechas.append(clave_fecha)
+            self.metadatos['huellas'].append(huella)
+        else:
+            self.metadatos['huellas'][posicion] = huella
+        self._guardar_metadatos()
+        return True
+
+
+def _reducir_bloque(serie, anios, nombres):
+    """Estadísticas por píxel de un bloque (fechas, alto, ancho) ignorando NaN."""
+    validos = ~np.isnan(serie)
+    n = validos.sum(axis=0)
+    resultados = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        suma = np.where(validos, serie, 0).sum(axis=0, dtype=np.float64)
+        media = suma / n
+        if 'media' in nombres:
+            resultados['media'] = media
+        if 'desviacion' in nombres:
+            desvio = np.where(validos, serie - media, 0)
+            resultados['desviacion'] = np.sqrt((desvio * desvio).sum(axis=0) / n)
+        if 'minimo' in nombres:
+            resultados['minimo'] = np.where(n > 0, np.where(validos, serie, np.inf).min(axis=0), np.nan)
+        if 'maximo' in nombres:
+            resultados['maximo'] = np.where(n > 0, np.where(validos, serie, -np.inf).max(axis=0), np.nan)
+        if 'pendiente' in nombres:
+            # Recta de mínimos cuadrados de cada píxel frente al tiempo, con sus fechas válidas
+            t = np.where(validos, anios[:, None, None], 0)
+            suma_t = t.sum(axis=0)
+            suma_tt = (t * t).sum(axis=0)
+            suma_ty = (t * np.where(validos, serie, 0)).sum(axis=0)
+            denominador = n * suma_tt - suma_t * suma_t
+            pendiente = (n * suma_ty - suma_t * suma) / denominador
+            resultados['pendiente'] = np.where((n >= 2) & (denominador > 0), pendiente, np.nan)
+        if 'n' in nombres:
+            resultados['n'] = n
+    return resultados
+
+
+def calcular_estadisticas(directorio, rutas_salida, workers=1, formato='GTiff', compresion='DEFLATE'):
+    """
+    Escribe estadísticas por píxel de toda la serie del cubo, recorriéndolo bloque a bloque.
+
+    rutas_salida: dict estadística -> ruta del GeoTIFF (ver ESTADISTICAS).
+    'pendiente' es la tendencia lineal en unidades del índice por año y 'n' el
+    número de fechas válidas del píxel. Los bloques se reducen en `workers` hilos.
+    """
+    desconocidas = set(rutas_salida) - set(ESTADISTICAS)
+    if desconocidas:
+        raise ValueError(f"Estadísticas no válidas: {', '.join(sorted(desconocidas))} "
+                         f"(opciones: {', '.join(ESTADISTICAS)})")
+    cubo = CuboTemporal(directorio)
+    if not cubo.metadatos['fechas']:
+        raise ValueError(f"El cubo de '{directorio}' no tiene fechas.")
+    origen = min(cubo.fechas)
+    anios = np.array([(fecha - origen).total_seconds() / 86400 / DIAS_POR_ANIO for fecha in cubo.fechas])
+
+    perfil = {'driver': 'GTiff', 'dtype': 'float32', 'count': 1, 'width': cubo.ancho, 'height': cubo.alto,
+              'transform': cubo.transform, 'crs': cubo.crs, 'nodata': np.nan}
+    perfil_destino = escritura.perfil_escritura(perfil, formato, compresion)
+    nombres = set(rutas_salida)
+
+    def reducir(ventana):
+        with parcial('lectura') as tramo:
+            serie = np.array(cubo.leer_bloque(ventana))
+            tramo.bytes = serie.nbytes
+        with parcial('calculo'):
+            return ventana, _reducir_bloque(serie, anios, nombres)
+
+    def escribir(ventana, resultados):
+        with parcial('escritura'):
+            for nombre, dst in destinos.items():
+                dst.write(resultados[nombre].astype(np.float32), 1, window=ventana)
+
+    rutas_escritura = {nombre: escritura.ruta_temporal(ruta, formato) for nombre, ruta in rutas_salida.items()}
+    destinos = {nombre: rasterio.open(ruta, 'w', **perfil_destino) for nombre, ruta in rutas_escritura.items()}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ejecutor:
+            # Como en bloques.resultados_por_ventana, como mucho 2 * workers bloques en vuelo
+            pendientes = deque()
+            for ventana in cubo.bloques():
+                pendientes.append(ejecutor.submit(reducir, ventana))
+                if len(pendientes) >= 2 * max(1, workers):
+                    escribir(*pendientes.popleft().result())
+            while pendientes:
+                escribir(*pendientes.popleft().result())
+    finally:
+        for dst in destinos.values():
+            dst.close()
+    for nombre, ruta in rutas_salida.items():
+        escritura.finalizar(rutas_escritura[nombre], ruta, formato, compresion)
+
+
+def ruta_cubo(raiz, indice, tile):
+    """Carpeta del cubo de un índice y un tile dentro de `raiz`."""
+    return os.path.join(raiz, f'{indice}_T{tile}')
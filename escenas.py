@@ -0,0 +1,96 @@
+import glob
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+
+# Nombre de banda de Sentinel-2 L2A: T17LQL_20250721T152721_B04_10m.tif, o .jp2 dentro de un SAFE
+# (S2A_MSIL2A_....SAFE/GRANULE/L2A_.../IMG_DATA/R10m, R20m y R60m); también la clasificación SCL (20 m)
+PATRON_BANDA = re.compile(
+    r'^T(?P<tile>\d{2}[A-Z]{3})_(?P<fecha>\d{8}T\d{6})_(?P<banda>B\d[\dA]|SCL)_(?P<resolucion>\d{2}m)\.(tiff?|jp2)$',
+    re.IGNORECASE
+)
+
+
+@dataclass
+class Escena:
+    """Una adquisición de un tile: sus bandas y la carpeta donde se guardan los productos."""
+
+    tile: str
+    fecha: datetime
+    carpeta: str
+    bandas: dict = field(default_factory=dict)
+
+    @property
+    def identificador(self):
+        return f"T{self.tile}_{self.fecha:%Y%m%dT%H%M%S}"
+
+    def rutas_bandas(self, nombres):
+        """Rutas de las bandas pedidas; lanza FileNotFoundError si falta alguna."""
+        faltantes = [nombre for nombre in nombres if nombre not in self.bandas]
+        if faltantes:
+            raise FileNotFoundError(
+                f"La escena {self.identificador} no tiene las bandas: {', '.join(faltantes)}"
+            )
+        return {nombre: self.bandas[nombre] for nombre in nombres}
+
+
+def interpretar_nombre_banda(ruta):
+    """Devuelve (tile, fecha, banda, resolución) a partir del nombre del archivo, o None."""
+    coincidencia = PATRON_BANDA.match(os.path.basename(ruta))
+    if coincidencia is None:
+        return None
+    fecha = datetime.strptime(coincidencia['fecha'], '%Y%m%dT%H%M%S')
+    return coincidencia['tile'], fecha, coincidencia['banda'], coincidencia['resolucion']
+
+
+def _metros(resolucion):
+    return int(resolucion.rstrip('m'))
+
+
+def agrupar_escenas(rutas, resolucion='10m'):
+    """
+    Agrupa rutas de bandas Sentinel-2 en escenas por tile y fecha.
+
+    De cada banda se usa el archivo con la resolución indicada; si no lo hay, el
+    de la resolución más fina que exista (p. ej. B11 a 20 m, que se remuestrea
+    al leerlo, ver bloques.abrir_en_rejilla). Con la misma resolución se prefiere
+    GeoTIFF a JP2. La carpeta de la escena, donde se guardan los productos, es la
+    de sus bandas en la resolución indicada. Se ignoran las rutas que no son bandas.
+    """
+    objetivo = _metros(resolucion)
+    candidatas = {}
+    for ruta in rutas:
+        datos = interpretar_nombre_banda(ruta)
+        if datos is None:
+            continue
+        tile, fecha, banda, resolucion_banda = datos
+        metros = _metros(resolucion_banda)
+        if metros < objetivo:
+            continue
+        orden = (metros, ruta.lower().endswith('.jp2'))
+        anterior = candidatas.get((tile, fecha, banda))
+        if anterior is None or orden < anterior[0]:
+            candidatas[(tile, fecha, banda)] = (orden, ruta)
+
+    escenas = {}
+    for (tile, fecha, banda), ((metros, _), ruta) in sorted(candidatas.items()):
+        if (tile, fecha) not in escenas:
+            escenas[(tile, fecha)] = Escena(tile, fecha, None)
+        escena = escenas[(tile, fecha)]
+        escena.bandas[banda] = ruta
+        if metros == objetivo and escena.carpeta is None:
+            escena.carpeta = os.path.dirname(ruta)
+
+    # Sin ninguna banda en la resolución indicada no hay rejilla de salida: no es una escena
+    return [escenas[clave] for clave in sorted(escenas) if escenas[clave].carpeta is not None]
+
+
+def descubrir_escenas(raiz, resolucion='10m'):
+    """
+    Busca bandas Sentinel-2 (GeoTIFF o JP2 de un SAFE) bajo `raiz` y las agrupa
+    en escenas por tile y fecha con `agrupar_escenas`.
+
+    Las escenas se devuelven ordenadas por tile y fecha.
+    """
+    return agrupar_escenas(glob.glob(os.path.join(raiz, '**', '*'), recursive=True), resolucion)
@@ -0,0 +1,116 @@
+import os
+
+import numpy as np
+import rasterio
+from rasterio.shutil import copy as copiar_raster
+
+# 'GTiff' mantiene la salida original (mismo perfil que la banda de entrada);
+# 'COG' genera un Cloud-Optimized GeoTIFF comprimido, teselado y con overviews
+FORMATOS = ('GTiff', 'COG')
+COMPRESIONES = ('DEFLATE', 'ZSTD', 'LERC', 'LERC_ZSTD', 'NONE')
+
+# Lado de las teselas internas del COG
+TAMANO_TESELA = 512
+
+# Con estas compresiones se usa el predictor de coma flotante (PREDICTOR=3)
+COMPRESIONES_CON_PREDICTOR = {'DEFLATE', 'ZSTD'}
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos del formato de los rásteres de salida."""
+    parser.add_argument('--formato', choices=FORMATOS, default='GTiff',
+                        help="'GTiff' escribe como hasta ahora; 'COG' genera un Cloud-Optimized GeoTIFF.")
+    parser.add_argument('--compresion', choices=COMPRESIONES, default='DEFLATE',
+                        help='Compresión del COG (por defecto DEFLATE).')
+
+
+def perfil_escritura(perfil_salida, formato='GTiff', compresion='DEFLATE'):
+    """
+    Perfil con el que se escribe el raster por ventanas.
+
+    Para COG se escribe primero un GeoTIFF teselado y comprimido, que después
+    `finalizar` convierte en COG con sus overviews.
+    """
+    if formato == 'GTiff':
+        return perfil_salida
+    if formato != 'COG':
+        raise ValueError(f"Formato no válido: '{formato}' (opciones: {', '.join(FORMATOS)})")
+
+    perfil = perfil_salida.copy()
+    perfil.update(
+        driver='GTiff',
+        tiled=True,
+        blockxsize=TAMANO_TESELA,
+        blockysize=TAMANO_TESELA,
+        BIGTIFF='IF_SAFER',
+    )
+    # Los píxeles sin dato de los índices son NaN; declararlo evita que las overviews los promedien
+    if np.issubdtype(np.dtype(perfil['dtype']), np.floating):
+        perfil['nodata'] = np.nan
+    perfil.pop('compress', None)
+    perfil.pop('predictor', None)
+    if compresion != 'NONE':
+        perfil['compress'] = compresion
+        if compresion in COMPRESIONES_CON_PREDICTOR:
+            perfil['predictor'] = 3 if np.issubdtype(np.dtype(perfil['dtype']), np.floating) else 2
+    return perfil
+
+
+def ruta_temporal(ruta_salida, formato='GTiff'):
+    """Ruta en la que se escribe por ventanas antes de `finalizar`."""
+    if formato == 'GTiff':
+        return ruta_salida
+    return ruta_salida + '.tmp.tif'
+
+
+def finalizar(ruta_escrita, ruta_salida, formato='GTiff', compresion='DEFLATE'):
+    """Convierte el archivo escrito por ventanas en el producto final (COG con overviews)."""
+    if formato == 'GTiff':
+        return
+    try:
+        copiar_raster(ruta_escrita, ruta_salida, driver='COG', **_opciones_cog(compresion))
+    finally:
+        os.remove(ruta_escrita)
+
+
+def _opciones_cog(compresion):
+    opciones = {
+        'BLOCKSIZE': TAMANO_TESELA,
+        'COMPRESS': compresion,
+        'OVERVIEWS': 'AUTO',
+        'OVERVIEW_RESAMPLING': 'AVERAGE',
+        'BIGTIFF': 'IF_SAFER',
+        'NUM_THREADS': 'ALL_CPUS',
+    }
+    if compresion in COMPRESIONES_CON_PREDICTOR:
+        opciones['PREDICTOR'] = 'YES'
+    return opciones
+
+
+def guardar_copia(ruta_origen, ruta_salida, formato='GTiff', compresion='DEFLATE'):
+    """
+    Guarda en disco un raster ya calculado (p. ej. en memoria, /vsimem) con el formato indicado.
+
+    Con 'GTiff' se conserva la organización del original (teselas o tiras,
+    compresión y predictor), así que el archivo es el mismo que si se hubiera
+    escrito directamente en disco.
+    """
+    if formato == 'COG':
+        copiar_raster(ruta_origen, ruta_salida, driver='COG', **_opciones_cog(compresion))
+        return
+    with rasterio.open(ruta_origen) as src:
+        perfil = src.profile
+        estructura = src.tags(ns='IMAGE_STRUCTURE')
+    opciones = {clave: perfil[clave] for clave in ('tiled', 'blockxsize', 'blockysize', 'compress', 'interleave')
+                if clave in perfil}
+    if 'PREDICTOR' in estructura:
+        opciones['predictor'] = estructura['PREDICTOR']
+    copiar_raster(ruta_origen, ruta_salida, driver='GTiff', **opciones)
+
+
+def escribir_raster(ruta_salida, datos, perfil_salida, formato='GTiff', compresion='DEFLATE'):
+    """Escribe un array completo de una banda con el formato indicado."""
+    ruta = ruta_temporal(ruta_salida, formato)
+    with rasterio.open(ruta, 'w', **perfil_escritura(perfil_salida, formato, compresion)) as dst:
+        dst.write(datos, 1)
+    finalizar(ruta, ruta_salida, formato, compresion)
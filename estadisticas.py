@@ -0,0 +1,199 @@
+import json
+
+import numpy as np
+import rasterio
+
+import bloques
+from cache import SUFIJO_ESTADISTICAS, en_memoria, huella_archivo
+
+# Intervalos del histograma (par: al ampliarlo se juntan de dos en dos)
+INTERVALOS = 1024
+
+# Percentiles que se anotan en el resumen; cualquier otro se saca del histograma
+PERCENTILES_RESUMEN = (1, 2, 5, 25, 50, 75, 95, 98, 99)
+
+# Estiramiento de color por defecto de los mapas: percentiles 2 y 98
+ESTIRAMIENTO = (2, 98)
+
+# Estadísticas de los rásteres en memoria (/vsimem), que no tienen carpeta donde dejar el archivo
+_en_memoria = {}
+
+
+def agregar_argumentos(parser, defecto=None):
+    """Opciones de línea de comandos del estiramiento de color por percentiles."""
+    parser.add_argument('--estiramiento', nargs=2, type=float, metavar=('INF', 'SUP'), default=defecto,
+                        help='Percentiles entre los que se estira la escala de color, leídos de las estadísticas '
+                             'del producto sin recorrer el raster (p. ej. 2 98; 0 100 es el mínimo y el máximo).')
+
+
+class Acumulador:
+    """
+    Estadísticas de un raster que se van acumulando ventana a ventana mientras se escribe.
+
+    Lleva n, media y suma de cuadrados (fórmula de Chan para juntar bloques),
+    mínimo, máximo y un histograma de INTERVALOS intervalos de igual ancho. El
+    rango del histograma sale del primer bloque y, cuando llega un valor fuera
+    de él, se duplica el ancho juntando los intervalos de dos en dos, así que
+    nunca hace falta una segunda pasada. Se ignoran NaN, infinitos y `nodata`.
+    """
+
+    def __init__(self, nodata=None, intervalos=INTERVALOS):
+        self.nodata = None if nodata is None or np.isnan(nodata) else nodata
+        self.intervalos = intervalos
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.minimo = np.inf
+        self.maximo = -np.inf
+        self.origen = None
+        self.ancho = None
+        self.cuentas = np.zeros(intervalos, dtype=np.int64)
+
+    def agregar(self, valores):
+        valores = np.asarray(valores).ravel()
+        if np.issubdtype(valores.dtype, np.floating):
+            valores = valores[np.isfinite(valores)]
+        if self.nodata is not None:
+            valores = valores[valores != self.nodata]
+        if valores.size == 0:
+            return
+        valores = valores.astype(np.float64, copy=False)
+
+        n = valores.size
+        media = valores.mean()
+        m2 = np.square(valores - media).sum()
+        delta = media - self.media
+        total = self.n + n
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.media += delta * n / total
+        self.n = total
+        minimo, maximo = valores.min(), valores.max()
+        self.minimo = min(self.minimo, float(minimo))
+        self.maximo = max(self.maximo, float(maximo))
+
+        if self.origen is None:
+            self.origen = float(minimo)
+            rango = float(maximo) - self.origen
+            self.ancho = rango / (self.intervalos - 1) if rango > 0 else max(abs(self.origen), 1.0) * 2.0 ** -20
+        self._ampliar(minimo, maximo)
+        posiciones = ((valores - self.origen) / self.ancho).astype(np.int64)
+        np.clip(posiciones, 0, self.intervalos - 1, out=posiciones)
+        self.cuentas += np.bincount(posiciones, minlength=self.intervalos)
+
+    def _ampliar(self, minimo, maximo):
+        mitad = self.intervalos // 2
+        while minimo < self.origen or maximo >= self.origen + self.ancho * self.intervalos:
+            juntas = self.cuentas.reshape(mitad, 2).sum(axis=1)
+            self.cuentas = np.zeros_like(self.cuentas)
+            if minimo < self.origen:
+                # Se amplía por abajo: el rango anterior pasa a ser la mitad superior
+                self.origen -= self.ancho * self.intervalos
+                self.cuentas[mitad:] = juntas
+            else:
+                self.cuentas[:mitad] = juntas
+            self.ancho *= 2
+
+    def resumen(self):
+        """dict con n, mínimo, máximo, media, desviación típica, percentiles e histograma (None si no hay datos)."""
+        if self.n == 0:
+            return None
+        resumen = {
+            'n': self.n,
+            'minimo': self.minimo,
+            'maximo': self.maximo,
+            'media': self.media,
+            'desviacion': float(np.sqrt(self.m2 / self.n)),
+            'histograma': {'origen': self.origen, 'ancho': self.ancho, 'cuentas': self.cuentas.tolist()},
+        }
+        resumen['percentiles'] = {str(p): percentil(resumen, p) for p in PERCENTILES_RESUMEN}
+        return resumen
+
+
+def _valor_de_posicion(cuentas, acumuladas, origen, ancho, posicion):
+    """Valor aproximado del elemento `posicion` (0 = el menor), repartiendo cada intervalo uniformemente."""
+    intervalo = int(np.searchsorted(acumuladas, posicion, side='right'))
+    anteriores = acumuladas[intervalo - 1] if intervalo > 0 else 0
+    fraccion = (posicion - anteriores + 0.5) / cuentas[intervalo]
+    return origen + (intervalo + fraccion) * ancho
+
+
+def percentil(resumen, p):
+    """
+    Percentil `p` (0-100) a partir del histograma del resumen, con la interpolación lineal de np.percentile.
+
+    El error es como mucho el ancho de un intervalo; 0 y 100 son el mínimo y el máximo exactos.
+    """
+    if p <= 0:
+        return resumen['minimo']
+    if p >= 100:
+        return resumen['maximo']
+    histograma = resumen['histograma']
+    cuentas = np.asarray(histograma['cuentas'])
+    acumuladas = np.cumsum(cuentas)
+    posicion = p / 100 * (resumen['n'] - 1)
+    inferior = _valor_de_posicion(cuentas, acumuladas, histograma['origen'], histograma['ancho'], np.floor(posicion))
+    superior = _valor_de_posicion(cuentas, acumuladas, histograma['origen'], histograma['ancho'], np.ceil(posicion))
+    valor = inferior + (posicion - np.floor(posicion)) * (superior - inferior)
+    return float(min(max(valor, resumen['minimo']), resumen['maximo']))
+
+
+def ruta_estadisticas(ruta_producto):
+    return ruta_producto + SUFIJO_ESTADISTICAS
+
+
+def guardar(ruta_producto, resumen):
+    """Guarda el resumen junto al producto, con su tamaño y fecha para saber si sigue vigente."""
+    if en_memoria(ruta_producto):
+        _en_memoria[ruta_producto] = resumen
+        return
+    registro = {'huella': huella_archivo(ruta_producto), 'estadisticas': resumen}
+    with open(ruta_estadisticas(ruta_producto), 'w', encoding='utf-8') as f:
+        json.dump(registro, f)
+
+
+def leer(ruta_producto):
+    """Resumen guardado del producto, o None si no lo hay o el producto ha cambiado desde entonces."""
+    if en_memoria(ruta_producto):
+        return _en_memoria.get(ruta_producto)
+    try:
+        with open(ruta_estadisticas(ruta_producto), encoding='utf-8') as f:
+            registro = json.load(f)
+        if registro.get('huella') != huella_archivo(ruta_producto):
+            return None
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return registro.get('estadisticas')
+
+
+def calcular(ruta_producto, tamano_ventana=None):
+    """Recorre el raster por ventanas, guarda su resumen y lo devuelve (para productos sin estadísticas)."""
+    with rasterio.open(ruta_producto) as src:
+        acumulador = Acumulador(src.nodata)
+        for ventana in bloques.ventanas(src, tamano_ventana):
+            acumulador.agregar(src.read(1, window=ventana))
+    resumen = acumulador.resumen()
+    guardar(ruta_producto, resumen)
+    return resumen
+
+
+def obtener(ruta_producto):
+    """Resumen del producto: el guardado al escribirlo o, si no lo hay, uno calculado en una pasada."""
+    resumen = leer(ruta_producto)
+    if resumen is None:
+        resumen = calcular(ruta_producto)
+    return resumen
+
+
+def rango_estiramiento(ruta_producto, inferior=ESTIRAMIENTO[0], superior=ESTIRAMIENTO[1]):
+    """(vmin, vmax) de la escala de color entre los percentiles `inferior` y `superior` del producto."""
+    resumen = obtener(ruta_producto)
+    if resumen is None:
+        return np.nan, np.nan
+    return percentil(resumen, inferior), percentil(resumen, superior)
+
+
+def copiar(ruta_origen, ruta_destino):
+    """Pasa el resumen de un raster a su copia (p. ej. de /vsimem a disco), si lo tiene."""
+    resumen = leer(ruta_origen)
+    if resumen is not None:
+        guardar(ruta_destino, resumen)
@@ -0,0 +1,74 @@
+import os
+import argparse
+
+import cache
+import estadisticas_zonales
+import instrumentacion
+import zonas
+
+# --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
+ruta_carpeta = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m'
+
+# Capa de parcelas (GeoJSON, o Shapefile/GeoPackage con fiona) y campo con el identificador de cada parcela
+ruta_parcelas = r'D:\INFORMES-PECH\2025\AGOSTO\PARCELAS\parcelas_riego.geojson'
+campo_parcela = 'id_parcela'
+
+# Mapas de los que se resumen los valores de cada parcela (en la misma malla)
+productos = {
+    'SSI': os.path.join(ruta_carpeta, 'SSI_final.tiff'),
+    'CALIBRADO': os.path.join(ruta_carpeta, 'SSI_calibrado_uScm.tiff'),
+}
+
+# Tabla de salida: .csv o .parquet
+ruta_tabla = os.path.join(ruta_carpeta, 'estadisticas_parcelas.csv')
+
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Resume los mapas de SSI por parcela (media, desviación, percentiles...).')
+parser.add_argument('--productos', nargs='+', choices=sorted(productos), default=sorted(productos),
+                    help='Mapas que se resumen (por defecto todos los de la configuración).')
+parser.add_argument('--parcelas', default=ruta_parcelas, help='Capa vectorial de las parcelas.')
+parser.add_argument('--campo', default=campo_parcela, help='Campo con el identificador de cada parcela.')
+parser.add_argument('--salida', default=ruta_tabla, help='Tabla de salida (.csv o .parquet).')
+estadisticas_zonales.agregar_argumentos(parser)
+cache.agregar_argumentos(parser)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'estadisticas_parcelas')
+
+rutas_valores = {nombre: productos[nombre] for nombre in args.productos}
+
+try:
+    # --- 2. PARCELAS A RASTER DE ETIQUETAS ---
+    # Se rasterizan una sola vez sobre la malla del primer mapa; mientras no cambie la capa se reutiliza
+    with instrumentacion.etapa('rasterizado'):
+        parcelas = zonas.zonas_poligonos(args.parcelas, args.campo, next(iter(rutas_valores.values())))
+    print(f"{len(parcelas.nombres)} parcelas en: {parcelas.ruta_etiquetas}")
+
+    # --- 3. ESTADÍSTICAS POR PARCELA ---
+    # Los mapas se leen por ventanas junto con las etiquetas y se resumen por parcela
+    with instrumentacion.etapa('estadisticas', parcelas=len(parcelas.nombres)):
+        tabla, recalculada = estadisticas_zonales.estadisticas_en_tabla(
+            rutas_valores,
+            parcelas,
+            args.salida,
+            percentiles=args.percentiles,
+            workers=args.workers,
+            usar_procesos=args.procesos,
+            usar_cache=not args.forzar,
+            hash_contenido=args.hash_entradas
+        )
+    if recalculada:
+        print(f"Estadísticas de {len(parcelas.nombres)} parcelas guardadas en: {args.salida}")
+    else:
+        print(f"Las estadísticas ya estaban actualizadas, se reutilizan: {args.salida}")
+
+    sin_datos = tabla.groupby('zona')['area_ha'].sum() == 0
+    if sin_datos.any():
+        print(f"Aviso: {int(sin_datos.sum())} parcelas no tienen ningún píxel con dato (fuera del mapa o sin dato).")
+
+except FileNotFoundError as e:
+    print(f"Error: No se encontró un archivo de entrada: {e}")
+except KeyError as e:
+    print(f"Error: La capa de parcelas no tiene el campo {e}.")
+except Exception as e:
+    print(f"Ocurrió un error inesperado: {e}")
@@ -0,0 +1,246 @@
+import os
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import rasterio
+
+from bloques import rejilla, misma_rejilla, resultados_por_ventana, ventanas
+from cache import clave_cache, producto_vigente, registrar_producto
+
+# Percentiles por defecto de cada zona
+PERCENTILES = (10, 50, 90)
+
+# Intervalos del histograma de cada zona con que se estiman los percentiles: el error es como
+# mucho (máximo - mínimo) / INTERVALOS_PERCENTILES de la zona
+INTERVALOS_PERCENTILES = 512
+
+# Formatos de exportación de la tabla, según la extensión del archivo
+FORMATOS_TABLA = ('.csv', '.parquet')
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos de las estadísticas zonales."""
+    parser.add_argument('--percentiles', nargs='*', type=float, default=list(PERCENTILES),
+                        help='Percentiles de cada zona (por defecto 10 50 90; sin valores no se calculan y '
+                             'basta una pasada por el raster).')
+    parser.add_argument('--workers', type=int, default=1, help='Número de ventanas en paralelo (por defecto 1).')
+    parser.add_argument('--procesos', action='store_true',
+                        help='Reparte las ventanas entre procesos y no entre hilos (las reducciones agrupadas de '
+                             'NumPy no liberan el GIL; compensa con muchas ventanas).')
+
+
+def _validos(datos, nombre, n_zonas, nodata):
+    """Código de zona y valor (float64) de los píxeles con zona y con dato de la ventana."""
+    codigos = datos['ZONA'].ravel().astype(np.int64)
+    valores = datos[nombre].ravel().astype(np.float64)
+    en_zona = (codigos >= 1) & (codigos <= n_zonas)
+    con_dato = en_zona & np.isfinite(valores)
+    if nodata is not None and not np.isnan(nodata):
+        con_dato &= valores != nodata
+    return codigos, en_zona, con_dato, valores
+
+
+def _momentos_ventana(n_zonas, nodatas, datos):
+    """Por producto: zonas de la ventana con sus píxeles con zona, n, media, M2, mínimo y máximo."""
+    resultado = {}
+    for nombre, nodata in nodatas.items():
+        codigos, en_zona, con_dato, valores = _validos(datos, nombre, n_zonas, nodata)
+        pixeles = np.bincount(codigos[en_zona], minlength=n_zonas + 1)
+        if not con_dato.any():
+            resultado[nombre] = (pixeles, None)
+            continue
+        codigos, valores = codigos[con_dato], valores[con_dato]
+        # Reducciones agrupadas por código de zona; solo se devuelven las zonas presentes en la ventana
+        n = np.bincount(codigos, minlength=n_zonas + 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            media = np.bincount(codigos, valores, n_zonas + 1) / n
+        desvio = valores - media[codigos]
+        m2 = np.bincount(codigos, desvio * desvio, n_zonas + 1)
+        minimo = np.full(n_zonas + 1, np.inf)
+        maximo = np.full(n_zonas + 1, -np.inf)
+        np.minimum.at(minimo, codigos, valores)
+        np.maximum.at(maximo, codigos, valores)
+        zonas = np.flatnonzero(n)
+        resultado[nombre] = (pixeles, (zonas, n[zonas], media[zonas], m2[zonas], minimo[zonas], maximo[zonas]))
+    return resultado
+
+
+def _histograma_ventana(n_zonas, nodatas, limites, datos):
+    """Por producto: (celda, cuenta) del histograma de cada zona, con INTERVALOS_PERCENTILES entre su mínimo y máximo."""
+    resultado = {}
+    for nombre, nodata in nodatas.items():
+        codigos, _, con_dato, valores = _validos(datos, nombre, n_zonas, nodata)
+        codigos, valores = codigos[con_dato], valores[con_dato]
+        minimo, ancho = limites[nombre]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            posicion = (valores - minimo[codigos]) / ancho[codigos] * INTERVALOS_PERCENTILES
+        # Las zonas con un solo valor (ancho 0) van todas al primer intervalo
+        intervalo = np.clip(np.nan_to_num(posicion, nan=0.0), 0, INTERVALOS_PERCENTILES - 1).astype(np.int64)
+        resultado[nombre] = np.unique(codigos * INTERVALOS_PERCENTILES + intervalo, return_counts=True)
+    return resultado
+
+
+def _valor_de_posicion(histograma, acumulado, posicion, n, minimo, ancho):
+    """Valor estimado del dato que ocupa `posicion` (entera, desde 0) entre los datos ordenados de cada zona."""
+    filas = np.arange(len(n))
+    intervalo = (acumulado <= posicion[:, np.newaxis]).sum(axis=1).clip(0, INTERVALOS_PERCENTILES - 1)
+    antes = acumulado[filas, intervalo] - histograma[filas, intervalo]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Dentro del intervalo se suponen los datos repartidos de manera uniforme
+        fraccion = (posicion - antes + 0.5) / histograma[filas, intervalo]
+        valor = minimo + (intervalo + np.clip(fraccion, 0, 1)) * ancho / INTERVALOS_PERCENTILES
+    # El primero y el último son el mínimo y el máximo, que se conocen exactos
+    valor = np.where(posicion <= 0, minimo, valor)
+    return np.where(posicion >= n - 1, minimo + ancho, valor)
+
+
+def _percentiles_histograma(histograma, n, minimo, ancho, percentiles):
+    """Percentil (interpolación lineal, como np.percentile) de cada zona a partir de su histograma."""
+    acumulado = np.cumsum(histograma, axis=1)
+    columnas = {}
+    for percentil in percentiles:
+        posicion = percentil / 100 * np.maximum(n - 1, 0)
+        abajo = np.floor(posicion)
+        inferior = _valor_de_posicion(histograma, acumulado, abajo, n, minimo, ancho)
+        superior = _valor_de_posicion(histograma, acumulado, np.minimum(abajo + 1, np.maximum(n - 1, 0)), n,
+                                      minimo, ancho)
+        valor = inferior + (posicion - abajo) * (superior - inferior)
+        columnas[f'p{percentil:g}'] = np.where(n > 0, valor, np.nan)
+    return columnas
+
+
+def estadisticas_zonales(rutas_valores, zonas, percentiles=PERCENTILES, tamano_ventana=None, workers=1,
+                         usar_procesos=False):
+    """
+    Estadísticas de cada zona (p. ej. parcela) sobre uno o varios rásteres de la misma malla.
+
+    rutas_valores: dict producto -> ruta del raster (p. ej. {'SSI': ..., 'CALIBRADO': ...});
+                   se leen todos a la vez junto con el raster de etiquetas.
+    zonas: zonas.ZonasRaster (p. ej. de zonas.zonas_poligonos), en la misma malla.
+    Los rásteres se recorren ventana a ventana, repartidas en `workers` hilos (o
+    procesos con `usar_procesos`), y
+    cada ventana se resume por zona con reducciones agrupadas; los resúmenes se
+    combinan (fórmula de Chan para la varianza), así que la memoria depende del
+    número de zonas y no del tamaño de la escena. Si hay `percentiles` se hace una
+    segunda pasada con un histograma de cada zona entre su mínimo y su máximo.
+
+    Devuelve un DataFrame con una fila por zona y producto: zona, producto,
+    pixeles (con zona), sin_dato, area_ha (de los píxeles con dato), media,
+    desviacion (muestral), minimo, maximo y p<percentil>.
+    """
+    n_zonas = len(zonas.nombres)
+    rutas = dict(rutas_valores)
+    rutas['ZONA'] = zonas.ruta_etiquetas
+    nodatas = {}
+    with rasterio.open(zonas.ruta_etiquetas) as src:
+        rejilla_zonas = rejilla(src)
+        lista_ventanas = list(ventanas(src, tamano_ventana))
+        area_pixel = abs(src.transform.a * src.transform.e - src.transform.b * src.transform.d)
+    for nombre, ruta in rutas_valores.items():
+        with rasterio.open(ruta) as src:
+            if not misma_rejilla(rejilla(src), rejilla_zonas):
+                raise ValueError(f"El raster '{nombre}' no está en la malla de las zonas ({ruta}).")
+            nodatas[nombre] = src.nodata
+
+    # --- Primera pasada: número de píxeles, media, varianza, mínimo y máximo ---
+    tamano = n_zonas + 1
+    acumulados = {nombre: {'pixeles': np.zeros(tamano, np.int64), 'n': np.zeros(tamano, np.int64),
+                           'media': np.zeros(tamano), 'm2': np.zeros(tamano),
+                           'minimo': np.full(tamano, np.inf), 'maximo': np.full(tamano, -np.inf)}
+                  for nombre in rutas_valores}
+    funcion = partial(_momentos_ventana, n_zonas, nodatas)
+    for _, resultado in resultados_por_ventana(rutas, funcion, lista_ventanas, workers, usar_procesos):
+        for nombre, (pixeles, momentos) in resultado.items():
+            total = acumulados[nombre]
+            total['pixeles'] += pixeles
+            if momentos is None:
+                continue
+            zona, n, media, m2, minimo, maximo = momentos
+            n_antes = total['n'][zona]
+            n_total = n_antes + n
+            delta = media - total['media'][zona]
+            total['media'][zona] += delta * n / n_total
+            total['m2'][zona] += m2 + delta * delta * n_antes * n / n_total
+            total['n'][zona] = n_total
+            total['minimo'][zona] = np.minimum(total['minimo'][zona], minimo)
+            total['maximo'][zona] = np.maximum(total['maximo'][zona], maximo)
+
+    # --- Segunda pasada (opcional): histograma de cada zona para los percentiles ---
+    histogramas = {}
+    if percentiles:
+        limites = {}
+        for nombre, total in acumulados.items():
+            minimo = np.where(total['n'] > 0, total['minimo'], 0.0)
+            limites[nombre] = (minimo, np.where(total['n'] > 0, total['maximo'], 0.0) - minimo)
+            histogramas[nombre] = np.zeros(tamano * INTERVALOS_PERCENTILES, np.int64)
+        funcion = partial(_histograma_ventana, n_zonas, nodatas, limites)
+        for _, resultado in resultados_por_ventana(rutas, funcion, lista_ventanas, workers, usar_procesos):
+            for nombre, (celdas, cuentas) in resultado.items():
+                histogramas[nombre][celdas] += cuentas
+
+    tablas = []
+    for nombre, total in acumulados.items():
+        n = total['n'][1:]
+        con_dato = n > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            desviacion = np.where(n > 1, np.sqrt(total['m2'][1:] / (n - 1)), np.nan)
+        tabla = pd.DataFrame({
+            'zona': zonas.nombres,
+            'producto': nombre,
+            'pixeles': total['pixeles'][1:],
+            'sin_dato': total['pixeles'][1:] - n,
+            'area_ha': n * area_pixel / 10000,
+            'media': np.where(con_dato, total['media'][1:], np.nan),
+            'desviacion': desviacion,
+            'minimo': np.where(con_dato, total['minimo'][1:], np.nan),
+            'maximo': np.where(con_dato, total['maximo'][1:], np.nan),
+        })
+        if percentiles:
+            histograma = histogramas[nombre].reshape(tamano, INTERVALOS_PERCENTILES)[1:]
+            minimo, ancho = (limite[1:] for limite in limites[nombre])
+            for columna, valores in _percentiles_histograma(histograma, n, minimo, ancho, percentiles).items():
+                tabla[columna] = valores
+        tablas.append(tabla)
+    return pd.concat(tablas, ignore_index=True)
+
+
+def _comprobar_formato(ruta):
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension not in FORMATOS_TABLA:
+        raise ValueError(f"Formato de tabla no válido: '{extension}' (opciones: {', '.join(FORMATOS_TABLA)})")
+    return extension
+
+
+def exportar_tabla(tabla, ruta):
+    """Guarda la tabla en CSV o Parquet según la extensión de `ruta`."""
+    if _comprobar_formato(ruta) == '.parquet':
+        tabla.to_parquet(ruta, index=False)
+    else:
+        tabla.to_csv(ruta, index=False)
+
+
+def estadisticas_en_tabla(rutas_valores, zonas, ruta_tabla, percentiles=PERCENTILES, tamano_ventana=None,
+                          workers=1, usar_procesos=False, usar_cache=True, hash_contenido=False):
+    """
+    Calcula `estadisticas_zonales` y las exporta a `ruta_tabla` (CSV o Parquet).
+
+    Con `usar_cache` no se recalculan mientras no cambien los rásteres, las
+    zonas ni los percentiles. Devuelve (tabla, True si se ha recalculado).
+    """
+    # El formato se comprueba antes de recorrer los rásteres
+    _comprobar_formato(ruta_tabla)
+    clave = clave_cache(list(rutas_valores.values()) + [zonas.ruta_etiquetas], 'estadisticas_zonales',
+                        {'productos': list(rutas_valores), 'zonas': zonas.nombres,
+                         'percentiles': [float(p) for p in percentiles]},
+                        hash_contenido)
+    if usar_cache and producto_vigente(ruta_tabla, clave):
+        if ruta_tabla.lower().endswith('.parquet'):
+            return pd.read_parquet(ruta_tabla), False
+        # Los identificadores de parcela son texto aunque parezcan números
+        return pd.read_csv(ruta_tabla, dtype={'zona': str}), False
+
+    tabla = estadisticas_zonales(rutas_valores, zonas, percentiles, tamano_ventana, workers, usar_procesos)
+    exportar_tabla(tabla, ruta_tabla)
+    registrar_producto(ruta_tabla, clave)
+    return tabla, True
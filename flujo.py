@@ -0,0 +1,234 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+
+from rasterio.shutil import delete as borrar_raster
+
+import escritura
+import estadisticas
+import instrumentacion
+from cache import PREFIJO_MEMORIA, clave_cache, en_memoria, producto_vigente, registrar_producto
+
+# Tipos de producto: 'raster' (se pasa como ruta, en memoria si cabe), 'archivo' (siempre en disco,
+# p. ej. un HTML) y 'objeto' (un valor de Python, p. ej. un modelo ajustado)
+TIPOS_PRODUCTO = ('raster', 'archivo', 'objeto')
+
+# Memoria máxima para los rásteres intermedios en /vsimem; lo que no cabe va a una carpeta temporal
+LIMITE_MEMORIA = 4 * 1024 ** 3
+
+
+class Nodo:
+    """
+    Paso del flujo: una función que consume productos de otros pasos y genera los suyos.
+
+    funcion(entradas, salidas, formato, compresion) recibe:
+      entradas: dict producto -> ruta (rásteres y archivos) o valor (objetos);
+      salidas: dict producto -> ruta donde debe escribir cada raster o archivo;
+    y devuelve un dict con los productos de tipo 'objeto' (o None si no tiene).
+    fuentes: archivos de disco que lee directamente (bandas, Excel); junto con
+    `parametros` y las claves de sus entradas forman la clave de caché del paso.
+    """
+
+    def __init__(self, nombre, funcion, salidas, entradas=(), fuentes=(), parametros=None):
+        desconocidos = set(salidas.values()) - set(TIPOS_PRODUCTO)
+        if desconocidos:
+            raise ValueError(f"Tipos de producto no válidos: {', '.join(sorted(desconocidos))} "
+                             f"(opciones: {', '.join(TIPOS_PRODUCTO)})")
+        self.nombre = nombre
+        self.funcion = funcion
+        self.salidas = dict(salidas)
+        self.entradas = list(entradas)
+        self.fuentes = list(fuentes)
+        self.parametros = parametros or {}
+
+
+class Flujo:
+    """
+    Grafo de pasos que se ejecuta en un solo proceso.
+
+    Los rásteres intermedios se pasan de un paso a otro en memoria (/vsimem de
+    GDAL) mientras quepan en `limite_memoria`, y se liberan en cuanto su último
+    consumidor termina; solo se escriben en disco los productos pedidos. Cada
+    paso tiene una clave encadenada con la de sus entradas, así que un producto
+    guardado que sigue vigente no se recalcula ni obliga a recalcular lo anterior.
+
+    Con `directorio_intermedios`, los rásteres intermedios se guardan ahí en vez
+    de en memoria, registrados como intermedios (ver cache.limpiar_cache), y se
+    reutilizan en la siguiente ejecución mientras sigan vigentes.
+    """
+
+    def __init__(self, bytes_raster, limite_memoria=LIMITE_MEMORIA, directorio_temporal=None,
+                 directorio_intermedios=None):
+        self.bytes_raster = bytes_raster
+        self.limite_memoria = limite_memoria
+        self.directorio_temporal = directorio_temporal
+        self.directorio_intermedios = directorio_intermedios
+        self.nodos = []
+        self.productor = {}
+
+    def agregar(self, nodo):
+        """Añade un paso; sus entradas tienen que ser productos de pasos ya añadidos."""
+        faltantes = [producto for producto in nodo.entradas if producto not in self.productor]
+        if faltantes:
+            raise ValueError(f"El paso '{nodo.nombre}' usa productos que ningún paso anterior genera: "
+                             f"{', '.join(faltantes)}")
+        repetidos = [producto for producto in nodo.salidas if producto in self.productor]
+        if repetidos:
+            raise ValueError(f"Productos generados por más de un paso: {', '.join(repetidos)}")
+        self.nodos.append(nodo)
+        for producto in nodo.salidas:
+            self.productor[producto] = nodo
+        return nodo
+
+    def _claves(self, hash_contenido):
+        # Los pasos se añaden en orden de dependencias, así que basta un recorrido
+        claves = {}
+        for nodo in self.nodos:
+            entradas = {producto: claves[self.productor[producto].nombre] for producto in nodo.entradas}
+            claves[nodo.nombre] = clave_cache(nodo.fuentes, nodo.nombre,
+                                              {'parametros': nodo.parametros, 'entradas': entradas},
+                                              hash_contenido)
+        return claves
+
+    @staticmethod
+    def _clave_producto(clave_nodo, producto, formato, compresion):
+        # El formato de guardado forma parte del producto: cambiarlo obliga a reescribirlo
+        return hashlib.sha256(f'{clave_nodo}:{producto}:{formato}:{compresion}'.encode('utf-8')).hexdigest()
+
+    def _ruta_intermedia(self, clave_nodo, producto):
+        # La clave del paso va en el nombre: cada versión del intermedio tiene su propio archivo
+        return os.path.join(self.directorio_intermedios, f'{producto}_{clave_nodo[:16]}.tif')
+
+    def ejecutar(self, pedidos, rutas_guardado, usar_cache=True, hash_contenido=False, formato='GTiff',
+                 compresion='DEFLATE'):
+        """
+        Genera los productos `pedidos` y los guarda en `rutas_guardado` (dict producto -> ruta).
+
+        Solo se ejecutan los pasos necesarios. Devuelve (dict producto pedido -> ruta,
+        lista de pasos ejecutados).
+        """
+        sin_ruta = [producto for producto in pedidos if producto not in rutas_guardado]
+        if sin_ruta:
+            raise ValueError(f"Falta la ruta de guardado de: {', '.join(sin_ruta)}")
+        guardados = {producto: rutas_guardado[producto] for producto in pedidos}
+        for producto in guardados:
+            if self.productor[producto].salidas[producto] == 'objeto':
+                raise ValueError(f"'{producto}' no es un raster ni un archivo y no se puede guardar.")
+
+        claves = self._claves(hash_contenido)
+
+        # --- Qué pasos hay que ejecutar: hacia atrás desde lo pedido, parando en lo vigente ---
+        ejecutar = set()
+        vigentes = {}
+
+        def requerir(producto):
+            nodo = self.productor[producto]
+            if nodo.nombre in ejecutar or producto in vigentes:
+                return
+            ruta = rutas_guardado.get(producto)
+            if (usar_cache and ruta is not None and nodo.salidas[producto] != 'objeto'
+                    and producto_vigente(ruta, self._clave_producto(claves[nodo.nombre], producto, formato, compresion))):
+                vigentes[producto] = ruta
+                return
+            if (usar_cache and producto not in guardados and nodo.salidas[producto] == 'raster'
+                    and self.directorio_intermedios is not None):
+                ruta = self._ruta_intermedia(claves[nodo.nombre], producto)
+                if producto_vigente(ruta, claves[nodo.nombre]):
+                    vigentes[producto] = ruta
+                    return
+            ejecutar.add(nodo.nombre)
+            for entrada in nodo.entradas:
+                requerir(entrada)
+
+        for producto in pedidos:
+            requerir(producto)
+        pasos = [nodo for nodo in self.nodos if nodo.nombre in ejecutar]
+
+        # Consumidores pendientes de cada producto, para liberarlo en cuanto deja de hacer falta
+        consumidores = {}
+        for nodo in pasos:
+            for entrada in nodo.entradas:
+                consumidores[entrada] = consumidores.get(entrada, 0) + 1
+
+        valores = dict(vigentes)
+        en_uso = 0
+        prefijo_memoria = f'{PREFIJO_MEMORIA}flujo_{uuid.uuid4().hex}/'
+        temporal = tempfile.mkdtemp(prefix='flujo_', dir=self.directorio_temporal)
+        temporales = []
+        if self.directorio_intermedios is not None:
+            os.makedirs(self.directorio_intermedios, exist_ok=True)
+
+        def liberar(producto):
+            nonlocal en_uso
+            if self.productor[producto].salidas[producto] != 'raster':
+                valores.pop(producto, None)
+                return
+            ruta = valores[producto]
+            if ruta in temporales:
+                temporales.remove(ruta)
+                if en_memoria(ruta):
+                    borrar_raster(ruta)
+                    en_uso -= self.bytes_raster
+                else:
+                    os.remove(ruta)
+
+        try:
+            for nodo in pasos:
+                rasteres = [producto for producto, tipo in nodo.salidas.items() if tipo == 'raster']
+                intermedios = [producto for producto in rasteres
+                               if self.directorio_intermedios is not None and producto not in guardados]
+                # Todos los rásteres del paso que no se guardan como intermedios van juntos a memoria si
+                # caben; si no, a disco
+                n_memoria = len(rasteres) - len(intermedios)
+                a_memoria = (n_memoria > 0 or not intermedios) and en_uso + n_memoria * self.bytes_raster <= self.limite_memoria
+                salidas = {}
+                for producto, tipo in nodo.salidas.items():
+                    if tipo == 'archivo':
+                        salidas[producto] = rutas_guardado[producto]
+                    elif producto in intermedios:
+                        salidas[producto] = self._ruta_intermedia(claves[nodo.nombre], producto)
+                    elif tipo == 'raster':
+                        if a_memoria:
+                            salidas[producto] = prefijo_memoria + f'{producto}.tif'
+                            en_uso += self.bytes_raster
+                        elif producto in guardados:
+                            salidas[producto] = guardados[producto]
+                        else:
+                            salidas[producto] = os.path.join(temporal, f'{producto}.tif')
+                        if salidas[producto] != guardados.get(producto):
+                            temporales.append(salidas[producto])
+
+                entradas = {producto: valores[producto] for producto in nodo.entradas}
+                # En memoria se escribe GTiff; el formato pedido se aplica al copiarlo a disco
+                campos = {'ubicacion': 'memoria' if a_memoria else 'disco'} if rasteres else {}
+                with instrumentacion.etapa(nodo.nombre, **campos):
+                    objetos = nodo.funcion(entradas, salidas, 'GTiff' if a_memoria else formato, compresion)
+                valores.update(salidas)
+                valores.update(objetos or {})
+
+                for producto, ruta in salidas.items():
+                    if producto in intermedios:
+                        registrar_producto(ruta, claves[nodo.nombre], intermedio=True)
+                    if producto not in guardados:
+                        continue
+                    if ruta != guardados[producto]:
+                        with instrumentacion.etapa('guardado', producto=producto):
+                            escritura.guardar_copia(ruta, guardados[producto], formato, compresion)
+                            estadisticas.copiar(ruta, guardados[producto])
+                    registrar_producto(guardados[producto], self._clave_producto(claves[nodo.nombre], producto, formato, compresion))
+
+                for entrada in nodo.entradas:
+                    consumidores[entrada] -= 1
+                    if consumidores[entrada] == 0:
+                        liberar(entrada)
+        finally:
+            for ruta in list(temporales):
+                if en_memoria(ruta):
+                    borrar_raster(ruta)
+                elif os.path.exists(ruta):
+                    os.remove(ruta)
+            shutil.rmtree(temporal, ignore_errors=True)
+
+        return guardados, [nodo.nombre for nodo in pasos]
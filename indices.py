@@ -0,0 +1,281 @@
+import threading
+from functools import partial
+
+import numpy as np
+
+import nucleos
+from bloques import calcular_por_ventanas
+from cache import clave_cache, producto_vigente, registrar_producto
+from nucleos import FACTOR_REFLECTANCIA, PRECISIONES
+
+# Operaciones conmutativas: sus operandos se ordenan para que B04 + B08 y B08 + B04
+# se reconozcan como la misma subexpresión (el resultado en coma flotante es idéntico)
+OPERACIONES_CONMUTATIVAS = {'suma', 'producto'}
+
+
+class Expresion:
+    """
+    Nodo de una expresión sobre bandas con nombre.
+
+    Cada nodo tiene una `clave` canónica; dos subexpresiones con la misma clave
+    se calculan una sola vez por ventana.
+    """
+
+    clave = None
+
+    def __add__(self, otra):
+        return Operacion('suma', self, otra)
+
+    def __radd__(self, otra):
+        return Operacion('suma', otra, self)
+
+    def __sub__(self, otra):
+        return Operacion('resta', self, otra)
+
+    def __rsub__(self, otra):
+        return Operacion('resta', otra, self)
+
+    def __mul__(self, otra):
+        return Operacion('producto', self, otra)
+
+    def __rmul__(self, otra):
+        return Operacion('producto', otra, self)
+
+    def __truediv__(self, otra):
+        return Operacion('division', self, otra)
+
+    def __rtruediv__(self, otra):
+        return Operacion('division', otra, self)
+
+    def bandas(self):
+        return set()
+
+    def __repr__(self):
+        return repr(self.clave)
+
+
+class Banda(Expresion):
+    """Banda de entrada, escalada a reflectancia al leerla."""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.clave = ('banda', nombre)
+
+    def bandas(self):
+        return {self.nombre}
+
+
+class Constante(Expresion):
+    def __init__(self, valor):
+        self.valor = valor
+        self.clave = ('constante', valor)
+
+
+class Operacion(Expresion):
+    def __init__(self, operador, *operandos):
+        operandos = [o if isinstance(o, Expresion) else Constante(o) for o in operandos]
+        if operador in OPERACIONES_CONMUTATIVAS:
+            operandos.sort(key=lambda o: repr(o.clave))
+        self.operador = operador
+        self.operandos = tuple(operandos)
+        self.clave = (operador,) + tuple(o.clave for o in self.operandos)
+
+    def bandas(self):
+        return set().union(*(o.bandas() for o in self.operandos))
+
+
+def cociente_seguro(numerador, denominador):
+    """numerador / denominador, con NaN donde el denominador es cero."""
+    return Operacion('cociente_seguro', numerador, denominador)
+
+
+def evaluar(expresion, datos, memo):
+    """
+    Evalúa `expresion` sobre los datos crudos de una ventana.
+
+    datos: dict nombre de banda -> array con los valores digitales de la ventana.
+    memo: dict compartido entre las expresiones de la misma ventana; guarda cada
+          subexpresión ya calculada (incluidas las bandas escaladas).
+    """
+    if expresion.clave in memo:
+        return memo[expresion.clave]
+
+    if isinstance(expresion, Banda):
+        resultado = datos[expresion.nombre].astype(float) / FACTOR_REFLECTANCIA
+    elif isinstance(expresion, Constante):
+        resultado = expresion.valor
+    else:
+        valores = [evaluar(o, datos, memo) for o in expresion.operandos]
+        if expresion.operador == 'suma':
+            resultado = valores[0] + valores[1]
+        elif expresion.operador == 'resta':
+            resultado = valores[0] - valores[1]
+        elif expresion.operador == 'producto':
+            resultado = valores[0] * valores[1]
+        elif expresion.operador == 'division':
+            resultado = valores[0] / valores[1]
+        elif expresion.operador == 'cociente_seguro':
+            numerador, denominador = valores
+            with np.errstate(divide='ignore', invalid='ignore'):
+                resultado = np.where(denominador == 0, np.nan, numerador / denominador)
+        else:
+            raise ValueError(f"Operación desconocida: '{expresion.operador}'")
+
+    memo[expresion.clave] = resultado
+    return resultado
+
+
+# --- DEFINICIÓN DE LOS ÍNDICES ---
+
+B04 = Banda('B04')  # Rojo
+B08 = Banda('B08')  # Infrarrojo cercano (NIR)
+B11 = Banda('B11')  # Infrarrojo de onda corta (SWIR)
+
+INDICES = {
+    # Índice de Salinidad del Suelo: (B4 * B11) / (B4 + B11)
+    'SSI': cociente_seguro(B04 * B11, B04 + B11),
+    # Índice de Vegetación: (NIR - Rojo) / (NIR + Rojo)
+    'NDVI': cociente_seguro(B08 - B04, B08 + B04),
+    # Índice de Salinidad Normalizado (misma expresión que el NDVI en este proyecto)
+    'NDSI': cociente_seguro(B08 - B04, B08 + B04),
+}
+
+
+# Nombre de archivo con el que se guarda cada índice en la carpeta de la escena
+ARCHIVOS_SALIDA = {
+    'SSI': 'SSI_final.tiff',
+    'NDVI': 'NDVI_mapa.tiff',
+    'NDSI': 'NDSI_mapa.tiff',
+}
+
+# Núcleo fusionado de cada índice y bandas que recibe, en orden
+NUCLEOS = {
+    'SSI': (nucleos.ssi, ('B04', 'B11')),
+    'NDVI': (nucleos.diferencia_normalizada, ('B08', 'B04')),
+    'NDSI': (nucleos.diferencia_normalizada, ('B08', 'B04')),
+}
+
+
+def bandas_necesarias(nombres_indices):
+    """Conjunto de bandas que hay que leer para calcular los índices indicados."""
+    return set().union(*(INDICES[nombre].bandas() for nombre in nombres_indices))
+
+
+def _calcular_ventana(nombres_indices, datos):
+    memo = {}
+    return {nombre: evaluar(INDICES[nombre], datos, memo) for nombre in nombres_indices}
+
+
+# Buffer auxiliar de los núcleos, uno por hilo y reutilizado entre ventanas
+_trabajo = threading.local()
+
+
+def _buffer_trabajo(forma, dtype):
+    buffer = getattr(_trabajo, 'buffer', None)
+    if buffer is None or buffer.shape != forma or buffer.dtype != dtype:
+        buffer = _trabajo.buffer = np.empty(forma, dtype=dtype)
+    return buffer
+
+
+def _calcular_ventana_nucleos(nombres_indices, dtype, datos):
+    resultados = {}
+    calculados = {}
+    for nombre in nombres_indices:
+        nucleo, bandas = NUCLEOS[nombre]
+        # NDVI y NDSI comparten núcleo y bandas: se calculan una sola vez
+        if (nucleo, bandas) not in calculados:
+            entradas = [datos[banda] for banda in bandas]
+            trabajo = _buffer_trabajo(entradas[0].shape, dtype)
+            calculados[(nucleo, bandas)] = nucleo(*entradas, trabajo=trabajo, dtype=dtype)
+        resultados[nombre] = calculados[(nucleo, bandas)]
+    return resultados
+
+
+def definicion_indice(nombre, precision):
+    """Texto que identifica cómo se calcula un índice, para la clave de caché."""
+    if precision == 'exacta':
+        return repr(INDICES[nombre].clave)
+    nucleo, bandas = NUCLEOS[nombre]
+    return f"{nucleo.__name__}{bandas}"
+
+
+def calcular_indices(rutas_bandas, rutas_salida, tamano_ventana=None, workers=1, usar_procesos=False,
+                     precision='exacta', usar_cache=True, hash_contenido=False, formato='GTiff',
+                     compresion='DEFLATE', remuestreo='cercano', omitir_vacios=False, ruta_scl=None,
+                     clases_scl=None):
+    """
+    Calcula varios índices en una sola pasada sobre las bandas.
+
+    rutas_bandas: dict nombre de banda -> ruta del GeoTIFF (p. ej. {'B04': ..., 'B11': ...}).
+    rutas_salida: dict nombre de índice de INDICES -> ruta del GeoTIFF de salida.
+
+    Cada banda necesaria se lee y escala una sola vez por ventana, y las
+    subexpresiones comunes entre índices se calculan una sola vez. Con workers > 1
+    las ventanas se reparten entre hilos (o procesos con `usar_procesos`).
+
+    precision: 'exacta' evalúa las expresiones de INDICES en float64 como los
+    scripts originales; 'float32' o 'float64' usan los núcleos de NUCLEOS.
+
+    Con `usar_cache` no se recalculan los productos cuyas bandas, fórmula y
+    precisión no han cambiado desde que se generaron (ver cache.py). Devuelve la
+    lista de índices que se han recalculado.
+
+    formato, compresion: 'GTiff' o 'COG' y su compresión (ver escritura.py).
+    remuestreo: cómo se leen en la rejilla de 10 m las bandas de menor
+    resolución, p. ej. B11 a 20 m directamente del SAFE (ver bloques.REMUESTREOS).
+    omitir_vacios, ruta_scl, clases_scl: no calcula los bloques sin datos (en
+    todas las bandas a cero o sin dato, o sin dato en la banda SCL); quedan como
+    NaN, que es lo que darían los índices (ver bloques.calcular_por_ventanas).
+    """
+    if precision not in PRECISIONES:
+        raise ValueError(f"Precisión no válida: '{precision}' (opciones: {', '.join(PRECISIONES)})")
+    desconocidos = set(rutas_salida) - set(INDICES)
+    if desconocidos:
+        raise ValueError(f"Índices no definidos: {', '.join(sorted(desconocidos))}")
+
+    necesarias = bandas_necesarias(rutas_salida)
+    faltantes = necesarias - set(rutas_bandas)
+    if faltantes:
+        raise ValueError(f"Faltan las rutas de las bandas: {', '.join(sorted(faltantes))}")
+
+    claves = {}
+    pendientes = {}
+    for nombre, ruta in rutas_salida.items():
+        entradas = [rutas_bandas[banda] for banda in sorted(INDICES[nombre].bandas())]
+        parametros = {'precision': precision, 'formato': formato, 'compresion': compresion}
+        # Solo entra en la clave si no es el de por defecto, para no invalidar los productos ya calculados
+        if remuestreo != 'cercano':
+            parametros['remuestreo'] = remuestreo
+        if omitir_vacios:
+            parametros['omitir_vacios'] = {'clases_scl': clases_scl, 'scl': ruta_scl is not None}
+            if ruta_scl is not None:
+                entradas = entradas + [ruta_scl]
+        claves[nombre] = clave_cache(entradas, definicion_indice(nombre, precision), parametros, hash_contenido)
+        if not (usar_cache and producto_vigente(ruta, claves[nombre])):
+            pendientes[nombre] = ruta
+    if not pendientes:
+        return []
+
+    if precision == 'exacta':
+        funcion = partial(_calcular_ventana, tuple(pendientes))
+    else:
+        funcion = partial(_calcular_ventana_nucleos, tuple(pendientes), np.dtype(precision))
+
+    calcular_por_ventanas(
+        {banda: rutas_bandas[banda] for banda in sorted(bandas_necesarias(pendientes))},
+        funcion,
+        pendientes,
+        tamano_ventana=tamano_ventana,
+        workers=workers,
+        usar_procesos=usar_procesos,
+        formato=formato,
+        compresion=compresion,
+        remuestreo=remuestreo,
+        omitir_vacios=omitir_vacios,
+        ruta_scl=ruta_scl,
+        clases_scl=clases_scl
+    )
+
+    for nombre, ruta in pendientes.items():
+        registrar_producto(ruta, claves[nombre])
+    return list(pendientes)
@@ -0,0 +1,295 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import ContextDecorator
+from datetime import datetime
+
+# Ganchos de perfilado que se pueden activar con --perfil
+PERFILES = ('cprofile', 'tracemalloc')
+
+# Líneas de código con más memoria reservada que se listan al final con --perfil tracemalloc
+LINEAS_TRACEMALLOC = 15
+
+# Estado de la instrumentación del proceso; sin `configurar` las etapas no miden nada
+_estado = {'activo': False, 'script': None, 'destino': None, 'perfil': None, 'ruta_perfil': None}
+_cerrojo_salida = threading.Lock()
+
+# Etapas abiertas (del hilo principal); los parciales de los hilos de cálculo se suman a la última
+_pila = []
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos de la instrumentación por etapas."""
+    parser.add_argument('--metricas', default=None,
+                        help="Archivo JSON Lines al que se añade una línea por etapa (tiempo, CPU, memoria, E/S); "
+                             "'-' las escribe en la salida de error.")
+    parser.add_argument('--perfil', choices=PERFILES, default=None,
+                        help="Activa cProfile (todo el script) o tracemalloc (pico de memoria de Python por etapa).")
+    parser.add_argument('--ruta-perfil', default=None,
+                        help='Dónde guardar el perfil de cProfile (por defecto perfil_<script>.prof).')
+
+
+def configurar(args, script):
+    """Activa la instrumentación según las opciones de `agregar_argumentos`."""
+    metricas = getattr(args, 'metricas', None)
+    perfil = getattr(args, 'perfil', None)
+    if metricas is None and perfil is None:
+        return
+    _estado.update(activo=True, script=script, destino=metricas or '-', perfil=perfil)
+
+    if perfil == 'cprofile':
+        import cProfile
+        perfilador = cProfile.Profile()
+        ruta_perfil = getattr(args, 'ruta_perfil', None) or f'perfil_{script}.prof'
+        _estado.update(perfilador=perfilador, ruta_perfil=ruta_perfil)
+        perfilador.enable()
+        atexit.register(_guardar_cprofile)
+    elif perfil == 'tracemalloc':
+        tracemalloc.start()
+        atexit.register(_emitir_tracemalloc)
+
+
+def emitir(registro):
+    """Escribe un registro como una línea JSON en el destino configurado."""
+    if not _estado['activo']:
+        return
+    linea = json.dumps(registro, ensure_ascii=False, default=str) + '\n'
+    with _cerrojo_salida:
+        if _estado['destino'] == '-':
+            sys.stderr.write(linea)
+            sys.stderr.flush()
+        else:
+            # Una sola escritura en modo 'a' por línea: varios procesos pueden compartir el archivo
+            with open(_estado['destino'], 'a', encoding='utf-8') as f:
+                f.write(linea)
+
+
+def _memoria_pico():
+    """Pico de memoria residente del proceso desde que empezó, en bytes (None si no se puede saber)."""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ContadoresMemoria(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        contadores = ContadoresMemoria()
+        contadores.cb = ctypes.sizeof(contadores)
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(_proceso_windows(), ctypes.byref(contadores),
+                                                         contadores.cb):
+            return None
+        return contadores.PeakWorkingSetSize
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KiB y macOS en bytes
+    return pico if sys.platform == 'darwin' else pico * 1024
+
+
+def _bytes_entrada_salida():
+    """(bytes leídos, bytes escritos) por el proceso hasta ahora, o (None, None)."""
+    if sys.platform == 'win32':
+        import ctypes
+
+        class ContadoresES(ctypes.Structure):
+            _fields_ = [(nombre, ctypes.c_ulonglong) for nombre in
+                        ('ReadOperationCount', 'WriteOperationCount', 'OtherOperationCount',
+                         'ReadTransferCount', 'WriteTransferCount', 'OtherTransferCount')]
+
+        contadores = ContadoresES()
+        if not ctypes.windll.kernel32.GetProcessIoCounters(_proceso_windows(), ctypes.byref(contadores)):
+            return None, None
+        return contadores.ReadTransferCount, contadores.WriteTransferCount
+    try:
+        # rchar/wchar cuentan también lo servido desde la caché de disco del sistema
+        with open('/proc/self/io') as f:
+            valores = dict(linea.split(': ') for linea in f.read().splitlines())
+        return int(valores['rchar']), int(valores['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _proceso_windows():
+    import ctypes
+    from ctypes import wintypes
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    return wintypes.HANDLE(kernel32.GetCurrentProcess())
+
+
+def _megabytes(valor):
+    return None if valor is None else round(valor / 1024 ** 2, 1)
+
+
+def _diferencia(despues, antes):
+    return None if despues is None or antes is None else despues - antes
+
+
+class _Etapa(ContextDecorator):
+    """
+    Mide una etapa: tiempo real, tiempo de CPU del proceso, pico de memoria
+    residente y bytes leídos/escritos, y la emite como línea JSON al terminar.
+
+    Los `parcial` que se ejecuten dentro (también desde hilos de cálculo) se
+    acumulan y se emiten como líneas propias con 'padre' igual a esta etapa.
+    """
+
+    def __init__(self, nombre, campos):
+        self.nombre = nombre
+        self.campos = campos
+        self.parciales = {}
+        self._cerrojo = threading.Lock()
+
+    def _recreate_cm(self):
+        # Usada como decorador, cada llamada mide con un objeto nuevo
+        return _Etapa(self.nombre, dict(self.campos))
+
+    def __enter__(self):
+        if not _estado['activo']:
+            return self
+        self.padre = _pila[-1].nombre if _pila else None
+        if _estado['perfil'] == 'tracemalloc':
+            # El pico de tracemalloc es global: se guarda el de la etapa exterior antes de reiniciarlo
+            if _pila:
+                _pila[-1].pico_python = max(_pila[-1].pico_python, tracemalloc.get_traced_memory()[1])
+            self.pico_python = 0
+            tracemalloc.reset_peak()
+        _pila.append(self)
+        self.inicio = datetime.now()
+        self.leidos, self.escritos = _bytes_entrada_salida()
+        self.cpu = time.process_time()
+        self.reloj = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, error, traza):
+        if not _estado['activo'] or not _pila or _pila[-1] is not self:
+            return False
+        segundos = time.perf_counter() - self.reloj
+        cpu = time.process_time() - self.cpu
+        leidos, escritos = _bytes_entrada_salida()
+        _pila.pop()
+
+        registro = {
+            'script': _estado['script'],
+            'etapa': self.nombre,
+            'padre': self.padre,
+            'inicio': self.inicio.isoformat(timespec='milliseconds'),
+            'segundos': round(segundos, 4),
+            'cpu_segundos': round(cpu, 4),
+            # Pico del proceso hasta el final de la etapa (el sistema no permite medirlo por tramos)
+            'rss_pico_mb': _megabytes(_memoria_pico()),
+            'bytes_leidos': _diferencia(leidos, self.leidos),
+            'bytes_escritos': _diferencia(escritos, self.escritos),
+            'pid': os.getpid(),
+        }
+        if _estado['perfil'] == 'tracemalloc':
+            self.pico_python = max(self.pico_python, tracemalloc.get_traced_memory()[1])
+            registro['python_pico_mb'] = _megabytes(self.pico_python)
+            if _pila:
+                _pila[-1].pico_python = max(_pila[-1].pico_python, self.pico_python)
+        if tipo is not None:
+            registro['error'] = f'{tipo.__name__}: {error}'
+        registro.update(self.campos)
+        emitir(registro)
+
+        for nombre, (segundos_parcial, cpu_parcial, llamadas, n_bytes) in self.parciales.items():
+            emitir({
+                'script': _estado['script'],
+                'etapa': nombre,
+                'padre': self.nombre,
+                'acumulada': True,
+                'segundos': round(segundos_parcial, 4),
+                'cpu_segundos': round(cpu_parcial, 4),
+                'llamadas': llamadas,
+                'bytes': n_bytes,
+                'pid': os.getpid(),
+            })
+        return False
+
+    def sumar_parcial(self, nombre, segundos, cpu, n_bytes):
+        with self._cerrojo:
+            acumulado = self.parciales.setdefault(nombre, [0.0, 0.0, 0, 0])
+            acumulado[0] += segundos
+            acumulado[1] += cpu
+            acumulado[2] += 1
+            acumulado[3] += n_bytes
+
+
+def etapa(nombre, **campos):
+    """
+    Context manager (o decorador) que mide la etapa `nombre` del script.
+
+    Los `campos` se añaden tal cual al registro (p. ej. el índice o la ruta).
+    Si la instrumentación no está activada no hace nada.
+    """
+    return _Etapa(nombre, campos)
+
+
+class _Parcial:
+    """Tramo repetido (p. ej. leer una ventana) cuyo tiempo se suma a la etapa abierta."""
+
+    __slots__ = ('nombre', 'bytes', '_etapa', '_reloj', '_cpu')
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.bytes = 0
+
+    def __enter__(self):
+        self._etapa = _pila[-1] if _estado['activo'] and _pila else None
+        if self._etapa is not None:
+            self._cpu = time.thread_time()
+            self._reloj = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, error, traza):
+        if self._etapa is not None:
+            self._etapa.sumar_parcial(self.nombre, time.perf_counter() - self._reloj,
+                                      time.thread_time() - self._cpu, self.bytes)
+        return False
+
+
+def parcial(nombre):
+    """
+    Mide un tramo que se repite dentro de una etapa (lectura, cálculo o escritura
+    de cada ventana). El tiempo real y el de CPU del hilo se suman por nombre y se
+    emiten al cerrar la etapa; `bytes` puede fijarse dentro del bloque. En los
+    procesos hijos (usar_procesos) no hay etapa abierta y no se mide.
+    """
+    return _Parcial(nombre)
+
+
+def _guardar_cprofile():
+    perfilador = _estado['perfilador']
+    perfilador.disable()
+    perfilador.dump_stats(_estado['ruta_perfil'])
+    # cProfile solo ve el hilo principal: con --workers > 1 el cálculo de las ventanas no aparece
+    print(f"Perfil de cProfile guardado en: {_estado['ruta_perfil']} (ábrelo con pstats o snakeviz)")
+
+
+def _emitir_tracemalloc():
+    # Lo que sigue reservado al terminar el script (cachés, fugas), agrupado por línea de código
+    instantanea = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ])
+    lineas = instantanea.statistics('lineno')[:LINEAS_TRACEMALLOC]
+    emitir({
+        'script': _estado['script'],
+        'etapa': 'tracemalloc',
+        'memoria_actual_mb': _megabytes(tracemalloc.get_traced_memory()[0]),
+        'asignaciones_vivas': [{'linea': str(estadistica.traceback[0]), 'mb': _megabytes(estadistica.size),
+                                'bloques': estadistica.count} for estadistica in lineas],
+        'pid': os.getpid(),
+    })
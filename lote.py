@@ -0,0 +1,155 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bloques
+import cache
+import escritura
+import instrumentacion
+import validez
+from catalogo import escenas_catalogadas
+from cubo import CuboTemporal, ruta_cubo
+from escenas import descubrir_escenas
+from indices import ARCHIVOS_SALIDA, INDICES, bandas_necesarias, calcular_indices
+from nucleos import PRECISIONES
+
+# --- 1. CONFIGURACIÓN ---
+# Carpeta raíz bajo la que se buscan todas las escenas (se recorre de forma recursiva)
+ruta_raiz = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES'
+
+
+def procesar_escena(escena, indices, workers, precision, usar_cache, hash_contenido, formato, compresion,
+                    remuestreo='cercano', omitir_vacios=False, clases_scl=None):
+    """
+    Calcula los índices de una escena y devuelve una fila para el informe.
+
+    Con `omitir_vacios` se saltan los bloques sin datos; si la escena tiene la
+    banda SCL, también los de las clases `clases_scl`.
+    """
+    inicio = time.perf_counter()
+    fila = {
+        'escena': escena.identificador,
+        'tile': escena.tile,
+        'fecha': escena.fecha.strftime('%Y-%m-%d'),
+        'carpeta': escena.carpeta,
+        'estado': 'ok',
+        'mensaje': '',
+    }
+    try:
+        rutas_bandas = escena.rutas_bandas(sorted(bandas_necesarias(indices)))
+        rutas_salida = {indice: os.path.join(escena.carpeta, ARCHIVOS_SALIDA[indice]) for indice in indices}
+        recalculados = calcular_indices(rutas_bandas, rutas_salida, workers=workers, precision=precision,
+                                        usar_cache=usar_cache, hash_contenido=hash_contenido,
+                                        formato=formato, compresion=compresion, remuestreo=remuestreo,
+                                        omitir_vacios=omitir_vacios, ruta_scl=escena.bandas.get('SCL'),
+                                        clases_scl=clases_scl)
+        if recalculados:
+            fila['mensaje'] = 'recalculados: ' + ', '.join(recalculados)
+        else:
+            fila['mensaje'] = 'sin cambios (caché)'
+    except Exception as e:
+        # Un fallo en una escena no detiene el lote: queda registrado en el informe
+        fila['estado'] = 'error'
+        fila['mensaje'] = str(e)
+    fila['segundos'] = round(time.perf_counter() - inicio, 2)
+    return fila
+
+
+def agregar_a_cubos(escena, indices, raiz_cubos):
+    """Añade los productos de la escena a los cubos temporales; devuelve el texto para el informe."""
+    agregados = []
+    errores = []
+    for indice in indices:
+        ruta_producto = os.path.join(escena.carpeta, ARCHIVOS_SALIDA[indice])
+        try:
+            cubo = CuboTemporal.abrir_o_crear(ruta_cubo(raiz_cubos, indice, escena.tile), ruta_producto)
+            if cubo.agregar(ruta_producto, escena.fecha):
+                agregados.append(indice)
+        except Exception as e:
+            # Un cubo que falla no impide añadir los demás índices de la escena
+            errores.append(f'{indice} ({e})')
+    texto = f"; añadidos al cubo: {', '.join(agregados)}" if agregados else ''
+    if errores:
+        texto += f"; error al añadir al cubo: {', '.join(errores)}"
+    return texto
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calcula los índices espectrales de todas las escenas bajo una carpeta.')
+    parser.add_argument('raiz', nargs='?', default=ruta_raiz, help='Carpeta raíz con las escenas.')
+    parser.add_argument('--indices', nargs='+', choices=sorted(INDICES), default=['SSI', 'NDVI', 'NDSI'],
+                        help='Índices a calcular en cada escena.')
+    parser.add_argument('--escenas-paralelas', type=int, default=1,
+                        help='Número de escenas que se procesan a la vez (procesos).')
+    parser.add_argument('--workers', type=int, default=1, help='Hilos de cálculo dentro de cada escena.')
+    parser.add_argument('--precision', choices=PRECISIONES, default='exacta')
+    parser.add_argument('--cubos', default=None,
+                        help='Carpeta de los cubos temporales: cada índice calculado se añade al cubo de su tile.')
+    parser.add_argument('--limite-cache-gb', type=float, default=None,
+                        help='Tras el lote, borra los productos intermedios menos usados bajo la raíz (p. ej. los de '
+                             'cadena.py --intermedios) hasta no superar este tamaño; los índices y demás productos '
+                             'finales nunca se borran.')
+    parser.add_argument('--catalogo', nargs='?', const='', default=None,
+                        help='Busca las escenas en el catálogo SQLite de revisor.py, abriendo solo los archivos '
+                             'nuevos o modificados (sin ruta: el catálogo por defecto de la carpeta raíz).')
+    bloques.agregar_argumentos(parser)
+    cache.agregar_argumentos(parser)
+    escritura.agregar_argumentos(parser)
+    validez.agregar_argumentos(parser)
+    parser.add_argument('--informe', default=None,
+                        help='Ruta del informe CSV (por defecto informe_lote.csv en la carpeta raíz).')
+    instrumentacion.agregar_argumentos(parser)
+    args = parser.parse_args()
+    instrumentacion.configurar(args, 'lote')
+
+    # --- 2. DESCUBRIMIENTO DE ESCENAS ---
+    with instrumentacion.etapa('descubrimiento'):
+        if args.catalogo is not None:
+            escenas = escenas_catalogadas(args.raiz, args.catalogo or None)
+        else:
+            escenas = descubrir_escenas(args.raiz)
+    if not escenas:
+        print(f"Error: No se encontraron escenas Sentinel-2 en '{args.raiz}'.")
+        return
+    print(f"Se encontraron {len(escenas)} escenas para procesar.")
+
+    # --- 3. PROCESAMIENTO ---
+    filas = []
+    # Las escenas se calculan en procesos hijos: se mide el conjunto y, por escena, el añadido a los cubos
+    with instrumentacion.etapa('procesamiento', escenas=len(escenas)):
+        with ProcessPoolExecutor(max_workers=max(1, args.escenas_paralelas)) as ejecutor:
+            futuros = [ejecutor.submit(procesar_escena, escena, args.indices, args.workers, args.precision,
+                                       not args.forzar, args.hash_entradas, args.formato, args.compresion,
+                                       args.remuestreo, args.omitir_vacios, args.clases_scl)
+                       for escena in escenas]
+            for escena, futuro in zip(escenas, futuros):
+                fila = futuro.result()
+                if args.cubos and fila['estado'] == 'ok':
+                    # Se añade desde el proceso principal para que dos escenas del mismo tile no escriban a la vez
+                    with instrumentacion.etapa('cubos', escena=escena.identificador):
+                        fila['mensaje'] += agregar_a_cubos(escena, args.indices, args.cubos)
+                filas.append(fila)
+                print(f"  [{fila['estado']}] {fila['escena']} ({fila['segundos']} s) {fila['mensaje']}")
+
+    # --- 4. INFORME ---
+    ruta_informe = args.informe or os.path.join(args.raiz, 'informe_lote.csv')
+    with open(ruta_informe, 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=list(filas[0]))
+        escritor.writeheader()
+        escritor.writerows(filas)
+
+    if args.limite_cache_gb is not None:
+        with instrumentacion.etapa('limpieza_cache'):
+            borrados = cache.limpiar_cache(args.raiz, args.limite_cache_gb * 1024 ** 3)
+        print(f"Caché: se borraron {len(borrados)} productos intermedios para no superar {args.limite_cache_gb} GB.")
+
+    errores = sum(fila['estado'] == 'error' for fila in filas)
+    print("---")
+    print(f"Escenas procesadas: {len(filas) - errores} correctas, {errores} con error.")
+    print(f"Informe guardado en: {ruta_informe}")
+
+
+if __name__ == '__main__':
+    main()
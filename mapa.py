@@ -1,13 +1,13 @@
 import os
 os.environ['PROJ_DATA'] = r'C:\Users\Sfriasa.CHAVIMOCHIC\AppData\Local\Programs\Python\Python313\Lib\site-packages\rasterio\proj_data'
 
-import folium
 import rasterio
-from rasterio.warp import transform
-import numpy as np
-import base64
-from io import BytesIO
-from PIL import Image
+import argparse
+
+import estadisticas
+import instrumentacion
+from mapa_web import crear_mapa, imagen_incrustada, limites_wgs84
+from teselas import generar_piramide
 
 # --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
 ruta_carpeta = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m'
@@ -16,58 +16,84 @@ ruta_ssi_mapa_utm = os.path.join(ruta_carpeta, nombre_ssi_mapa_utm)
 
 ruta_salida_mapa = os.path.join(ruta_carpeta, 'mapa_interactivo_SSI_final.html')
 
+# Carpeta de la pirámide de teselas z/x/y (modo --teselas), junto al HTML
+ruta_teselas = os.path.join(ruta_carpeta, 'teselas_SSI')
+
+# Escala de color fija de las teselas (la de la vista previa de ssi.py): al ser la misma en todas las
+# fechas, las teselas cuya zona no cambia se reutilizan de una fecha a otra
+rango_teselas = (0, 0.5)
+
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Genera el mapa interactivo del SSI.')
+parser.add_argument('--teselas', action='store_true',
+                    help='Genera una pirámide de teselas XYZ en lugar de incrustar una imagen en el HTML.')
+parser.add_argument('--zoom-min', type=int, default=8, help='Zoom mínimo de la pirámide (por defecto 8).')
+parser.add_argument('--zoom-max', type=int, default=None,
+                    help='Zoom máximo de la pirámide (por defecto, el de la resolución del raster).')
+parser.add_argument('--workers', type=int, default=4, help='Hilos para generar las teselas (por defecto 4).')
+parser.add_argument('--raster', default=ruta_ssi_mapa_utm, help='Raster a representar (por defecto el SSI de la carpeta).')
+parser.add_argument('--salida', default=ruta_salida_mapa, help='Ruta del HTML del mapa.')
+parser.add_argument('--rango', nargs=2, type=float, metavar=('VMIN', 'VMAX'), default=None,
+                    help='Valores fijos de los extremos de la escala de color (con --teselas, por defecto '
+                         f'{rango_teselas[0]:g} {rango_teselas[1]:g}; p. ej. otro rango para el mapa calibrado).')
+estadisticas.agregar_argumentos(parser)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'mapa')
+
+ruta_ssi_mapa_utm = args.raster
+nombre_ssi_mapa_utm = os.path.basename(ruta_ssi_mapa_utm)
+ruta_salida_mapa = args.salida
+ruta_teselas = os.path.join(os.path.dirname(os.path.abspath(ruta_salida_mapa)), os.path.basename(ruta_teselas))
+
 # --- 2. PREPARACIÓN DE DATOS Y CONVERSIÓN DE COORDENADAS ---
 try:
+    # El estiramiento de color es común a la imagen o a todas las teselas. Las teselas usan por defecto
+    # un rango fijo; la imagen, los percentiles 2 y 98 de las estadísticas guardadas al escribir el raster,
+    # que se leen sin recorrerlo. Con percentiles, cada fecha tiene su propia escala y las teselas solo
+    # se reutilizan al repetir la misma fecha
+    if args.rango is not None:
+        min_val, max_val = args.rango
+    elif args.teselas and args.estiramiento is None:
+        min_val, max_val = rango_teselas
+    else:
+        with instrumentacion.etapa('estiramiento'):
+            min_val, max_val = estadisticas.rango_estiramiento(ruta_ssi_mapa_utm,
+                                                               *(args.estiramiento or estadisticas.ESTIRAMIENTO))
+
     with rasterio.open(ruta_ssi_mapa_utm) as src:
-        data = src.read(1)
-        
-        # --- LÍNEAS CORREGIDAS ---
-        # Definimos las proyecciones usando el nuevo formato
-        src_proj_crs = src.crs
-        dst_proj_crs = 'EPSG:4326' # WGS84
-        
-        # Transformamos las coordenadas de las esquinas. Ahora pasamos las coordenadas como listas
-        xs = [src.bounds.left, src.bounds.right]
-        ys = [src.bounds.bottom, src.bounds.top]
-        
-        lon, lat = transform(src_proj_crs, dst_proj_crs, xs, ys)
-        
-        lon_min, lon_max = lon[0], lon[1]
-        lat_min, lat_max = lat[0], lat[1]
+        # Esquinas del raster en WGS84 para situar la capa sobre el mapa base
+        bounds_wgs84 = limites_wgs84(src)
 
-        # --- FIN DE LÍNEAS CORREGIDAS ---
-        
-        bounds_wgs84 = [[lat_min, lon_min], [lat_max, lon_max]]
-        
-        centro_lat = (lat_min + lat_max) / 2
-        centro_lon = (lon_min + lon_max) / 2
+        if not args.teselas:
+            with instrumentacion.etapa('lectura'):
+                data = src.read(1)
+            with instrumentacion.etapa('codificacion'):
+                image_uri = imagen_incrustada(data, min_val, max_val)
 
-        min_val, max_val = np.nanmin(data), np.nanmax(data)
-        normalized_data = (data - min_val) / (max_val - min_val) * 255
-        img = Image.fromarray(normalized_data.astype(np.uint8), mode='L')
-        
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        encoded_img = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        image_uri = f'data:image/png;base64,{encoded_img}'
+    if args.teselas:
+        with instrumentacion.etapa('codificacion', modo='teselas'):
+            zoom_min, zoom_max, total_teselas, teselas_escritas = generar_piramide(
+                ruta_ssi_mapa_utm,
+                ruta_teselas,
+                min_val,
+                max_val,
+                zoom_min=args.zoom_min,
+                zoom_max=args.zoom_max,
+                workers=args.workers
+            )
+        print(f"Pirámide de teselas (zoom {zoom_min}-{zoom_max}): {teselas_escritas} de {total_teselas} teselas actualizadas.")
 
     # --- 3. CREACIÓN Y GUARDADO DEL MAPA ---
-    mapa_folium = folium.Map(
-        location=[centro_lat, centro_lon],
-        zoom_start=6,
-        control_scale=True
-    )
-    
-    folium.raster_layers.ImageOverlay(
-        image=image_uri,
-        bounds=bounds_wgs84,
-        opacity=0.8,
-        name='Mapa de SSI'
-    ).add_to(mapa_folium)
-    
-    folium.LayerControl().add_to(mapa_folium)
+    if args.teselas:
+        # La URL de las teselas es relativa al HTML, que se guarda en la misma carpeta
+        url_teselas = os.path.relpath(ruta_teselas, os.path.dirname(ruta_salida_mapa)).replace(os.sep, '/')
+        mapa_folium = crear_mapa(bounds_wgs84, url_teselas=url_teselas, zoom_min=zoom_min, zoom_max=zoom_max)
+    else:
+        mapa_folium = crear_mapa(bounds_wgs84, image_uri=image_uri)
 
-    mapa_folium.save(ruta_salida_mapa)
+    with instrumentacion.etapa('guardado'):
+        mapa_folium.save(ruta_salida_mapa)
     
     print(f"El mapa interactivo se ha creado correctamente en: {ruta_salida_mapa}")
 
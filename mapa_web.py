@@ -0,0 +1,92 @@
+import base64
+import os
+from io import BytesIO
+
+import folium
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.warp import transform
+
+from estadisticas import ESTIRAMIENTO, rango_estiramiento
+
+# Opacidad de la capa del índice sobre el mapa base
+OPACIDAD = 0.8
+
+
+def limites_wgs84(src):
+    """Límites [[lat_min, lon_min], [lat_max, lon_max]] del raster abierto, en WGS84."""
+    xs = [src.bounds.left, src.bounds.right]
+    ys = [src.bounds.bottom, src.bounds.top]
+    lon, lat = transform(src.crs, 'EPSG:4326', xs, ys)
+    return [[lat[0], lon[0]], [lat[1], lon[1]]]
+
+
+def imagen_incrustada(datos, min_val=None, max_val=None):
+    """
+    PNG en escala de grises del array, como URI data: para el HTML.
+
+    Se estira entre `min_val` y `max_val` (los valores de fuera se saturan);
+    por defecto, entre el mínimo y el máximo del array.
+    """
+    if min_val is None or max_val is None:
+        min_val, max_val = np.nanmin(datos), np.nanmax(datos)
+    normalized_data = np.clip((datos - min_val) / (max_val - min_val) * 255, 0, 255)
+    img = Image.fromarray(normalized_data.astype(np.uint8), mode='L')
+
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    encoded_img = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return f'data:image/png;base64,{encoded_img}'
+
+
+def crear_mapa(limites, image_uri=None, url_teselas=None, zoom_min=None, zoom_max=None, nombre='Mapa de SSI'):
+    """
+    Mapa de folium centrado en `limites` con la capa del índice.
+
+    La capa es la imagen incrustada `image_uri` o, si se da `url_teselas`, la
+    pirámide de teselas z/x/y de esa URL (relativa al HTML).
+    """
+    (lat_min, lon_min), (lat_max, lon_max) = limites
+    mapa_folium = folium.Map(
+        location=[(lat_min + lat_max) / 2, (lon_min + lon_max) / 2],
+        zoom_start=6,
+        control_scale=True
+    )
+
+    if url_teselas is not None:
+        folium.raster_layers.TileLayer(
+            tiles=url_teselas + '/{z}/{x}/{y}.png',
+            attr='SSI Sentinel-2',
+            name=nombre,
+            overlay=True,
+            opacity=OPACIDAD,
+            min_native_zoom=zoom_min,
+            max_native_zoom=zoom_max,
+            max_zoom=max(18, zoom_max)
+        ).add_to(mapa_folium)
+    else:
+        folium.raster_layers.ImageOverlay(
+            image=image_uri,
+            bounds=limites,
+            opacity=OPACIDAD,
+            name=nombre
+        ).add_to(mapa_folium)
+
+    folium.LayerControl().add_to(mapa_folium)
+    return mapa_folium
+
+
+def guardar_mapa(ruta_raster, ruta_html, nombre='Mapa de SSI', estiramiento=ESTIRAMIENTO):
+    """
+    Guarda el HTML con el raster incrustado como imagen (el modo por defecto de mapa.py).
+
+    La imagen se estira entre los percentiles `estiramiento` del raster, leídos
+    de las estadísticas guardadas junto a él.
+    """
+    min_val, max_val = rango_estiramiento(ruta_raster, *estiramiento)
+    with rasterio.open(ruta_raster) as src:
+        limites = limites_wgs84(src)
+        image_uri = imagen_incrustada(src.read(1), min_val, max_val)
+    os.makedirs(os.path.dirname(os.path.abspath(ruta_html)), exist_ok=True)
+    crear_mapa(limites, image_uri=image_uri, nombre=nombre).save(ruta_html)
@@ -0,0 +1,87 @@
+import os
+import argparse
+
+import bloques
+import cache
+import escritura
+import estadisticas
+import instrumentacion
+import validez
+from indices import PRECISIONES, calcular_indices
+from vista_previa import guardar_vista_previa
+
+# --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
+ruta_carpeta = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m'
+
+# Bandas de entrada (solo se leen las que necesiten los índices pedidos)
+rutas_bandas = {
+    'B04': os.path.join(ruta_carpeta, 'T17LQL_20250721T152721_B04_10m.tif'),  # Banda Roja
+    'B08': os.path.join(ruta_carpeta, 'T17LQL_20250721T152721_B08_10m.tif'),  # Banda NIR
+    'B11': os.path.join(ruta_carpeta, 'T17LQL_20250721T152721_B11_10m.tif'),  # Banda SWIR
+    # o la B11 nativa de 20 m del SAFE, que se remuestrea al vuelo (ver --remuestreo):
+    # 'B11': os.path.join(ruta_carpeta, '..', 'R20m', 'T17LQL_20250721T152721_B11_20m.jp2'),
+}
+
+# Clasificación de escena (SCL) de L2A, opcional: con --omitir-vacios descarta también los bloques de las
+# clases de --clases-scl, p. ej. os.path.join(ruta_carpeta, '..', 'R20m', 'T17LQL_20250721T152721_SCL_20m.jp2')
+ruta_scl = None
+
+# Productos a generar: índice -> (archivo de salida, paleta, vmin, vmax, etiqueta, título, nombre del PNG)
+# (vmin y vmax fijos para poder comparar fechas; con --estiramiento salen de los percentiles de cada mapa)
+productos = {
+    'SSI': ('SSI_final.tiff', 'plasma', 0, 0.5,
+            'Índice de Salinidad del Suelo (SSI)', 'Mapa SSI (Salinidad)', 'SSI_mapa.png'),
+    'NDVI': ('NDVI_mapa.tiff', 'YlGn', -0.2, 1.0,
+             'Índice de Vegetación (NDVI)', 'Mapa de NDVI', 'NDVI_mapa.png'),
+    'NDSI': ('NDSI_mapa.tiff', 'YlOrRd', -0.2, 0.4,
+             'Índice de Salinidad Normalizado (NDSI)', 'Mapa de NDSI (Salinidad)', 'NDSI_mapa.png'),
+}
+
+# Tamaño de las ventanas de procesamiento en píxeles (None = bloques internos del GeoTIFF)
+tamano_ventana = None
+
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Calcula SSI, NDVI y NDSI en una sola pasada.')
+parser.add_argument('--workers', type=int, default=1, help='Número de hilos de cálculo (por defecto 1).')
+parser.add_argument('--precision', choices=PRECISIONES, default='exacta',
+                    help="'exacta' reproduce el cálculo original en float64; 'float32'/'float64' usan los núcleos fusionados.")
+bloques.agregar_argumentos(parser)
+cache.agregar_argumentos(parser)
+escritura.agregar_argumentos(parser)
+validez.agregar_argumentos(parser)
+estadisticas.agregar_argumentos(parser)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'mapas_indices')
+
+rutas_salida = {indice: os.path.join(ruta_carpeta, datos[0]) for indice, datos in productos.items()}
+
+# --- 2. CÁLCULO DE TODOS LOS ÍNDICES EN UNA SOLA PASADA ---
+try:
+    # Cada banda se lee una sola vez por ventana y se reutiliza en todos los índices
+    # Los productos que siguen vigentes en la caché no se vuelven a calcular
+    with instrumentacion.etapa('indices'):
+        recalculados = calcular_indices(rutas_bandas, rutas_salida, tamano_ventana=tamano_ventana,
+                                        workers=args.workers, precision=args.precision,
+                                        usar_cache=not args.forzar, hash_contenido=args.hash_entradas,
+                                        formato=args.formato, compresion=args.compresion,
+                                        remuestreo=args.remuestreo, omitir_vacios=args.omitir_vacios,
+                                        ruta_scl=ruta_scl, clases_scl=args.clases_scl)
+    for indice, ruta in rutas_salida.items():
+        if indice in recalculados:
+            print(f"El archivo {indice} se ha guardado en: {ruta}")
+        else:
+            print(f"El archivo {indice} ya estaba actualizado, se reutiliza: {ruta}")
+
+    # --- 3. VISUALIZACIÓN ---
+    for indice, (_, cmap, vmin, vmax, etiqueta, titulo, nombre_png) in productos.items():
+        ruta_salida_png = os.path.join(ruta_carpeta, nombre_png)
+        with instrumentacion.etapa('grafico', indice=indice):
+            guardar_vista_previa(rutas_salida[indice], ruta_salida_png, cmap, vmin, vmax,
+                                 etiqueta=etiqueta, titulo=titulo, estiramiento=args.estiramiento)
+        print(f"La visualización del mapa se ha guardado en: {ruta_salida_png}")
+
+except FileNotFoundError:
+    print(f"Error: No se encontraron los archivos de banda. Verifica los nombres y la ruta.")
+except Exception as e:
+    print(f"Ocurrió un error inesperado: {e}")
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from cache import huella_archivo
+
+# Esquema normalizado de las muestras de campo
+COLUMNAS = ('x', 'y', 'ce', 'ubicacion', 'fecha_campana', 'origen')
+
+# Nombres con que aparecen las columnas en los Excel de campo (se comparan sin espacios y en minúsculas);
+# una columna solo se toma por posición si se indica con un entero en `columnas`
+ALIAS_COLUMNAS = {
+    'x': ('cooreste', 'x', 'este', 'coord_x'),
+    'y': ('coornorte', 'y', 'norte', 'coord_y'),
+    'ce': ('ce', 'conductividad', 'conductividad_electrica'),
+    'ubicacion': ('ubicacion', 'zona'),
+}
+
+# Fecha de campaña en el nombre del archivo: 20250721, 2025-07-21 o 2025-07
+PATRON_FECHA = re.compile(r'(\d{4})[-_]?(\d{2})(?:[-_]?(\d{2}))?')
+
+NOMBRE_REGISTRO = 'registro.json'
+
+
+def _resolver_columnas(cabecera, columnas=None):
+    """
+    Columna del Excel (por posición) que corresponde a x, y, ce y ubicacion.
+
+    `columnas` permite indicar, para cada campo, el nombre o la posición (entero)
+    de la columna cuando no se reconoce por ALIAS_COLUMNAS. Si x, y o ce no se
+    encuentran se lanza KeyError; la ubicación puede faltar (None).
+    """
+    nombres = {str(c).strip().lower(): i for i, c in enumerate(cabecera)}
+    columnas = columnas or {}
+    posiciones = {}
+    for campo, alias in ALIAS_COLUMNAS.items():
+        if campo in columnas:
+            # Nombre de columna, o su posición si es un entero
+            if isinstance(columnas[campo], int):
+                posicion = columnas[campo] if columnas[campo] < len(cabecera) else None
+            else:
+                posicion = nombres.get(str(columnas[campo]).strip().lower())
+            if posicion is None:
+                raise KeyError(columnas[campo])
+        else:
+            posicion = next((nombres[a] for a in alias if a in nombres), None)
+        if posicion is None and campo != 'ubicacion':
+            raise KeyError(campo)
+        posiciones[campo] = posicion
+    return posiciones
+
+
+def _normalizar_excel(ruta_excel, fecha=None, columnas=None):
+    """
+    Lee un Excel de campo y lo devuelve con el esquema COLUMNAS, sin filas sin x, y o ce.
+
+    Devuelve (muestras, cabecera del Excel, posiciones de las columnas usadas).
+    """
+    df = pd.read_excel(ruta_excel)
+    posiciones = _resolver_columnas(list(df.columns), columnas)
+    datos = {campo: df.iloc[:, posicion] for campo, posicion in posiciones.items() if posicion is not None}
+    if posiciones['ubicacion'] is None:
+        datos['ubicacion'] = pd.Series([None] * len(df), index=df.index, dtype='object')
+
+    muestras = pd.DataFrame({
+        'x': pd.to_numeric(datos['x'], errors='coerce').astype(float),
+        'y': pd.to_numeric(datos['y'], errors='coerce').astype(float),
+        'ce': pd.to_numeric(datos['ce'], errors='coerce').astype(float),
+        'ubicacion': datos['ubicacion'].astype('string'),
+    })
+    muestras.dropna(subset=['x', 'y', 'ce'], inplace=True)
+    muestras.reset_index(drop=True, inplace=True)
+
+    if fecha is None:
+        coincidencia = PATRON_FECHA.search(os.path.basename(ruta_excel))
+        if coincidencia is not None:
+            anio, mes, dia = coincidencia.groups()
+            fecha = f"{anio}-{mes}-{dia or '01'}"
+    muestras['fecha_campana'] = pd.to_datetime(fecha, errors='coerce') if fecha is not None else pd.NaT
+    muestras['fecha_campana'] = muestras['fecha_campana'].astype('datetime64[ns]')
+    muestras['origen'] = os.path.abspath(ruta_excel)
+    return muestras, [str(c) for c in df.columns], posiciones
+
+
+class AlmacenMuestras:
+    """
+    Almacén columnar (Parquet) de las campañas de campo.
+
+    Cada Excel ingresado se guarda normalizado en su propio Parquet dentro de
+    `directorio`; registro.json anota la huella de cada Excel para no volver a
+    leerlo mientras no cambie. Añadir una campaña nueva solo escribe su archivo.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._arbol = None
+        self._muestras = None
+
+    def _ruta_registro(self):
+        return os.path.join(self.directorio, NOMBRE_REGISTRO)
+
+    def _leer_registro(self):
+        try:
+            with open(self._ruta_registro(), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _ruta_campana(self, ruta_excel):
+        resumen = hashlib.sha256(os.path.abspath(ruta_excel).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directorio, f'campana_{resumen}.parquet')
+
+    def agregar_excel(self, ruta_excel, fecha=None, columnas=None):
+        """
+        Ingresa (o actualiza) la campaña de `ruta_excel`. Devuelve el número de
+        muestras escritas, o 0 si el Excel ya estaba ingresado y no ha cambiado.
+        """
+        registro = self._leer_registro()
+        origen = os.path.abspath(ruta_excel)
+        huella = huella_archivo(ruta_excel)
+        ruta_parquet = self._ruta_campana(ruta_excel)
+        anterior = registro.get(origen)
+        # Si el Excel no ha cambiado y las columnas pedidas son las mismas que se ingresaron, no se relee
+        if (anterior is not None and anterior['huella'] == huella and anterior['fecha'] == fecha
+                and os.path.exists(ruta_parquet)):
+            try:
+                if _resolver_columnas(anterior['cabecera'], columnas) == anterior['posiciones']:
+                    return 0
+            except KeyError:
+                pass
+
+        muestras, cabecera, posiciones = _normalizar_excel(ruta_excel, fecha, columnas)
+        os.makedirs(self.directorio, exist_ok=True)
+        muestras.to_parquet(ruta_parquet, index=False)
+        registro[origen] = {'huella': huella, 'fecha': fecha, 'cabecera': cabecera, 'posiciones': posiciones,
+                            'archivo': os.path.basename(ruta_parquet), 'muestras': len(muestras)}
+        with open(self._ruta_registro(), 'w', encoding='utf-8') as f:
+            json.dump(registro, f, indent=2)
+        self._arbol = self._muestras = None
+        return len(muestras)
+
+    def cargar(self, origenes=None, desde=None, hasta=None):
+        """
+        Muestras del almacén como DataFrame, en el orden de cada Excel.
+
+        origenes: rutas de los Excel a cargar (por defecto todos); desde/hasta:
+        filtro opcional por fecha de campaña.
+        """
+        registro = self._leer_registro()
+        if origenes is not None:
+            origenes = [os.path.abspath(ruta) for ruta in origenes]
+            faltantes = [ruta for ruta in origenes if ruta not in registro]
+            if faltantes:
+                raise KeyError(f"Excel no ingresados en el almacén: {', '.join(faltantes)}")
+        else:
+            origenes = list(registro)
+
+        partes = [pd.read_parquet(os.path.join(self.directorio, registro[origen]['archivo'])) for origen in origenes]
+        if not partes:
+            return pd.DataFrame({columna: [] for columna in COLUMNAS})
+        muestras = pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0]
+        if desde is not None:
+            muestras = muestras[muestras['fecha_campana'] >= pd.Timestamp(desde)]
+        if hasta is not None:
+            muestras = muestras[muestras['fecha_campana'] <= pd.Timestamp(hasta)]
+        return muestras.reset_index(drop=True)
+
+    def _indice(self):
+        # Árbol KD de todas las muestras; se construye la primera vez que se consulta
+        if self._arbol is None:
+            self._muestras = self.cargar()
+            self._arbol = cKDTree(self._muestras[['x', 'y']].to_numpy())
+        return self._arbol, self._muestras
+
+    def mas_cercanas(self, x, y, k=1):
+        """Las `k` muestras más próximas a (x, y), con su distancia en la columna 'distancia'."""
+        arbol, muestras = self._indice()
+        k = min(k, len(muestras))
+        if k == 0:
+            return muestras.assign(distancia=np.empty(0))
+        distancias, indices = arbol.query([x, y], k=k)
+        distancias, indices = np.atleast_1d(distancias), np.atleast_1d(indices)
+        return muestras.iloc[indices].assign(distancia=distancias)
+
+    def en_radio(self, x, y, radio):
+        """Muestras a `radio` o menos de (x, y), de la más próxima a la más lejana."""
+        arbol, muestras = self._indice()
+        indices = arbol.query_ball_point([x, y], r=radio)
+        seleccion = muestras.iloc[indices]
+        distancias = np.hypot(seleccion['x'].to_numpy() - x, seleccion['y'].to_numpy() - y)
+        return seleccion.assign(distancia=distancias).sort_values('distancia')
+
+
+def directorio_almacen(ruta_excel):
+    """Almacén por defecto: carpeta 'muestras_campo' junto al Excel."""
+    return os.path.join(os.path.dirname(os.path.abspath(ruta_excel)), 'muestras_campo')
+
+
+def cargar_excel(ruta_excel, columnas=None, fecha=None, directorio=None):
+    """
+    Muestras de un Excel de campo con el esquema normalizado, pasando por el almacén.
+
+    La primera vez (o si el Excel cambia) se lee el Excel y se guarda en Parquet;
+    las siguientes se lee directamente el Parquet.
+    """
+    almacen = AlmacenMuestras(directorio or directorio_almacen(ruta_excel))
+    almacen.agregar_excel(ruta_excel, fecha, columnas)
+    return almacen.cargar([ruta_excel])
@@ -0,0 +1,130 @@
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+# 'cercano' devuelve el valor del píxel que contiene el punto, como src.sample;
+# 'bilineal' interpola entre los cuatro centros de píxel más próximos;
+# 'media' y 'mediana' resumen una vecindad de vecindad × vecindad píxeles centrada en el punto
+METODOS = ('cercano', 'bilineal', 'media', 'mediana')
+
+
+def _margen(metodo, vecindad):
+    """Píxeles extra que hay que leer alrededor de cada bloque."""
+    if metodo == 'bilineal':
+        return 1
+    if metodo in ('media', 'mediana'):
+        if vecindad < 1 or vecindad % 2 == 0:
+            raise ValueError(f"La vecindad debe ser un número impar positivo (se recibió {vecindad}).")
+        return vecindad // 2
+    return 0
+
+
+def _leer_con_margen(src, banda, fila0, col0, alto, ancho, margen):
+    """
+    Lee la ventana ampliada en `margen` píxeles por cada lado como float64.
+
+    Lo que cae fuera del raster y los píxeles sin dato quedan como NaN.
+    """
+    datos = np.full((alto + 2 * margen, ancho + 2 * margen), np.nan)
+    f0, c0 = max(fila0 - margen, 0), max(col0 - margen, 0)
+    f1, c1 = min(fila0 + alto + margen, src.height), min(col0 + ancho + margen, src.width)
+    leido = src.read(banda, window=Window(c0, f0, c1 - c0, f1 - f0)).astype(np.float64)
+    if src.nodata is not None and not np.isnan(src.nodata):
+        leido[leido == src.nodata] = np.nan
+    datos[f0 - fila0 + margen:f1 - fila0 + margen, c0 - col0 + margen:c1 - col0 + margen] = leido
+    return datos
+
+
+def _valores_bloque(datos, filas, cols, metodo, vecindad):
+    """Valores de los puntos de un bloque; `filas` y `cols` son fraccionarias y relativas a `datos`."""
+    if metodo == 'cercano':
+        return datos[np.floor(filas).astype(np.intp), np.floor(cols).astype(np.intp)]
+
+    if metodo == 'bilineal':
+        # Coordenadas respecto a los centros de píxel
+        fy, fx = filas - 0.5, cols - 0.5
+        y0, x0 = np.floor(fy).astype(np.intp), np.floor(fx).astype(np.intp)
+        wy, wx = fy - y0, fx - x0
+        esquinas = np.stack([datos[y0, x0], datos[y0, x0 + 1], datos[y0 + 1, x0], datos[y0 + 1, x0 + 1]])
+        pesos = np.stack([(1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx])
+        # Los vecinos sin dato no cuentan y se reparte su peso entre los demás
+        pesos = np.where(np.isnan(esquinas), 0.0, pesos)
+        suma_pesos = pesos.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(suma_pesos > 0, np.nansum(esquinas * pesos, axis=0) / suma_pesos, np.nan)
+
+    radio = vecindad // 2
+    desplazamientos = np.arange(-radio, radio + 1)
+    f = np.floor(filas).astype(np.intp)[:, None, None] + desplazamientos[None, :, None]
+    c = np.floor(cols).astype(np.intp)[:, None, None] + desplazamientos[None, None, :]
+    vecinos = datos[f, c].reshape(len(filas), -1)
+    validos = ~np.isnan(vecinos).all(axis=1)
+    resultado = np.full(len(filas), np.nan)
+    if validos.any():
+        reductor = np.nanmean if metodo == 'media' else np.nanmedian
+        resultado[validos] = reductor(vecinos[validos], axis=1)
+    return resultado
+
+
+def muestrear(src, xs, ys, banda=1, metodo='cercano', vecindad=3):
+    """
+    Valores del raster en los puntos (xs, ys), expresados en el sistema de coordenadas del raster.
+
+    `src` puede ser una ruta o un dataset abierto. Las coordenadas se pasan a
+    fila/columna de una vez con la transformación inversa y los puntos se agrupan
+    por bloque interno del archivo, de modo que cada bloque se lee una sola vez.
+    Devuelve un array de coma flotante (float32, o float64 si el raster lo es)
+    del mismo largo que `xs`; los puntos fuera del raster o sobre píxeles sin
+    dato valen NaN.
+    """
+    if metodo not in METODOS:
+        raise ValueError(f"Método de muestreo no válido: '{metodo}' (opciones: {', '.join(METODOS)})")
+    if isinstance(src, str):
+        with rasterio.open(src) as dataset:
+            return muestrear(dataset, xs, ys, banda, metodo, vecindad)
+
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    margen = _margen(metodo, vecindad)
+    cols, filas = ~src.transform * (xs, ys)
+    # Mismo tipo que el raster cuando ya es float32, para que los ajustes den lo mismo que con src.sample
+    tipo = np.result_type(src.dtypes[banda - 1], np.float32)
+    resultado = np.full(xs.shape, np.nan, dtype=tipo)
+
+    dentro = (filas >= 0) & (filas < src.height) & (cols >= 0) & (cols < src.width)
+    indices = np.flatnonzero(dentro)
+    if not len(indices):
+        return resultado
+
+    # Agrupación de los puntos por el bloque interno que contiene su píxel
+    alto_bloque, ancho_bloque = src.block_shapes[banda - 1]
+    bloque_fila = filas[indices].astype(np.intp) // alto_bloque
+    bloque_col = cols[indices].astype(np.intp) // ancho_bloque
+    orden = np.lexsort((bloque_col, bloque_fila))
+    indices, bloque_fila, bloque_col = indices[orden], bloque_fila[orden], bloque_col[orden]
+    cortes = np.flatnonzero(np.diff(bloque_fila) | np.diff(bloque_col)) + 1
+
+    for grupo in np.split(np.arange(len(indices)), cortes):
+        fila0 = bloque_fila[grupo[0]] * alto_bloque
+        col0 = bloque_col[grupo[0]] * ancho_bloque
+        alto = min(alto_bloque, src.height - fila0)
+        ancho = min(ancho_bloque, src.width - col0)
+        datos = _leer_con_margen(src, banda, fila0, col0, alto, ancho, margen)
+        puntos = indices[grupo]
+        resultado[puntos] = _valores_bloque(datos, filas[puntos] - fila0 + margen, cols[puntos] - col0 + margen,
+                                            metodo, vecindad)
+    return resultado
+
+
+def muestrear_varios(rutas, xs, ys, banda=1, metodo='cercano', vecindad=3):
+    """Muestrea los mismos puntos en varios rásteres (p. ej. fechas); devuelve un array (puntos, rásteres)."""
+    return np.column_stack([muestrear(ruta, xs, ys, banda, metodo, vecindad) for ruta in rutas])
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos del muestreo de los puntos de campo."""
+    parser.add_argument('--muestreo', choices=METODOS, default='cercano',
+                        help="Cómo se toma el valor en cada punto: 'cercano' (píxel que lo contiene, como hasta ahora), "
+                             "'bilineal', o 'media'/'mediana' de una vecindad.")
+    parser.add_argument('--vecindad', type=int, default=3,
+                        help="Lado en píxeles (impar) de la vecindad de 'media' y 'mediana' (por defecto 3).")
@@ -1,7 +1,14 @@
-import rasterio
-import numpy as np
-import matplotlib.pyplot as plt
 import os
+import argparse
+
+import bloques
+import cache
+import escritura
+import estadisticas
+import instrumentacion
+import validez
+from indices import PRECISIONES, calcular_indices
+from vista_previa import guardar_vista_previa
 
 # --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
 ruta_carpeta = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m'
@@ -11,42 +18,60 @@ ruta_b4 = os.path.join(ruta_carpeta, nombre_b4)
 ruta_b8 = os.path.join(ruta_carpeta, nombre_b8)
 ruta_salida_ndsi = os.path.join(ruta_carpeta, 'NDSI_mapa.tiff')
 
-# --- 2. LECTURA, ESCALADO Y CÁLCULO DEL ÍNDICE ---
+# Clasificación de escena (SCL) de L2A, opcional: con --omitir-vacios descarta también los bloques de las
+# clases de --clases-scl, p. ej. ruta_scl = os.path.join(ruta_carpeta, '..', 'R20m', 'T17LQL_20250721T152721_SCL_20m.jp2')
+ruta_scl = None
+
+# Tamaño de las ventanas de procesamiento en píxeles (None = bloques internos del GeoTIFF)
+tamano_ventana = None
+
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Calcula el índice NDSI por ventanas.')
+parser.add_argument('--workers', type=int, default=1, help='Número de hilos de cálculo (por defecto 1).')
+parser.add_argument('--precision', choices=PRECISIONES, default='exacta',
+                    help="'exacta' reproduce el cálculo original en float64; 'float32'/'float64' usan los núcleos fusionados.")
+bloques.agregar_argumentos(parser)
+cache.agregar_argumentos(parser)
+escritura.agregar_argumentos(parser)
+validez.agregar_argumentos(parser)
+estadisticas.agregar_argumentos(parser)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'ndsi')
+
+# --- 2. LECTURA, CÁLCULO Y GUARDADO POR VENTANAS ---
 try:
-    with rasterio.open(ruta_b4) as src_b4:
-        banda_b4 = src_b4.read(1).astype(float) / 10000
-        perfil_b4 = src_b4.profile.copy()
-    with rasterio.open(ruta_b8) as src_b8:
-        banda_b8 = src_b8.read(1).astype(float) / 10000
-    print("Bandas B4 y B8 leídas y escaladas correctamente.")
-
-    denominador = banda_b8 + banda_b4
-    cero_mask = (denominador == 0)
-    ndsi = np.where(cero_mask, np.nan, (banda_b8 - banda_b4) / denominador)
-    print("Cálculo del NDSI completado.")
-
-    # --- 3. GUARDAR EL RESULTADO ---
-    perfil_salida = perfil_b4.copy()
-    perfil_salida.update(
-        dtype=rasterio.float32,
-        count=1,
-        driver='GTiff'
-    )
-    with rasterio.open(ruta_salida_ndsi, 'w', **perfil_salida) as dst:
-        dst.write(ndsi.astype(rasterio.float32), 1)
-    print(f"El archivo NDSI se ha guardado en: {ruta_salida_ndsi}")
-
-    # --- 4. VISUALIZACIÓN CORREGIDA ---
-    plt.figure(figsize=(10, 10))
+    # La fórmula del NDSI está definida en indices.py
+    with instrumentacion.etapa('indices'):
+        recalculados = calcular_indices(
+            {'B04': ruta_b4, 'B08': ruta_b8},
+            {'NDSI': ruta_salida_ndsi},
+            tamano_ventana=tamano_ventana,
+            workers=args.workers,
+            precision=args.precision,
+            usar_cache=not args.forzar,
+            hash_contenido=args.hash_entradas,
+            formato=args.formato,
+            compresion=args.compresion,
+            remuestreo=args.remuestreo,
+            omitir_vacios=args.omitir_vacios,
+            ruta_scl=ruta_scl,
+            clases_scl=args.clases_scl
+        )
+    if recalculados:
+        print("Cálculo del NDSI completado.")
+        print(f"El archivo NDSI se ha guardado en: {ruta_salida_ndsi}")
+    else:
+        print(f"El archivo NDSI ya estaba actualizado, se reutiliza: {ruta_salida_ndsi}")
+
+    # --- 3. VISUALIZACIÓN CORREGIDA ---
     # Cambiamos la paleta de colores para que represente mejor la salinidad
-    plt.imshow(ndsi, cmap='YlOrRd', vmin=-0.2, vmax=0.4) 
-    plt.colorbar(label='Índice de Salinidad Normalizado (NDSI)')
-    plt.title('Mapa de NDSI (Salinidad)')
-    
     ruta_salida_png = os.path.join(ruta_carpeta, 'NDSI_mapa.png')
-    plt.savefig(ruta_salida_png)
+    with instrumentacion.etapa('grafico'):
+        guardar_vista_previa(ruta_salida_ndsi, ruta_salida_png, 'YlOrRd', -0.2, 0.4,
+                             etiqueta='Índice de Salinidad Normalizado (NDSI)', titulo='Mapa de NDSI (Salinidad)',
+                             estiramiento=args.estiramiento)
     print(f"La visualización del mapa se ha guardado en: {ruta_salida_png}")
-    plt.show()
 
 except FileNotFoundError:
     print(f"Error: No se encontraron los archivos de banda. Verifica los nombres y la ruta.")
@@ -1,7 +1,14 @@
-import rasterio
-import numpy as np
-import matplotlib.pyplot as plt
 import os
+import argparse
+
+import bloques
+import cache
+import escritura
+import estadisticas
+import instrumentacion
+import validez
+from indices import PRECISIONES, calcular_indices
+from vista_previa import guardar_vista_previa
 
 # --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
 ruta_carpeta = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m'
@@ -15,46 +22,59 @@ ruta_b4 = os.path.join(ruta_carpeta, nombre_b4)
 ruta_b8 = os.path.join(ruta_carpeta, nombre_b8)
 ruta_salida_ndvi = os.path.join(ruta_carpeta, 'NDVI_mapa.tiff')
 
-# --- 2. LECTURA, ESCALADO Y CÁLCULO DEL ÍNDICE ---
+# Clasificación de escena (SCL) de L2A, opcional: con --omitir-vacios descarta también los bloques de las
+# clases de --clases-scl, p. ej. ruta_scl = os.path.join(ruta_carpeta, '..', 'R20m', 'T17LQL_20250721T152721_SCL_20m.jp2')
+ruta_scl = None
+
+# Tamaño de las ventanas de procesamiento en píxeles (None = bloques internos del GeoTIFF)
+tamano_ventana = None
+
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Calcula el índice NDVI por ventanas.')
+parser.add_argument('--workers', type=int, default=1, help='Número de hilos de cálculo (por defecto 1).')
+parser.add_argument('--precision', choices=PRECISIONES, default='exacta',
+                    help="'exacta' reproduce el cálculo original en float64; 'float32'/'float64' usan los núcleos fusionados.")
+bloques.agregar_argumentos(parser)
+cache.agregar_argumentos(parser)
+escritura.agregar_argumentos(parser)
+validez.agregar_argumentos(parser)
+estadisticas.agregar_argumentos(parser)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'ndvi')
+
+# --- 2. LECTURA, CÁLCULO Y GUARDADO POR VENTANAS ---
 try:
-    with rasterio.open(ruta_b4) as src_b4:
-        banda_b4 = src_b4.read(1).astype(float) / 10000
-        perfil_b4 = src_b4.profile.copy()
-
-    with rasterio.open(ruta_b8) as src_b8:
-        banda_b8 = src_b8.read(1).astype(float) / 10000
-        
-    print("Bandas B4 y B8 leídas y escaladas correctamente.")
-
-    # Aplica la fórmula del NDVI: (NIR - Rojo) / (NIR + Rojo)
-    denominador_ndvi = banda_b8 + banda_b4
-    cero_mask = (denominador_ndvi == 0)
-    ndvi = np.where(cero_mask, np.nan, (banda_b8 - banda_b4) / denominador_ndvi)
-    
-    print("Cálculo del NDVI completado.")
-
-    # --- 3. GUARDAR RESULTADO ---
-    perfil_salida = perfil_b4.copy()
-    perfil_salida.update(
-        dtype=rasterio.float32,
-        count=1,
-        driver='GTiff'
-    )
-    
-    with rasterio.open(ruta_salida_ndvi, 'w', **perfil_salida) as dst:
-        dst.write(ndvi.astype(rasterio.float32), 1)
-    print(f"El archivo NDVI se ha guardado en: {ruta_salida_ndvi}")
-
-    # --- 4. VISUALIZACIÓN ---
-    plt.figure(figsize=(10, 10))
-    plt.imshow(ndvi, cmap='YlGn', vmin=-0.2, vmax=1.0)
-    plt.colorbar(label='Índice de Vegetación (NDVI)')
-    plt.title('Mapa de NDVI')
-    
+    # La fórmula del NDVI está definida en indices.py
+    with instrumentacion.etapa('indices'):
+        recalculados = calcular_indices(
+            {'B04': ruta_b4, 'B08': ruta_b8},
+            {'NDVI': ruta_salida_ndvi},
+            tamano_ventana=tamano_ventana,
+            workers=args.workers,
+            precision=args.precision,
+            usar_cache=not args.forzar,
+            hash_contenido=args.hash_entradas,
+            formato=args.formato,
+            compresion=args.compresion,
+            remuestreo=args.remuestreo,
+            omitir_vacios=args.omitir_vacios,
+            ruta_scl=ruta_scl,
+            clases_scl=args.clases_scl
+        )
+    if recalculados:
+        print("Cálculo del NDVI completado.")
+        print(f"El archivo NDVI se ha guardado en: {ruta_salida_ndvi}")
+    else:
+        print(f"El archivo NDVI ya estaba actualizado, se reutiliza: {ruta_salida_ndvi}")
+
+    # --- 3. VISUALIZACIÓN ---
     ruta_salida_png = os.path.join(ruta_carpeta, 'NDVI_mapa.png')
-    plt.savefig(ruta_salida_png)
+    with instrumentacion.etapa('grafico'):
+        guardar_vista_previa(ruta_salida_ndvi, ruta_salida_png, 'YlGn', -0.2, 1.0,
+                             etiqueta='Índice de Vegetación (NDVI)', titulo='Mapa de NDVI',
+                             estiramiento=args.estiramiento)
     print(f"La visualización del mapa se ha guardado en: {ruta_salida_png}")
-    plt.show()
 
 except FileNotFoundError:
     print(f"Error: No se encontraron los archivos de banda. Verifica los nombres y la ruta.")
@@ -0,0 +1,81 @@
+import numpy as np
+
+# Factor de escala de los valores digitales de Sentinel-2 L2A a reflectancia
+FACTOR_REFLECTANCIA = 10000
+
+# 'exacta' reproduce el cálculo original en float64 (salida idéntica byte a byte);
+# 'float32' y 'float64' usan los núcleos de este módulo
+PRECISIONES = ('exacta', 'float32', 'float64')
+
+
+def _buffer(buffer, forma, dtype):
+    """Devuelve `buffer` si ya sirve para el resultado; si no, reserva uno nuevo."""
+    if buffer is None:
+        return np.empty(forma, dtype=dtype)
+    if buffer.shape != forma or buffer.dtype != np.dtype(dtype):
+        raise ValueError(f"El buffer debe tener forma {forma} y tipo {np.dtype(dtype)} "
+                         f"(tiene {buffer.shape} y {buffer.dtype}).")
+    return buffer
+
+
+def division_enmascarada(numerador, denominador, out):
+    """
+    out = numerador / denominador, con NaN donde el denominador es cero.
+
+    La división se hace en el propio `out`, que puede ser el mismo array que el
+    numerador o el denominador; no se evalúa un segundo cociente como con np.where.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(numerador, denominador, out=out)
+    # x / 0 da ±inf (o NaN si x también es 0): ambos casos quedan como NaN
+    np.copyto(out, np.nan, where=np.isinf(out))
+    return out
+
+
+def ssi(b4, b11, out=None, trabajo=None, dtype=np.float32):
+    """
+    Índice de Salinidad del Suelo a partir de los valores digitales de B4 y B11.
+
+    SSI = (B4 * B11) / (B4 + B11) en reflectancia, que equivale a
+    (B4 * B11) / ((B4 + B11) * 10000) en valores digitales, así que no hace falta
+    escalar cada banda por separado.
+
+    out: buffer de salida; trabajo: buffer auxiliar para el numerador. Ambos del
+    tamaño de la ventana y del tipo `dtype`; si no se pasan se reservan.
+    """
+    out = _buffer(out, b4.shape, dtype)
+    trabajo = _buffer(trabajo, b4.shape, dtype)
+    np.multiply(b4, b11, out=trabajo, dtype=dtype)
+    np.add(b4, b11, out=out, dtype=dtype)
+    np.multiply(out, FACTOR_REFLECTANCIA, out=out)
+    return division_enmascarada(trabajo, out, out)
+
+
+def diferencia_normalizada(a, b, out=None, trabajo=None, dtype=np.float32):
+    """
+    Diferencia normalizada (A - B) / (A + B), como el NDVI o el NDSI.
+
+    El escalado a reflectancia se cancela en el cociente, así que se calcula
+    directamente sobre los valores digitales.
+    """
+    out = _buffer(out, a.shape, dtype)
+    trabajo = _buffer(trabajo, a.shape, dtype)
+    np.subtract(a, b, out=trabajo, dtype=dtype)
+    np.add(a, b, out=out, dtype=dtype)
+    return division_enmascarada(trabajo, out, out)
+
+
+def calibracion_lineal(ssi, pendiente, intercepto, out=None, recortar_negativos=True, dtype=np.float32):
+    """
+    Conductividad = pendiente * SSI + intercepto, con NaN donde el SSI es NaN.
+
+    `out` puede ser el propio array del SSI para calibrar en el sitio. Con
+    `recortar_negativos` los valores negativos se llevan a 0 (el NaN se conserva).
+    """
+    out = _buffer(out, ssi.shape, dtype)
+    escalar = np.dtype(dtype).type
+    np.multiply(ssi, escalar(pendiente), out=out, dtype=dtype)
+    np.add(out, escalar(intercepto), out=out)
+    if recortar_negativos:
+        np.maximum(out, 0, out=out)
+    return out
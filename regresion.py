@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Intervalos de confianza de la pendiente y el intercepto
+METODOS_INTERVALO = ('bootstrap', 'jackknife')
+
+# Elementos (repeticiones × puntos) por tanda del bootstrap, para acotar la memoria
+ELEMENTOS_TANDA = 2 ** 22
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos de los intervalos de confianza de los modelos."""
+    parser.add_argument('--intervalos', choices=METODOS_INTERVALO, default=None,
+                        help='Calcula intervalos de confianza de la pendiente y el intercepto de cada modelo.')
+    parser.add_argument('--repeticiones', type=int, default=1000,
+                        help='Remuestreos del bootstrap (por defecto 1000).')
+    parser.add_argument('--confianza', type=float, default=0.95,
+                        help='Nivel de confianza de los intervalos (por defecto 0.95).')
+
+
+def _sumas_centradas(codigos, x, y, n_grupos):
+    """n, medias y sumas de cuadrados y productos centradas de cada grupo."""
+    n = np.bincount(codigos, minlength=n_grupos).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media_x = np.bincount(codigos, x, n_grupos) / n
+        media_y = np.bincount(codigos, y, n_grupos) / n
+    dx = x - media_x[codigos]
+    dy = y - media_y[codigos]
+    sxx = np.bincount(codigos, dx * dx, n_grupos)
+    sxy = np.bincount(codigos, dx * dy, n_grupos)
+    syy = np.bincount(codigos, dy * dy, n_grupos)
+    return n, media_x, media_y, dx, dy, sxx, sxy, syy
+
+
+def _recta(media_x, media_y, sxx, sxy):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pendiente = np.where(sxx > 0, sxy / sxx, np.nan)
+    return pendiente, media_y - pendiente * media_x
+
+
+def _intervalos_jackknife(codigos, n, media_x, media_y, dx, dy, sxx, sxy, confianza):
+    """Intervalo jackknife (t de Student) a partir de las rectas sin cada punto, en forma cerrada."""
+    n_i = n[codigos]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Quitar el punto i mueve la media y resta su aportación a las sumas centradas
+        factor = n_i / (n_i - 1)
+        sxx_i = sxx[codigos] - dx * dx * factor
+        sxy_i = sxy[codigos] - dx * dy * factor
+        media_x_i = media_x[codigos] - dx / (n_i - 1)
+        media_y_i = media_y[codigos] - dy / (n_i - 1)
+        pendiente_i = np.where(sxx_i > 0, sxy_i / sxx_i, np.nan)
+    intercepto_i = media_y_i - pendiente_i * media_x_i
+
+    n_grupos = len(n)
+    t = stats.t.ppf(0.5 + confianza / 2, np.maximum(n - 1, 1))
+    intervalos = {}
+    for nombre, valores in (('pendiente', pendiente_i), ('intercepto', intercepto_i)):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            media = np.bincount(codigos, valores, n_grupos) / n
+            varianza = (n - 1) / n * np.bincount(codigos, (valores - media[codigos]) ** 2, n_grupos)
+        intervalos[nombre] = t * np.sqrt(varianza)
+    return intervalos
+
+
+def _intervalos_bootstrap(codigos, n, media_x, media_y, dx, dy, repeticiones, confianza, semilla):
+    """Intervalo de percentiles con remuestreos dentro de cada grupo, todos los grupos a la vez."""
+    n_grupos = len(n)
+    orden = np.argsort(codigos, kind='stable')
+    codigos, dx, dy = codigos[orden], dx[orden], dy[orden]
+    inicios = np.concatenate(([0], np.cumsum(n)[:-1])).astype(np.int64)
+    generador = np.random.default_rng(semilla)
+
+    pendientes, interceptos = [], []
+    tanda = max(1, ELEMENTOS_TANDA // max(1, len(dx)))
+    for inicio in range(0, repeticiones, tanda):
+        b = min(tanda, repeticiones - inicio)
+        # Cada posición se sustituye por un punto al azar de su mismo grupo
+        indices = inicios[codigos] + (generador.random((b, len(dx))) * n[codigos]).astype(np.int64)
+        # Un código por (remuestreo, grupo) para sumar todos los remuestreos con un solo bincount
+        codigos_b = (np.arange(b)[:, np.newaxis] * n_grupos + codigos).ravel()
+        x_b, y_b = dx[indices].ravel(), dy[indices].ravel()
+        # Los valores ya están centrados en la media del grupo original, así que las sumas
+        # sin centrar de cada remuestreo no pierden precisión
+        suma_x = np.bincount(codigos_b, x_b, b * n_grupos).reshape(b, n_grupos)
+        suma_y = np.bincount(codigos_b, y_b, b * n_grupos).reshape(b, n_grupos)
+        suma_xx = np.bincount(codigos_b, x_b * x_b, b * n_grupos).reshape(b, n_grupos)
+        sxx = suma_xx - suma_x ** 2 / n
+        # Con todos los x iguales la resta deja solo un residuo de redondeo: no hay recta
+        sxx[sxx <= 1e-12 * suma_xx] = 0
+        sxy = np.bincount(codigos_b, x_b * y_b, b * n_grupos).reshape(b, n_grupos) - suma_x * suma_y / n
+        pendiente, intercepto = _recta(media_x + suma_x / n, media_y + suma_y / n, sxx, sxy)
+        pendientes.append(pendiente)
+        interceptos.append(intercepto)
+
+    cuantiles = [50 - confianza * 50, 50 + confianza * 50]
+    intervalos = {}
+    for nombre, valores in (('pendiente', pendientes), ('intercepto', interceptos)):
+        with np.errstate(invalid='ignore'):
+            # Los remuestreos con todos los x iguales no tienen recta y se ignoran
+            intervalos[nombre] = np.nanpercentile(np.concatenate(valores), cuantiles, axis=0)
+    return intervalos
+
+
+def ajustar_por_grupos(x, y, grupos, intervalos=None, repeticiones=1000, confianza=0.95, semilla=0):
+    """
+    Ajusta una recta y = pendiente * x + intercepto por mínimos cuadrados en cada grupo.
+
+    x, y: valores de los puntos; grupos: código entero (0, 1, ...) del grupo de
+    cada punto. Todas las rectas salen de una sola pasada con np.bincount, sin
+    un ajuste por grupo. Devuelve un DataFrame con una fila por código de grupo:
+      n, pendiente, intercepto, r2 (el de LinearRegression.score), r2_loo
+      (R² de validación dejando uno fuera, con el PRESS), rmse (error típico
+      de los residuos, n - 2 grados de libertad), residuo_max,
+      error_pendiente y error_intercepto.
+    Con `intervalos` ('bootstrap' o 'jackknife') añade pendiente_inf,
+    pendiente_sup, intercepto_inf e intercepto_sup al nivel `confianza`.
+    Los grupos con menos de dos puntos o con todos los x iguales quedan en NaN.
+    """
+    if intervalos is not None and intervalos not in METODOS_INTERVALO:
+        raise ValueError(f"Intervalo no válido: '{intervalos}' (opciones: {', '.join(METODOS_INTERVALO)})")
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    codigos = np.asarray(grupos, dtype=np.int64)
+    n_grupos = int(codigos.max()) + 1 if len(codigos) else 0
+
+    n, media_x, media_y, dx, dy, sxx, sxy, syy = _sumas_centradas(codigos, x, y, n_grupos)
+    pendiente, intercepto = _recta(media_x, media_y, sxx, sxy)
+    residuos = dy - pendiente[codigos] * dx
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ss_residuos = np.bincount(codigos, residuos * residuos, n_grupos)
+        r2 = np.where(syy > 0, 1 - ss_residuos / syy, np.nan)
+        # Residuo de cada punto con la recta ajustada sin él: e / (1 - h), con h el apalancamiento
+        apalancamiento = 1 / n[codigos] + dx * dx / sxx[codigos]
+        press = np.bincount(codigos, (residuos / (1 - apalancamiento)) ** 2, n_grupos)
+        r2_loo = np.where((syy > 0) & (n > 2), 1 - press / syy, np.nan)
+        rmse = np.where(n > 2, np.sqrt(ss_residuos / (n - 2)), np.nan)
+        error_pendiente = rmse / np.sqrt(sxx)
+        error_intercepto = rmse * np.sqrt(1 / n + media_x ** 2 / sxx)
+    residuo_max = np.full(n_grupos, np.nan)
+    validos = ~np.isnan(residuos)
+    np.fmax.at(residuo_max, codigos[validos], np.abs(residuos[validos]))
+
+    tabla = pd.DataFrame({
+        'n': n.astype(int), 'pendiente': pendiente, 'intercepto': intercepto, 'r2': r2, 'r2_loo': r2_loo,
+        'rmse': rmse, 'residuo_max': residuo_max,
+        'error_pendiente': error_pendiente, 'error_intercepto': error_intercepto,
+    })
+
+    if intervalos == 'jackknife':
+        semianchos = _intervalos_jackknife(codigos, n, media_x, media_y, dx, dy, sxx, sxy, confianza)
+        for nombre, semiancho in semianchos.items():
+            tabla[f'{nombre}_inf'] = tabla[nombre] - semiancho
+            tabla[f'{nombre}_sup'] = tabla[nombre] + semiancho
+    elif intervalos == 'bootstrap':
+        limites = _intervalos_bootstrap(codigos, n, media_x, media_y, dx, dy, repeticiones, confianza, semilla)
+        for nombre, (inferior, superior) in limites.items():
+            tabla[f'{nombre}_inf'] = inferior
+            tabla[f'{nombre}_sup'] = superior
+
+    # Sin recta no hay nada que medir
+    tabla.loc[tabla['n'] < 2, tabla.columns.drop('n')] = np.nan
+    return tabla
+
+
+def ajustar_tabla(df, x, y, por, intervalos=None, repeticiones=1000, confianza=0.95, semilla=0):
+    """
+    Ajusta una recta por cada combinación de las columnas `por` de `df`.
+
+    x: columna de la variable explicativa, o lista de columnas (p. ej. un
+    índice por columna); con una lista se ajusta cada una por separado y la
+    tabla lleva una columna 'variable'. Se ignoran las filas con x o y NaN.
+    Devuelve una fila por grupo con las columnas de agrupación seguidas de las
+    de `ajustar_por_grupos`.
+    """
+    por = [por] if isinstance(por, str) else list(por)
+    if isinstance(x, str):
+        largo = df[por + [x, y]].rename(columns={x: '_x', y: '_y'})
+    else:
+        por = por + ['variable']
+        largo = df.melt(id_vars=[c for c in por if c != 'variable'] + [y], value_vars=list(x),
+                        var_name='variable', value_name='_x').rename(columns={y: '_y'})
+    largo = largo.dropna(subset=['_x', '_y'])
+
+    claves = largo[por].drop_duplicates().sort_values(por).reset_index(drop=True)
+    codigos = pd.MultiIndex.from_frame(claves).get_indexer(pd.MultiIndex.from_frame(largo[por]))
+    resultado = ajustar_por_grupos(largo['_x'].to_numpy(), largo['_y'].to_numpy(), codigos, intervalos,
+                                   repeticiones, confianza, semilla)
+    return pd.concat([claves, resultado.reindex(range(len(claves)))], axis=1)
+
+
+def modelos_de_tabla(tabla, columna):
+    """
+    dict grupo -> (pendiente, intercepto) para `aplicar_calibracion_por_zonas`.
+
+    Se omiten los grupos sin recta (menos de dos puntos).
+    """
+    validas = tabla.dropna(subset=['pendiente'])
+    return {grupo: (pendiente, intercepto)
+            for grupo, pendiente, intercepto in zip(validas[columna], validas['pendiente'], validas['intercepto'])}
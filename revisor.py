@@ -1,43 +1,64 @@
-import rasterio
 import os
-import glob
+import argparse
+import json
+
+import instrumentacion
+from catalogo import WORKERS, Catalogo, ruta_por_defecto
 
 # --- CONFIGURACIÓN DE LA RUTA ---
+# Carpeta que se revisa (se recorre de forma recursiva)
 ruta_carpeta = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_20250721T153200\IMG_DATA\R10m'
 
-# --- PROCESO DE VERIFICACIÓN ---
-archivos_tiff = glob.glob(os.path.join(ruta_carpeta, '*.tif'))
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(
+    description='Cataloga los metadatos de los GeoTIFF de una o varias carpetas en SQLite y los muestra.')
+parser.add_argument('raices', nargs='*', default=[ruta_carpeta], help='Carpetas a revisar (por defecto la de la configuración).')
+parser.add_argument('--catalogo', default=None,
+                    help=f'Archivo SQLite del catálogo (por defecto {os.path.basename(ruta_por_defecto("."))} '
+                         'en la primera carpeta).')
+parser.add_argument('--workers', type=int, default=WORKERS,
+                    help=f'Hilos que abren los archivos nuevos o modificados (por defecto {WORKERS}).')
+parser.add_argument('--tile', default=None, help='Muestra solo los archivos de este tile (p. ej. 17LQL).')
+parser.add_argument('--banda', default=None, help='Muestra solo los archivos de esta banda (p. ej. B04).')
+parser.add_argument('--resumen', action='store_true', help='Actualiza el catálogo sin listar los archivos.')
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'revisor')
 
-if not archivos_tiff:
-    print("Error: No se encontraron archivos .tiff en la ruta especificada.")
-    exit()
+# --- PROCESO DE VERIFICACIÓN ---
+try:
+    with Catalogo(args.catalogo or ruta_por_defecto(args.raices[0])) as catalogo:
+        # Solo se abren los archivos nuevos o modificados desde la revisión anterior
+        with instrumentacion.etapa('catalogo', raices=len(args.raices)):
+            resumen = catalogo.actualizar(args.raices, workers=args.workers)
+        print(f"Catálogo actualizado en: {catalogo.ruta}")
+        print(f"  {resumen['nuevos']} nuevos, {resumen['modificados']} modificados, "
+              f"{resumen['sin_cambios']} sin cambios, {resumen['eliminados']} eliminados.")
 
-print(f"Se encontraron {len(archivos_tiff)} archivos GeoTIFF para verificar.")
-print("---")
+        archivos = [fila for raiz in args.raices
+                    for fila in catalogo.consultar(raiz=raiz, tile=args.tile, banda=args.banda, con_error=True)]
+        if not archivos:
+            print("Error: No se encontraron archivos .tiff en la ruta especificada.")
+            exit()
 
-for archivo in archivos_tiff:
-    try:
-        with rasterio.open(archivo) as src:
-            nombre_archivo = os.path.basename(archivo)
-            
-            # --- LÍNEAS CORREGIDAS ---
-            crs = src.crs.to_string() if src.crs else "CRS no encontrado"
-            resolucion_x = src.transform.a  # Forma correcta de obtener la resolución en X
-            resolucion_y = -src.transform.e # Forma correcta de obtener la resolución en Y
-            # --- FIN DE LÍNEAS CORREGIDAS ---
-            
-            ancho = src.width
-            alto = src.height
-            tipo_dato = src.profile['dtype']
-            
-            print(f"Archivo: {nombre_archivo}")
-            print(f"  - Sistema de Referencia de Coordenadas (CRS): {crs}")
-            print(f"  - Resolución Espacial (Tamaño del píxel): {resolucion_x} x {resolucion_y} metros")
-            print(f"  - Dimensiones (ancho x alto): {ancho} x {alto} píxeles")
-            print(f"  - Tipo de Dato (dtype): {tipo_dato}")
-            print("---")
+        print(f"Se encontraron {len(archivos)} archivos GeoTIFF para verificar.")
+        print("---")
+        if not args.resumen:
+            for fila in archivos:
+                if fila['error'] is not None:
+                    print(f"Error al leer el archivo '{fila['nombre']}': {fila['error']}")
+                    continue
+                print(f"Archivo: {fila['nombre']}")
+                print(f"  - Sistema de Referencia de Coordenadas (CRS): {fila['crs'] or 'CRS no encontrado'}")
+                print(f"  - Resolución Espacial (Tamaño del píxel): {fila['resolucion_x']} x {fila['resolucion_y']} metros")
+                print(f"  - Dimensiones (ancho x alto): {fila['ancho']} x {fila['alto']} píxeles")
+                print(f"  - Tipo de Dato (dtype): {fila['dtype']}")
+                print(f"  - Bloques: {fila['bloque_x']} x {fila['bloque_y']}, "
+                      f"vistas reducidas: {json.loads(fila['overviews']) or 'ninguna'}, "
+                      f"nodata: {fila['nodata']}, compresión: {fila['compresion'] or 'ninguna'}")
+                print("---")
+        elif resumen['errores']:
+            print(f"{resumen['errores']} archivos nuevos o modificados no se pudieron leer.")
 
-    except rasterio.errors.RasterioIOError as e:
-        print(f"Error al leer el archivo '{os.path.basename(archivo)}': {e}")
-    except Exception as e:
-        print(f"Ocurrió un error inesperado con el archivo '{os.path.basename(archivo)}': {e}")
\ No newline at end of file
+except Exception as e:
+    print(f"Ocurrió un error inesperado: {e}")
@@ -1,7 +1,14 @@
-import rasterio
-import numpy as np
-import matplotlib.pyplot as plt
 import os
+import argparse
+
+import bloques
+import cache
+import escritura
+import estadisticas
+import instrumentacion
+import validez
+from indices import PRECISIONES, calcular_indices
+from vista_previa import guardar_vista_previa
 
 # --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
 
@@ -11,57 +18,72 @@ ruta_carpeta = r'D:\INFORMES-PECH\2025\AGOSTO\IMAGENES\L2A_T17LQL_A004571_202507
 # Nombres de los archivos de entrada
 nombre_b4 = 'T17LQL_20250721T152721_B04_10m.tif'
 nombre_b11 = 'T17LQL_20250721T152721_B11_10m.tif'
+# B11 también puede tomarse tal cual del SAFE, a 20 m: se remuestrea a 10 m al leer cada ventana, p. ej.
+# ruta_b11 = os.path.join(ruta_carpeta, '..', 'R20m', 'T17LQL_20250721T152721_B11_20m.jp2')
 
 # Construye las rutas completas
 ruta_b4 = os.path.join(ruta_carpeta, nombre_b4)
 ruta_b11 = os.path.join(ruta_carpeta, nombre_b11)
 ruta_salida_ssi = os.path.join(ruta_carpeta, 'SSI_final.tiff')
 
-# --- 2. LECTURA, ESCALADO Y CÁLCULO DEL ÍNDICE ---
-
-try:
-    with rasterio.open(ruta_b4) as src_b4:
-        # Leemos los datos y los convertimos a reflectancia real
-        banda_b4 = src_b4.read(1).astype(float) / 10000
-        perfil_b4 = src_b4.profile.copy()
+# Clasificación de escena (SCL) de L2A, opcional: con --omitir-vacios descarta también los bloques de las
+# clases de --clases-scl, p. ej. ruta_scl = os.path.join(ruta_carpeta, '..', 'R20m', 'T17LQL_20250721T152721_SCL_20m.jp2')
+ruta_scl = None
 
-    with rasterio.open(ruta_b11) as src_b11:
-        # Leemos los datos y los convertimos a reflectancia real
-        banda_b11 = src_b11.read(1).astype(float) / 10000
-        
-    print("Bandas B4 y B11 leídas y escaladas correctamente.")
+# Tamaño de las ventanas de procesamiento en píxeles (None = bloques internos del GeoTIFF)
+tamano_ventana = None
 
-    # Aplicamos la fórmula del SSI: (B4 * B11) / (B4 + B11)
-    denominador_ssi = banda_b4 + banda_b11
-    cero_mask_ssi = (denominador_ssi == 0)
-    ssi = np.where(cero_mask_ssi, np.nan, (banda_b4 * banda_b11) / denominador_ssi)
-    
-    print("Cálculo del SSI completado.")
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Calcula el índice SSI por ventanas.')
+parser.add_argument('--workers', type=int, default=1, help='Número de hilos de cálculo (por defecto 1).')
+parser.add_argument('--precision', choices=PRECISIONES, default='exacta',
+                    help="'exacta' reproduce el cálculo original en float64; 'float32'/'float64' usan los núcleos fusionados.")
+bloques.agregar_argumentos(parser)
+cache.agregar_argumentos(parser)
+escritura.agregar_argumentos(parser)
+validez.agregar_argumentos(parser)
+estadisticas.agregar_argumentos(parser)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'ssi')
 
-    # --- 3. GUARDAR RESULTADOS ---
+# --- 2. LECTURA, CÁLCULO Y GUARDADO POR VENTANAS ---
 
-    perfil_salida = perfil_b4.copy()
-    perfil_salida.update(
-        dtype=rasterio.float32,
-        count=1,
-        driver='GTiff'
-    )
-    
-    with rasterio.open(ruta_salida_ssi, 'w', **perfil_salida) as dst:
-        dst.write(ssi.astype(rasterio.float32), 1)
-    print(f"El archivo SSI final se ha guardado en: {ruta_salida_ssi}")
+try:
+    # Cada ventana se lee, se calcula y se escribe antes de pasar a la siguiente,
+    # por lo que la memoria usada depende del tamaño de ventana y no de la escena.
+    # La fórmula del SSI está definida en indices.py
+    with instrumentacion.etapa('indices'):
+        recalculados = calcular_indices(
+            {'B04': ruta_b4, 'B11': ruta_b11},
+            {'SSI': ruta_salida_ssi},
+            tamano_ventana=tamano_ventana,
+            workers=args.workers,
+            precision=args.precision,
+            usar_cache=not args.forzar,
+            hash_contenido=args.hash_entradas,
+            formato=args.formato,
+            compresion=args.compresion,
+            remuestreo=args.remuestreo,
+            omitir_vacios=args.omitir_vacios,
+            ruta_scl=ruta_scl,
+            clases_scl=args.clases_scl
+        )
+    if recalculados:
+        print("Cálculo del SSI completado.")
+        print(f"El archivo SSI final se ha guardado en: {ruta_salida_ssi}")
+    else:
+        print(f"El archivo SSI final ya estaba actualizado, se reutiliza: {ruta_salida_ssi}")
 
-    # --- 4. VISUALIZACIÓN ---
+    # --- 3. VISUALIZACIÓN ---
 
-    plt.figure(figsize=(10, 10))
-    plt.imshow(ssi, cmap='plasma', vmin=0, vmax=0.5) # Ajustamos el rango de visualización
-    plt.colorbar(label='Índice de Salinidad del Suelo (SSI)')
-    plt.title('Mapa SSI (Salinidad)')
-    
+    # Para la vista previa basta una versión reducida del mapa ya guardado
     ruta_salida_png = os.path.join(ruta_carpeta, 'SSI_mapa.png')
-    plt.savefig(ruta_salida_png)
+    with instrumentacion.etapa('grafico'):
+        guardar_vista_previa(ruta_salida_ssi, ruta_salida_png, 'plasma', 0, 0.5, # Ajustamos el rango de visualización
+                             etiqueta='Índice de Salinidad del Suelo (SSI)', titulo='Mapa SSI (Salinidad)',
+                             estiramiento=args.estiramiento)
     print(f"La visualización del mapa se ha guardado en: {ruta_salida_png}")
-    plt.show()
 
 except FileNotFoundError:
     print(f"Error: No se encontraron los archivos de banda. Verifica los nombres y la ruta.")
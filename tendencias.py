@@ -0,0 +1,48 @@
+import os
+import argparse
+
+import escritura
+import instrumentacion
+from cubo import ESTADISTICAS, CuboTemporal, calcular_estadisticas, ruta_cubo
+
+# --- 1. CONFIGURACIÓN DE LA RUTA Y ARCHIVOS ---
+# Carpeta donde lote.py --cubos guarda los cubos temporales
+ruta_cubos = r'D:\INFORMES-PECH\CUBOS'
+indice = 'SSI'
+tile = '17LQL'
+
+# Opciones de línea de comandos
+parser = argparse.ArgumentParser(description='Estadísticas por píxel de la serie temporal de un índice.')
+parser.add_argument('--indice', default=indice, help='Índice del cubo (por defecto SSI).')
+parser.add_argument('--tile', default=tile, help='Tile del cubo, p. ej. 17LQL.')
+parser.add_argument('--estadisticas', nargs='+', choices=ESTADISTICAS,
+                    default=['media', 'desviacion', 'minimo', 'maximo', 'pendiente'],
+                    help="Estadísticas a calcular; 'pendiente' es la tendencia lineal por año.")
+parser.add_argument('--workers', type=int, default=1, help='Número de hilos (por defecto 1).')
+escritura.agregar_argumentos(parser)
+instrumentacion.agregar_argumentos(parser)
+args = parser.parse_args()
+instrumentacion.configurar(args, 'tendencias')
+
+directorio_cubo = ruta_cubo(ruta_cubos, args.indice, args.tile)
+
+# --- 2. CÁLCULO POR BLOQUES DEL CUBO ---
+try:
+    cubo = CuboTemporal(directorio_cubo)
+    fechas = sorted(cubo.fechas)
+    print(f"Cubo {args.indice} del tile {args.tile}: {len(fechas)} fechas "
+          f"({fechas[0]:%Y-%m-%d} a {fechas[-1]:%Y-%m-%d}).")
+
+    # Cada bloque tiene toda su serie contigua en disco: se lee una vez y se reduce en memoria
+    rutas_salida = {estadistica: os.path.join(directorio_cubo, f'{args.indice}_{estadistica}.tiff')
+                    for estadistica in args.estadisticas}
+    with instrumentacion.etapa('estadisticas', indice=args.indice, tile=args.tile, fechas=len(fechas)):
+        calcular_estadisticas(directorio_cubo, rutas_salida, workers=args.workers,
+                              formato=args.formato, compresion=args.compresion)
+    for estadistica, ruta in rutas_salida.items():
+        print(f"El mapa de {estadistica} se ha guardado en: {ruta}")
+
+except FileNotFoundError:
+    print(f"Error: No se encontró el cubo en '{directorio_cubo}'. Genéralo con lote.py --cubos.")
+except Exception as e:
+    print(f"Ocurrió un error inesperado: {e}")
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds as ventana_de_limites
+
+from cache import clave_cache
+
+# Proyección Web Mercator (EPSG:3857) de las teselas XYZ de los mapas web
+CRS_TESELAS = 'EPSG:3857'
+TAMANO_TESELA = 256
+ORIGEN_MERCATOR = math.pi * 6378137.0  # Mitad del lado del mundo en metros
+
+NOMBRE_MANIFIESTO = 'manifiesto.json'
+
+# Píxeles de margen alrededor de la zona del raster que cae en cada tesela, para que el vecino más
+# cercano del borde también se lea
+MARGEN_VENTANA = 2
+
+
+def limites_tesela(z, x, y):
+    """Límites (oeste, sur, este, norte) de la tesela z/x/y en metros Web Mercator."""
+    lado = 2 * ORIGEN_MERCATOR / 2 ** z
+    oeste = -ORIGEN_MERCATOR + x * lado
+    norte = ORIGEN_MERCATOR - y * lado
+    return oeste, norte - lado, oeste + lado, norte
+
+
+def teselas_que_cubren(limites, z):
+    """Lista de (x, y) de las teselas del nivel z que tocan los límites dados en EPSG:3857."""
+    oeste, sur, este, norte = limites
+    lado = 2 * ORIGEN_MERCATOR / 2 ** z
+    ultimo = 2 ** z - 1
+    x0 = min(max(math.floor((oeste + ORIGEN_MERCATOR) / lado), 0), ultimo)
+    x1 = min(max(math.ceil((este + ORIGEN_MERCATOR) / lado) - 1, 0), ultimo)
+    y0 = min(max(math.floor((ORIGEN_MERCATOR - norte) / lado), 0), ultimo)
+    y1 = min(max(math.ceil((ORIGEN_MERCATOR - sur) / lado) - 1, 0), ultimo)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def zoom_nativo(src):
+    """Nivel de zoom cuyo tamaño de píxel es el primero igual o menor que el del raster."""
+    oeste, sur, este, norte = transform_bounds(src.crs, CRS_TESELAS, *src.bounds, densify_pts=21)
+    resolucion = (este - oeste) / src.width
+    return max(0, math.ceil(math.log2(2 * ORIGEN_MERCATOR / (TAMANO_TESELA * resolucion))))
+
+
+class _RenderizadorTeselas:
+    """
+    Convierte teselas z/x/y del raster en arrays de gris + alfa, en dos pasos:
+    `leer` calcula la huella de los píxeles del raster bajo la tesela, y
+    `renderizar` reproyecta esa zona y la estira. Así una tesela cuya zona del
+    raster no ha cambiado se descarta antes de reproyectarla.
+
+    Cada hilo abre sus propios datasets, uno por nivel de overview usado, para
+    que las teselas de zoom bajo lean las overviews y no la resolución completa.
+    """
+
+    def __init__(self, ruta_raster, minimo, maximo):
+        self.ruta_raster = ruta_raster
+        self.minimo = minimo
+        self.maximo = maximo
+        self._local = threading.local()
+        self._abiertos = []
+        self._cerrojo = threading.Lock()
+        with rasterio.open(ruta_raster) as src:
+            self.resolucion = src.res[0]
+            self.crs = src.crs
+            self.factores_overview = src.overviews(1)
+
+    def _fuente(self, nivel):
+        fuentes = getattr(self._local, 'fuentes', None)
+        if fuentes is None:
+            fuentes = self._local.fuentes = {}
+        if nivel not in fuentes:
+            if nivel is None:
+                fuentes[nivel] = rasterio.open(self.ruta_raster)
+            else:
+                fuentes[nivel] = rasterio.open(self.ruta_raster, overview_level=nivel)
+            with self._cerrojo:
+                self._abiertos.append(fuentes[nivel])
+        return fuentes[nivel]
+
+    def _nivel_overview(self, limites):
+        # Resolución de la tesela expresada en el sistema del raster
+        oeste, _, este, _ = transform_bounds(CRS_TESELAS, self.crs, *limites)
+        factor = (este - oeste) / TAMANO_TESELA / self.resolucion
+        nivel = None
+        for i, factor_overview in enumerate(self.factores_overview):
+            if factor_overview <= factor:
+                nivel = i
+        return nivel
+
+    def _ventana(self, src, limites):
+        # Zona del raster (o de su overview) bajo la tesela, con margen y recortada al raster
+        oeste, sur, este, norte = transform_bounds(CRS_TESELAS, self.crs, *limites, densify_pts=21)
+        ventana = ventana_de_limites(oeste, sur, este, norte, transform=src.transform)
+        col_ini = max(0, math.floor(ventana.col_off) - MARGEN_VENTANA)
+        fila_ini = max(0, math.floor(ventana.row_off) - MARGEN_VENTANA)
+        col_fin = min(src.width, math.ceil(ventana.col_off + ventana.width) + MARGEN_VENTANA)
+        fila_fin = min(src.height, math.ceil(ventana.row_off + ventana.height) + MARGEN_VENTANA)
+        return Window(col_ini, fila_ini, max(0, col_fin - col_ini), max(0, fila_fin - fila_ini))
+
+    def leer(self, z, x, y):
+        """
+        Píxeles del raster bajo la tesela, sin reproyectar, y su huella.
+
+        La huella cambia si cambian esos píxeles, el nivel de overview, la
+        ventana leída o el estiramiento, es decir, siempre que cambiaría la tesela.
+        """
+        limites = limites_tesela(z, x, y)
+        nivel = self._nivel_overview(limites)
+        src = self._fuente(nivel)
+        ventana = self._ventana(src, limites)
+        if ventana.width and ventana.height:
+            datos = src.read(1, window=ventana)
+        else:
+            datos = np.empty((0, 0), dtype=src.dtypes[0])
+        huella = hashlib.blake2b(datos.tobytes(), digest_size=16)
+        huella.update(repr((nivel, tuple(ventana.flatten()), datos.dtype.str, src.nodata,
+                            float(self.minimo), float(self.maximo))).encode('utf-8'))
+        return huella.hexdigest(), (src, datos.size > 0)
+
+    def renderizar(self, z, x, y, lectura):
+        """Reproyecta a la tesela la zona leída por `leer` y la estira a gris + alfa."""
+        src, con_pixeles = lectura
+        limites = limites_tesela(z, x, y)
+        nodata = src.nodata if src.nodata is not None else np.nan
+
+        valores = np.full((TAMANO_TESELA, TAMANO_TESELA), np.nan, dtype=np.float32)
+        if con_pixeles:
+            # Se reproyecta desde la banda del dataset, que ya lleva su georreferencia (un array suelto
+            # provoca un NotGeoreferencedWarning por tesela); los bloques recién leídos por `leer` siguen
+            # en la caché de GDAL
+            reproject(
+                source=rasterio.band(src, 1),
+                destination=valores,
+                src_nodata=nodata,
+                dst_transform=from_bounds(*limites, TAMANO_TESELA, TAMANO_TESELA),
+                dst_crs=CRS_TESELAS,
+                dst_nodata=np.nan,
+                resampling=Resampling.nearest,
+            )
+
+        # Mismo estiramiento lineal que la imagen de mapa.py; los píxeles sin dato, transparentes
+        validos = np.isfinite(valores)
+        rango = self.maximo - self.minimo if self.maximo > self.minimo else 1
+        gris = np.zeros(valores.shape, dtype=np.uint8)
+        gris[validos] = np.clip((valores[validos] - self.minimo) / rango * 255, 0, 255).astype(np.uint8)
+        alfa = np.where(validos, 255, 0).astype(np.uint8)
+        return np.dstack([gris, alfa])
+
+    def cerrar(self):
+        with self._cerrojo:
+            for src in self._abiertos:
+                src.close()
+            self._abiertos.clear()
+
+
+def _leer_manifiesto(directorio):
+    try:
+        with open(os.path.join(directorio, NOMBRE_MANIFIESTO), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def generar_piramide(ruta_raster, directorio, minimo, maximo, zoom_min=8, zoom_max=None, workers=4):
+    """
+    Genera las teselas PNG z/x/y del raster en `directorio`, en paralelo.
+
+    Los valores se estiran linealmente entre `minimo` y `maximo` a gris y los
+    píxeles sin dato quedan transparentes. La generación es incremental: en
+    manifiesto.json se guarda la huella de los píxeles del raster bajo cada
+    tesela, y las teselas cuya huella no cambia respecto a la ejecución anterior
+    (p. ej. al pasar a otra fecha, las zonas sin dato o sin cambios) no se
+    reproyectan, codifican ni escriben. Para que se aprovechen entre fechas el
+    estiramiento tiene que ser el mismo (un rango fijo, no percentiles de cada
+    raster). Las teselas de la ejecución anterior que ya no forman parte de la
+    pirámide (otro rango de zoom u otra extensión del raster) se borran. Si el
+    raster y los parámetros son los mismos que la última vez no se lee nada.
+
+    Devuelve (zoom_min, zoom_max, teselas totales, teselas escritas).
+    """
+    with rasterio.open(ruta_raster) as src:
+        if zoom_max is None:
+            zoom_max = zoom_nativo(src)
+        limites = transform_bounds(src.crs, CRS_TESELAS, *src.bounds, densify_pts=21)
+
+    teselas = [(z, x, y) for z in range(zoom_min, zoom_max + 1) for x, y in teselas_que_cubren(limites, z)]
+    clave = clave_cache([ruta_raster], 'teselas_gris',
+                        {'minimo': float(minimo), 'maximo': float(maximo), 'zoom_min': zoom_min, 'zoom_max': zoom_max})
+
+    manifiesto = _leer_manifiesto(directorio)
+    resumen_anterior = manifiesto.get('teselas', {})
+    if manifiesto.get('clave') == clave and all(
+            os.path.exists(os.path.join(directorio, str(z), str(x), f'{y}.png')) for z, x, y in teselas):
+        return zoom_min, zoom_max, len(teselas), 0
+    resumen_nuevo = {}
+
+    renderizador = _RenderizadorTeselas(ruta_raster, minimo, maximo)
+
+    def procesar(tesela):
+        z, x, y = tesela
+        resumen, lectura = renderizador.leer(z, x, y)
+        ruta_png = os.path.join(directorio, str(z), str(x), f'{y}.png')
+        nombre = f'{z}/{x}/{y}'
+        if resumen_anterior.get(nombre) == resumen and os.path.exists(ruta_png):
+            return nombre, resumen, False
+        imagen = renderizador.renderizar(z, x, y, lectura)
+        os.makedirs(os.path.dirname(ruta_png), exist_ok=True)
+        Image.fromarray(imagen, mode='LA').save(ruta_png, format='PNG')
+        return nombre, resumen, True
+
+    escritas = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ejecutor:
+            for nombre, resumen, escrita in ejecutor.map(procesar, teselas):
+                resumen_nuevo[nombre] = resumen
+                escritas += escrita
+    finally:
+        renderizador.cerrar()
+
+    # Las teselas que ya no están en la pirámide no deben quedarse junto a las nuevas
+    for nombre in set(resumen_anterior) - set(resumen_nuevo):
+        z, x, y = nombre.split('/')
+        ruta_png = os.path.join(directorio, z, x, f'{y}.png')
+        if os.path.exists(ruta_png):
+            os.remove(ruta_png)
+        for carpeta in (os.path.join(directorio, z, x), os.path.join(directorio, z)):
+            if os.path.isdir(carpeta) and not os.listdir(carpeta):
+                os.rmdir(carpeta)
+
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, NOMBRE_MANIFIESTO), 'w', encoding='utf-8') as f:
+        json.dump({'clave': clave, 'zoom_min': zoom_min, 'zoom_max': zoom_max, 'teselas': resumen_nuevo}, f)
+
+    return zoom_min, zoom_max, len(teselas), escritas
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+from functools import partial
+
+import numpy as np
+import rasterio
+
+import bloques
+from cache import cargar_resultado, clave_cache, en_memoria, guardar_resultado
+
+# Estado de cada bloque en el índice de validez
+VACIO = 'vacio'    # todos los píxeles sin dato (nodata, NaN o clase SCL descartada)
+CEROS = 'ceros'    # sin dato o a cero en todas las entradas (fuera de la pasada del satélite)
+VALIDO = 'valido'  # al menos un píxel con dato
+
+# Clases de la banda SCL de Sentinel-2 L2A (Scene Classification)
+CLASES_SCL = {
+    0: 'sin dato', 1: 'saturado o defectuoso', 2: 'zona oscura', 3: 'sombra de nube', 4: 'vegetación',
+    5: 'suelo desnudo', 6: 'agua', 7: 'sin clasificar', 8: 'nube (prob. media)', 9: 'nube (prob. alta)',
+    10: 'cirro', 11: 'nieve',
+}
+
+# Por defecto solo se descartan los píxeles que la SCL marca como sin dato
+CLASES_SCL_SIN_DATO = (0,)
+
+
+def agregar_argumentos(parser, con_scl=True):
+    """Opciones de línea de comandos para saltarse los bloques sin datos."""
+    parser.add_argument('--omitir-vacios', action='store_true',
+                        help='No calcula ni escribe los bloques sin ningún píxel válido (quedan como NaN); '
+                             'el tiempo pasa a depender del área con datos y no del tile completo.')
+    if con_scl:
+        parser.add_argument('--clases-scl', nargs='+', type=int, choices=sorted(CLASES_SCL),
+                            default=list(CLASES_SCL_SIN_DATO),
+                            help='Clases de la banda SCL que cuentan como sin dato al decidir qué bloques se omiten '
+                                 '(por defecto 0; p. ej. 0 6 para omitir también los bloques solo de agua).')
+
+
+def _resumir_ventana(nodatas, clases_invalidas, datos):
+    """Cuenta los píxeles sin dato, a cero y válidos de una ventana de todas las entradas."""
+    sin_dato = None
+    ceros = None
+    for nombre, valores in datos.items():
+        if nombre == 'SCL':
+            continue
+        nulos = np.isnan(valores) if np.issubdtype(valores.dtype, np.floating) else np.zeros(valores.shape, bool)
+        if nodatas[nombre] is not None and not np.isnan(nodatas[nombre]):
+            nulos |= valores == nodatas[nombre]
+        # Solo en las bandas enteras (valores digitales L2A) el 0 es la zona sin datos; en los productos
+        # de coma flotante (SSI, NDVI...) 0 es un valor como otro cualquiera
+        a_cero = nulos | (valores == 0) if np.issubdtype(valores.dtype, np.integer) else nulos
+        # Un píxel solo deja de ser válido si lo es en todas las entradas
+        sin_dato = nulos if sin_dato is None else sin_dato & nulos
+        ceros = a_cero if ceros is None else ceros & a_cero
+    if 'SCL' in datos:
+        descartados = np.isin(datos['SCL'], clases_invalidas)
+        sin_dato = descartados if sin_dato is None else sin_dato | descartados
+        ceros = descartados if ceros is None else ceros | descartados
+    n_sin_dato = int(np.count_nonzero(sin_dato))
+    n_ceros = int(np.count_nonzero(ceros)) - n_sin_dato if ceros is not None else 0
+    return {'validos': sin_dato.size - n_sin_dato - n_ceros, 'sin_dato': n_sin_dato, 'ceros': n_ceros}
+
+
+def _estado(resumen):
+    if resumen['validos'] > 0:
+        return VALIDO
+    return CEROS if resumen['ceros'] > 0 else VACIO
+
+
+def indice_validez(rutas_entrada, lista_ventanas, rejilla_destino=None, ruta_scl=None,
+                   clases_scl=None, workers=1, usar_cache=True):
+    """
+    Resumen por bloque de qué ventanas tienen algún píxel válido.
+
+    Un píxel no es válido si en todas las entradas es nodata, NaN o, en las
+    bandas enteras, cero (en L2A, la zona fuera de la pasada del satélite), o si
+    la banda SCL `ruta_scl` lo clasifica en `clases_scl` (por defecto
+    CLASES_SCL_SIN_DATO). Devuelve una lista paralela a `lista_ventanas` con
+    {'estado', 'validos', 'sin_dato', 'ceros'}.
+
+    El índice se guarda en un JSON (validez_<hash>.json) junto a la primera
+    entrada y se reutiliza mientras no cambien las entradas ni las ventanas, así
+    que lo comparten todos los pasos que leen las mismas bandas.
+    """
+    clases_scl = CLASES_SCL_SIN_DATO if clases_scl is None else clases_scl
+    rutas = dict(rutas_entrada)
+    if ruta_scl is not None:
+        rutas['SCL'] = ruta_scl
+    nodatas = {}
+    for nombre, ruta in rutas.items():
+        with rasterio.open(ruta) as src:
+            nodatas[nombre] = src.nodata
+
+    descripcion_ventanas = [[v.col_off, v.row_off, v.width, v.height] for v in lista_ventanas]
+    parametros = {'ventanas': descripcion_ventanas, 'clases_scl': sorted(clases_scl) if ruta_scl else None}
+    primera = next(iter(rutas.values()))
+    ruta_json = None
+    if not any(en_memoria(ruta) for ruta in rutas.values()):
+        identificador = json.dumps([sorted(os.path.abspath(r) for r in rutas.values()), parametros], sort_keys=True)
+        resumen_id = hashlib.sha256(identificador.encode('utf-8')).hexdigest()[:12]
+        ruta_json = os.path.join(os.path.dirname(os.path.abspath(primera)), f'validez_{resumen_id}.json')
+        clave = clave_cache([rutas[nombre] for nombre in sorted(rutas)], 'indice_validez', parametros)
+        if usar_cache:
+            guardado = cargar_resultado(ruta_json, clave)
+            if guardado is not None:
+                return guardado
+
+    # La SCL (20 m) se lee remuestreada al vecino más cercano para no mezclar clases
+    resumenes = []
+    for _, resumen in bloques.resultados_por_ventana(rutas, partial(_resumir_ventana, nodatas, list(clases_scl)),
+                                                     lista_ventanas, workers=workers,
+                                                     rejilla_destino=rejilla_destino):
+        resumen['estado'] = _estado(resumen)
+        resumenes.append(resumen)
+
+    if ruta_json is not None:
+        guardar_resultado(ruta_json, clave, resumenes)
+    return resumenes
+
+
+def fraccion_valida(resumenes):
+    """Fracción de bloques con algún píxel válido (1.0 si no hay bloques)."""
+    if not resumenes:
+        return 1.0
+    return sum(resumen['estado'] == VALIDO for resumen in resumenes) / len(resumenes)
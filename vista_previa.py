@@ -0,0 +1,95 @@
+import numpy as np
+from matplotlib import colormaps, font_manager
+from PIL import Image, ImageDraw, ImageFont
+
+from bloques import leer_reducido
+from estadisticas import rango_estiramiento
+
+# Lado mayor, en píxeles, del mapa dentro de la vista previa
+LADO_VISTA = 1000
+
+# Número de colores de la tabla de la paleta; el índice extra es el de los píxeles sin dato
+NIVELES_PALETA = 256
+
+# Márgenes de la composición (píxeles)
+ALTO_TITULO = 40
+ANCHO_LEYENDA = 130
+ANCHO_BARRA = 24
+MARGEN = 12
+
+
+def tabla_colores(cmap):
+    """Tabla RGBA uint8 de la paleta de matplotlib, más una última entrada transparente para NaN."""
+    tabla = np.zeros((NIVELES_PALETA + 1, 4), dtype=np.uint8)
+    tabla[:NIVELES_PALETA] = colormaps[cmap](np.linspace(0, 1, NIVELES_PALETA), bytes=True)
+    return tabla
+
+
+def colorear(valores, cmap, vmin, vmax):
+    """
+    Convierte un array de valores en una imagen RGBA uint8 mediante la tabla de la paleta.
+
+    Como en `imshow`, los valores fuera de [vmin, vmax] se saturan y los NaN quedan transparentes.
+    """
+    valores = np.asarray(valores, dtype=np.float32)
+    escala = (NIVELES_PALETA - 1) / (vmax - vmin) if vmax > vmin else 0.0
+    niveles = np.empty(valores.shape, dtype=np.float32)
+    np.subtract(valores, vmin, out=niveles)
+    np.multiply(niveles, escala, out=niveles)
+    np.clip(niveles, 0, NIVELES_PALETA - 1, out=niveles)
+    np.copyto(niveles, NIVELES_PALETA, where=~np.isfinite(valores))
+    indices = np.rint(niveles, out=niveles).astype(np.uint16)
+    return tabla_colores(cmap)[indices]
+
+
+def _fuente(tamano):
+    # DejaVu Sans viene con matplotlib y, a diferencia de la fuente por defecto de PIL, tiene tildes
+    return ImageFont.truetype(font_manager.findfont('DejaVu Sans'), tamano)
+
+
+def guardar_vista_previa(ruta_raster, ruta_png, cmap, vmin=None, vmax=None, etiqueta='', titulo='',
+                         lado_maximo=LADO_VISTA, estiramiento=None):
+    """
+    Guarda un PNG con el mapa reducido, su barra de color y el título, sin pasar por pyplot.
+
+    El raster se lee diezmado (o desde sus overviews si las tiene), de modo que ni la
+    lectura ni la memoria dependen del tamaño de la escena. Con `estiramiento`
+    (percentiles inferior y superior), o si falta vmin o vmax, la escala sale de
+    las estadísticas guardadas junto al raster (por defecto entre los
+    percentiles 2 y 98), sin recorrerlo entero.
+    """
+    if estiramiento is not None:
+        vmin, vmax = rango_estiramiento(ruta_raster, *estiramiento)
+    elif vmin is None or vmax is None:
+        inferior, superior = rango_estiramiento(ruta_raster)
+        vmin = inferior if vmin is None else vmin
+        vmax = superior if vmax is None else vmax
+    mapa = colorear(leer_reducido(ruta_raster, lado_maximo), cmap, vmin, vmax)
+    alto, ancho = mapa.shape[:2]
+
+    lienzo = Image.new('RGBA', (ancho + ANCHO_LEYENDA + 2 * MARGEN, alto + ALTO_TITULO + 2 * MARGEN), 'white')
+    lienzo.alpha_composite(Image.fromarray(mapa, mode='RGBA'), (MARGEN, ALTO_TITULO + MARGEN))
+    dibujo = ImageDraw.Draw(lienzo)
+    fuente = _fuente(14)
+    if titulo:
+        dibujo.text((MARGEN + ancho // 2, MARGEN + ALTO_TITULO // 2), titulo, fill='black', font=_fuente(18), anchor='mm')
+
+    # Barra de color con la misma tabla que el mapa, de vmax (arriba) a vmin (abajo)
+    x_barra = MARGEN + ancho + MARGEN
+    y_barra = ALTO_TITULO + MARGEN
+    gradiente = tabla_colores(cmap)[np.linspace(NIVELES_PALETA - 1, 0, alto).astype(np.uint16)]
+    barra = np.repeat(gradiente[:, np.newaxis, :], ANCHO_BARRA, axis=1)
+    lienzo.alpha_composite(Image.fromarray(barra, mode='RGBA'), (x_barra, y_barra))
+    dibujo.rectangle((x_barra, y_barra, x_barra + ANCHO_BARRA - 1, y_barra + alto - 1), outline='black')
+    for fraccion in (0, 0.25, 0.5, 0.75, 1):
+        y = y_barra + round((1 - fraccion) * (alto - 1))
+        dibujo.line((x_barra + ANCHO_BARRA, y, x_barra + ANCHO_BARRA + 4, y), fill='black')
+        dibujo.text((x_barra + ANCHO_BARRA + 7, y), f'{vmin + fraccion * (vmax - vmin):g}', fill='black',
+                    font=fuente, anchor='lm')
+    if etiqueta:
+        texto = Image.new('RGBA', (alto, 20), (255, 255, 255, 0))
+        ImageDraw.Draw(texto).text((alto // 2, 10), etiqueta, fill='black', font=fuente, anchor='mm')
+        lienzo.alpha_composite(texto.rotate(90, expand=True), (x_barra + ANCHO_LEYENDA - 2 * MARGEN - 8, y_barra))
+
+    # Compresión PNG rápida: la vista previa es pequeña y codificarla no debe costar más que leerla
+    lienzo.convert('RGB').save(ruta_png, format='PNG', compress_level=1)
@@ -0,0 +1,209 @@
+import json
+import os
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.features import bounds as limites_geometria
+from rasterio.features import rasterize
+from rasterio.warp import transform_geom
+from rasterio.windows import transform as transformacion_ventana
+
+import muestreo
+from bloques import ventanas
+from cache import clave_cache, producto_vigente, registrar_producto
+
+# Código de los píxeles que no pertenecen a ninguna zona; las zonas se numeran desde 1
+SIN_ZONA = 0
+
+TIPOS_ZONAS = ('umbral', 'poligonos', 'raster')
+
+
+class ZonasUmbral:
+    """
+    Zonas separadas por umbrales de una coordenada del mapa.
+
+    Con umbrales [u1, u2, ...] y eje 'y', la primera zona son los píxeles con
+    y < u1, la segunda u1 <= y < u2, etc.; `nombres` tiene una zona más que
+    `umbrales`. Como en el cálculo original, la coordenada de cada píxel es la
+    de su esquina superior izquierda.
+    """
+
+    def __init__(self, nombres, umbrales, eje='y'):
+        if eje not in ('x', 'y'):
+            raise ValueError(f"Eje no válido: '{eje}' (opciones: x, y)")
+        if len(nombres) != len(umbrales) + 1:
+            raise ValueError(f"Con {len(umbrales)} umbrales hacen falta {len(umbrales) + 1} nombres de zona "
+                             f"(se recibieron {len(nombres)}).")
+        if list(umbrales) != sorted(umbrales):
+            raise ValueError("Los umbrales deben estar en orden creciente.")
+        self.nombres = list(nombres)
+        self.umbrales = np.asarray(umbrales, dtype=float)
+        self.eje = eje
+
+    def entradas(self):
+        return {}
+
+    def descripcion(self):
+        return {'tipo': 'umbral', 'eje': self.eje, 'umbrales': self.umbrales.tolist(), 'nombres': self.nombres}
+
+    def _codigos_coordenada(self, coordenada):
+        return np.digitize(coordenada, self.umbrales) + 1
+
+    def codigos(self, datos, ventana, transformacion):
+        """Código de zona de los píxeles de la ventana; solo se calculan las coordenadas de una fila o columna."""
+        filas = np.arange(ventana.row_off, ventana.row_off + ventana.height)
+        cols = np.arange(ventana.col_off, ventana.col_off + ventana.width)
+        if self.eje == 'y':
+            giro, paso, origen = transformacion.d, transformacion.e, transformacion.f
+            if giro == 0:
+                return self._codigos_coordenada(paso * filas + origen)[:, np.newaxis]
+        else:
+            giro, paso, origen = transformacion.b, transformacion.a, transformacion.c
+            if giro == 0:
+                return self._codigos_coordenada(paso * cols + origen)[np.newaxis, :]
+        # Raster girado: la coordenada depende de fila y columna (solo dentro de la ventana)
+        xs, ys = transformacion * (cols[np.newaxis, :], filas[:, np.newaxis])
+        return self._codigos_coordenada(ys if self.eje == 'y' else xs)
+
+    def zonas_de_puntos(self, xs, ys):
+        """Nombre de la zona de cada punto (mismas coordenadas que el mapa)."""
+        coordenada = np.asarray(ys if self.eje == 'y' else xs, dtype=float)
+        return [self.nombres[codigo - 1] for codigo in self._codigos_coordenada(coordenada)]
+
+
+class ZonasRaster:
+    """
+    Zonas leídas de un raster de etiquetas con la misma malla que el mapa.
+
+    El píxel con valor i (1, 2, ...) pertenece a la zona nombres[i - 1]; el 0 y
+    cualquier otro valor quedan sin zona.
+    """
+
+    def __init__(self, ruta_etiquetas, nombres):
+        self.ruta_etiquetas = ruta_etiquetas
+        self.nombres = list(nombres)
+
+    def entradas(self):
+        return {'ZONA': self.ruta_etiquetas}
+
+    def descripcion(self):
+        return {'tipo': 'raster', 'nombres': self.nombres}
+
+    def codigos(self, datos, ventana, transformacion):
+        etiquetas = datos['ZONA']
+        return np.where((etiquetas >= 1) & (etiquetas <= len(self.nombres)), etiquetas, SIN_ZONA).astype(np.intp)
+
+    def zonas_de_puntos(self, xs, ys):
+        etiquetas = muestreo.muestrear(self.ruta_etiquetas, xs, ys)
+        return [self.nombres[int(e) - 1] if np.isfinite(e) and 1 <= e <= len(self.nombres) else None
+                for e in etiquetas]
+
+
+def _leer_vector(ruta_vector, campo):
+    """Devuelve (lista de (geometría, valor del campo), CRS) de un archivo vectorial."""
+    if ruta_vector.lower().endswith(('.geojson', '.json')):
+        with open(ruta_vector, encoding='utf-8') as f:
+            coleccion = json.load(f)
+        # GeoJSON sin miembro 'crs' está en WGS84 (RFC 7946)
+        crs = CRS.from_user_input(coleccion.get('crs', {}).get('properties', {}).get('name', 'EPSG:4326'))
+        entidades = [(entidad['geometry'], entidad['properties'][campo])
+                     for entidad in coleccion['features'] if entidad.get('geometry')]
+        return entidades, crs
+
+    # Shapefile, GeoPackage, etc. necesitan fiona
+    try:
+        import fiona
+    except ImportError:
+        raise ImportError(f"Para leer '{ruta_vector}' hace falta fiona (o conviértelo a GeoJSON).")
+    with fiona.open(ruta_vector) as capa:
+        crs = CRS.from_user_input(capa.crs_wkt)
+        entidades = [(dict(entidad['geometry']), entidad['properties'][campo])
+                     for entidad in capa if entidad['geometry'] is not None]
+    return entidades, crs
+
+
+def zonas_poligonos(ruta_vector, campo, ruta_referencia, nombres=None, directorio=None):
+    """
+    Zonas definidas por polígonos; el valor de `campo` de cada polígono es el nombre de su zona.
+
+    Los polígonos se rasterizan una sola vez sobre la malla de `ruta_referencia`,
+    ventana a ventana, en un raster de etiquetas que se guarda en `directorio`
+    (por defecto, junto al raster de referencia). Mientras no cambien el archivo
+    vectorial ni la malla se reutiliza. Si dos polígonos se solapan, manda el último.
+    """
+    entidades, crs_vector = _leer_vector(ruta_vector, campo)
+    if nombres is None:
+        nombres = sorted({str(valor) for _, valor in entidades})
+    codigo_de = {nombre: i + 1 for i, nombre in enumerate(nombres)}
+
+    with rasterio.open(ruta_referencia) as ref:
+        malla = {'crs': ref.crs.to_string(), 'transform': list(ref.transform)[:6],
+                 'ancho': ref.width, 'alto': ref.height}
+        nombre_base = os.path.splitext(os.path.basename(ruta_vector))[0]
+        directorio = directorio or os.path.dirname(os.path.abspath(ruta_referencia))
+        clave = clave_cache([ruta_vector], 'rasterizar_zonas', {'campo': campo, 'nombres': nombres, 'malla': malla})
+        ruta_etiquetas = os.path.join(directorio, f'zonas_{nombre_base}_{clave[:12]}.tif')
+        if producto_vigente(ruta_etiquetas, clave):
+            return ZonasRaster(ruta_etiquetas, nombres)
+
+        # Geometrías en el sistema del mapa, con su caja para descartar las que no tocan cada ventana
+        formas = []
+        for geometria, valor in entidades:
+            if str(valor) not in codigo_de:
+                continue
+            if crs_vector != ref.crs:
+                geometria = transform_geom(crs_vector, ref.crs, geometria)
+            formas.append((geometria, codigo_de[str(valor)]))
+        # Con miles de parcelas el filtro por ventana se hace sobre un array de cajas (oeste, sur, este, norte)
+        cajas = np.array([limites_geometria(g) for g, _ in formas], dtype=float).reshape(-1, 4)
+
+        dtype = 'uint8' if len(nombres) < 2 ** 8 else 'uint16' if len(nombres) < 2 ** 16 else 'uint32'
+        perfil = {'driver': 'GTiff', 'dtype': dtype, 'count': 1, 'width': ref.width, 'height': ref.height,
+                  'crs': ref.crs, 'transform': ref.transform, 'nodata': SIN_ZONA, 'compress': 'DEFLATE',
+                  'tiled': True, 'blockxsize': 512, 'blockysize': 512}
+        with rasterio.open(ruta_etiquetas, 'w', **perfil) as dst:
+            for ventana in ventanas(dst):
+                transformacion = transformacion_ventana(ventana, ref.transform)
+                oeste, norte = transformacion * (0, 0)
+                este, sur = transformacion * (ventana.width, ventana.height)
+                oeste, este = min(oeste, este), max(oeste, este)
+                sur, norte = min(sur, norte), max(sur, norte)
+                en_ventana = [formas[i] for i in np.flatnonzero(
+                    (cajas[:, 0] <= este) & (cajas[:, 2] >= oeste) & (cajas[:, 1] <= norte) & (cajas[:, 3] >= sur))]
+                if not en_ventana:
+                    continue  # Los bloques no escritos valen 0 (sin zona)
+                etiquetas = rasterize(en_ventana, out_shape=(ventana.height, ventana.width),
+                                      transform=transformacion, fill=SIN_ZONA, dtype=dtype)
+                dst.write(etiquetas, 1, window=ventana)
+
+    registrar_producto(ruta_etiquetas, clave)
+    return ZonasRaster(ruta_etiquetas, nombres)
+
+
+def agregar_argumentos(parser):
+    """Opciones de línea de comandos para definir las zonas de calibración."""
+    parser.add_argument('--zonas', choices=TIPOS_ZONAS, default='umbral',
+                        help="Cómo se definen las zonas: por 'umbral' de una coordenada, por 'poligonos' de un "
+                             "archivo vectorial o con un 'raster' de etiquetas.")
+    parser.add_argument('--nombres-zonas', nargs='+', default=None,
+                        help='Nombres de las zonas (umbral: de menor a mayor coordenada; raster: valores 1, 2, ...).')
+    parser.add_argument('--eje', choices=('x', 'y'), default='y', help='Coordenada que separan los umbrales.')
+    parser.add_argument('--umbrales', nargs='+', type=float, default=None,
+                        help='Valores de la coordenada que separan las zonas, en orden creciente.')
+    parser.add_argument('--vector-zonas', default=None, help='Archivo vectorial con los polígonos de las zonas.')
+    parser.add_argument('--campo-zona', default='ubicacion', help='Campo del vectorial con el nombre de la zona.')
+    parser.add_argument('--raster-zonas', default=None, help='Raster de etiquetas de zona (misma malla que el mapa).')
+
+
+def zonas_desde_argumentos(args, ruta_referencia, nombres_defecto, umbrales_defecto):
+    """Construye la definición de zonas a partir de las opciones de `agregar_argumentos`."""
+    if args.zonas == 'umbral':
+        return ZonasUmbral(args.nombres_zonas or nombres_defecto, args.umbrales or umbrales_defecto, args.eje)
+    if args.zonas == 'poligonos':
+        if not args.vector_zonas:
+            raise ValueError("Con --zonas poligonos hay que indicar --vector-zonas.")
+        return zonas_poligonos(args.vector_zonas, args.campo_zona, ruta_referencia, args.nombres_zonas)
+    if not args.raster_zonas:
+        raise ValueError("Con --zonas raster hay que indicar --raster-zonas.")
+    return ZonasRaster(args.raster_zonas, args.nombres_zonas or nombres_defecto)